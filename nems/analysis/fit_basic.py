@@ -3,6 +3,8 @@ import logging
 import time
 from functools import partial
 
+import numpy as np
+
 from nems.analysis.cost_functions import basic_cost
 from nems.fitters.api import scipy_minimize
 import nems.priors
@@ -78,8 +80,10 @@ def fit_basic(data, modelspec,
     #    .bounds(modelspec) -> fitspace_bounds
     packer, unpacker, pack_bounds = mapper(modelspec)
 
-    # A function to evaluate the modelspec on the data
-    evaluator = nems.modelspec.evaluate
+    # A function to evaluate the modelspec on the data. It works on plain
+    # arrays if every module has an array-level kernel, and only evaluates
+    # modules from the first one whose parameters changed.
+    evaluator = ms.fit_evaluator(data, modelspec)
 
     my_cost_function = cost_function
     my_cost_function.counter = 0
@@ -98,6 +102,7 @@ def fit_basic(data, modelspec,
 
     # Results should be a list of modelspecs
     # (might only be one in list, but still should be packaged as a list)
+    fit_kwargs = _fit_kwargs_for_precision(data, fitter, fit_kwargs)
     improved_sigma = fitter(sigma, cost_fn, bounds=bounds, **fit_kwargs)
     improved_modelspec = unpacker(improved_sigma)
 
@@ -115,6 +120,26 @@ def fit_basic(data, modelspec,
     return results
 
 
+def _fit_kwargs_for_precision(data, fitter, fit_kwargs):
+    '''
+    scipy_minimize estimates gradients by finite differences with a step of
+    1e-8, which is below the resolution of float32 predictions and stalls
+    the fit. If any signal in data is float32, use a step of sqrt(float32
+    eps) instead, unless fit_kwargs already chooses one.
+    '''
+    if fitter is not scipy_minimize:
+        return fit_kwargs
+    options = fit_kwargs.get('options', {})
+    if 'eps' in options:
+        return fit_kwargs
+    single = any(isinstance(getattr(s, '_data', None), np.ndarray) and
+                 s._data.dtype == np.float32 for s in data.signals.values())
+    if not single:
+        return fit_kwargs
+    options = {**options, 'eps': float(np.sqrt(np.finfo(np.float32).eps))}
+    return {**fit_kwargs, 'options': options}
+
+
 def fit_random_subsets(data, modelspec, nsplits=1, rebuild_every=10000):
     '''
     Randomly picks a small fraction of the data to fit on.
@@ -7,6 +7,7 @@ import numpy as np
 
 from nems.fitters.api import coordinate_descent
 from nems.analysis.cost_functions import basic_cost
+from nems.analysis.fit_basic import _fit_kwargs_for_precision
 import nems.fitters.mappers
 import nems.metrics.api
 import nems.modelspec as ms
@@ -59,6 +60,7 @@ def fit_module_sets(
 
     if invert:
         module_sets = _invert_subsets(modelspec, module_sets)
+    evaluator = _default_evaluator(data, modelspec, evaluator)
 
     ms.fit_mode_on(modelspec)
     start_time = time.time()
@@ -82,6 +84,16 @@ def fit_module_sets(
     return results
 
 
+def _default_evaluator(data, modelspec, evaluator):
+    '''
+    The default evaluator is replaced by nems.modelspec.fit_evaluator, which
+    skips modules upstream of the ones being fit.
+    '''
+    if evaluator is ms.evaluate:
+        return ms.fit_evaluator(data, modelspec)
+    return evaluator
+
+
 def _invert_subsets(modelspec, module_sets):
     inverted = []
     for subset in module_sets:
@@ -112,6 +124,7 @@ def _module_set_loop(subset, data, modelspec, cost_function, fitter,
         sigma = packer(modelspec)
         bounds = pack_bounds(modelspec)
 
+        fit_kwargs = _fit_kwargs_for_precision(data, fitter, fit_kwargs)
         improved_sigma = fitter(sigma, cost_fn, bounds=bounds, **fit_kwargs)
         improved_modelspec = unpacker(improved_sigma)
 
@@ -188,6 +201,7 @@ def fit_iteratively(
             log.debug('Phi not found for module, using mean of prior: {}'
                       .format(m))
             modelspec[i] = m
+    evaluator = _default_evaluator(data, modelspec, evaluator)
 
     error = np.inf
     for tol in tolerances:
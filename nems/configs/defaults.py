@@ -44,6 +44,43 @@ NEMS_LOG_FILE_LEVEL = 'DEBUG'
 NEMS_LOG_CONSOLE_LEVEL = 'DEBUG'
 
 
+################################################################################
+# Numerical precision
+################################################################################
+# dtype that load_recording casts floating point signal data to. 'float32'
+# halves memory use and bandwidth; metrics still accumulate in float64.
+NEMS_SIGNAL_DTYPE = 'float64'
+
+
+################################################################################
+# HTTP connections
+################################################################################
+# Number of keep-alive connections kept open per host by the shared session.
+NEMS_HTTP_POOL_SIZE = 10
+
+# How many times a failed request (connection error or 5xx) is retried.
+NEMS_HTTP_RETRIES = 3
+
+# Retries wait NEMS_HTTP_BACKOFF * 2**(retry number) seconds.
+NEMS_HTTP_BACKOFF = 0.5
+
+
+################################################################################
+# Remote resource cache
+################################################################################
+# Folder where recordings and modelspecs fetched over HTTP are cached. Set to
+# None to disable the cache and always go to the network.
+NEMS_CACHE_DIR = '/tmp/nems/cache'
+
+# Maximum size of the cache in bytes; least recently used entries are evicted
+# once it grows past this.
+NEMS_CACHE_MAX_BYTES = 10 * 1024**3
+
+# Seconds a cached entry is trusted without asking the server whether it
+# changed (via ETag / Last-Modified). 0 means always revalidate.
+NEMS_CACHE_MAX_AGE = 0
+
+
 ################################################################################
 # Plugins Registries
 ################################################################################
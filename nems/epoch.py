@@ -1,6 +1,7 @@
 from functools import wraps
 import re
 import warnings
+import weakref
 
 import numpy as np
 import pandas as pd
@@ -20,38 +21,55 @@ def check_result(f):
     return wrapper
 
 
+def _follow_chain(nxt):
+    '''
+    Given nxt[i] > i, the index visited after i (len(nxt) meaning stop),
+    returns a boolean mask of the indices visited starting from 0. Uses
+    pointer doubling, so it takes O(n log n) time without a Python loop
+    over the chain.
+    '''
+    n = len(nxt)
+    jump = np.append(nxt, n)
+    visited = np.zeros(n + 1, dtype=bool)
+    visited[0] = True
+    step = 1
+    while step <= n:
+        visited[jump[visited]] = True
+        jump = jump[jump]
+        step *= 2
+    return visited[:n]
+
+
 def remove_overlap(a):
     '''
     Remove overlapping occurences by taking the first occurence
     '''
-    a = a.copy()
-    a.sort(axis=0)
-    i = 0
+    a = np.sort(a, axis=0)
     n = len(a)
-    trimmed = []
-    while i < n:
-        lb, ub = a[i]
-        i += 1
-        trimmed.append((lb, ub))
-        while (i < n) and (ub > a[i, 0]):
-            i += 1
-    return np.array(trimmed)
+    if n == 0:
+        return np.array([])
+    lb, ub = a[:, 0], a[:, 1]
+
+    # After keeping occurrence i, the next one kept is the first that starts
+    # at or after ub[i]
+    nxt = np.searchsorted(lb, ub, side='left')
+    nxt = np.maximum(nxt, np.arange(1, n+1))
+    nxt[np.isnan(ub)] = np.arange(1, n+1)[np.isnan(ub)]
+    return a[_follow_chain(nxt)]
 
 
 def merge_epoch(a):
-    a = a.copy()
-    a.sort(axis=0)
-    i = 0
+    a = np.sort(a, axis=0)
     n = len(a)
-    merged = []
-    while i < n:
-        lb, ub = a[i]
-        i += 1
-        while (i < n) and (ub >= a[i, 0]):
-            ub = a[i, 1]
-            i += 1
-        merged.append((lb, ub))
-    return np.array(merged)
+    if n == 0:
+        return np.array([])
+    lb, ub = a[:, 0], a[:, 1]
+
+    # A merged occurrence ends wherever the next start is past the end of the
+    # occurrence before it
+    first = np.flatnonzero(np.r_[True, ~(ub[:-1] >= lb[1:])])
+    last = np.r_[first[1:] - 1, n - 1]
+    return np.stack([lb[first], ub[last]], axis=1)
 
 
 def epoch_union(a, b):
@@ -196,23 +214,50 @@ def epoch_difference(a, b):
     return np.array(difference)
 
 
+def _sorted_rows(a):
+    '''
+    Rows of a sorted by start and then end time.
+    '''
+    return a[np.lexsort((a[:, 1], a[:, 0]))]
+
+
+def _spanned(lb, ub, b):
+    '''
+    For each pair of lb and ub, whether some occurrence of b starts at or
+    before lb and ends at or after ub.
+    '''
+    b = np.asarray(b).reshape(-1, 2)
+    b = b[b[:, 0] == b[:, 0]]
+    order = np.argsort(b[:, 0], kind='stable')
+    starts = b[order, 0]
+    # furthest end reached by any occurrence starting at or before each start
+    reach = np.fmax.accumulate(b[order, 1])
+    k = np.searchsorted(starts, lb, side='right')
+    found = k > 0
+    result = np.zeros(np.shape(lb), dtype=bool)
+    result[found] = reach[k[found] - 1] >= ub[found]
+    return result
+
+
+def _any_between(x, lb, ub):
+    '''
+    For each pair of lb and ub, whether any value of x lies in [lb, ub].
+    '''
+    x = np.sort(x[x == x])
+    count = (np.searchsorted(x, ub, side='right') -
+             np.searchsorted(x, lb, side='left'))
+    return (count > 0) & (lb <= ub)
+
+
 def epoch_intersection_full(a, b):
     """
     returns all epoch times a that are fully spanned by epoch
     times in b
     """
-    a = a.copy().tolist()
-    a.sort()
-    b = b.copy().tolist()
-    b.sort()
-    intersection = []
-    for lb, ub in a:
-        for lb_b, ub_b in b:
-            if lb >= lb_b and ub <= ub_b:
-                intersection.append([lb, ub])
-                break
-
-    result = np.array(intersection)
+    a = _sorted_rows(np.asarray(a).reshape(-1, 2))
+    result = a[_spanned(a[:, 0], a[:, 1], b)]
+    if len(result) == 0:
+        return np.array([])
     return result
 
 
@@ -245,24 +290,91 @@ def epoch_intersection(a, b, precision=6):
     b:      [   ]       [ ]     []      [    ]
     result:  [  ]       [ ]             []
     '''
-    # Convert to a list and then sort in reversed order such that pop() walks
-    # through the occurences from earliest in time to latest in time.
     a = np.around(a, precision)
     b = np.around(b, precision)
+    if len(a)==0 or len(b)==0:
+        # lists are empty, just exit
+        return np.array([])
+
+    sorted_a = _sorted_rows(a)
+    sorted_b = _sorted_rows(b)
+    if not (_is_disjoint(sorted_a) and _is_disjoint(sorted_b)):
+        return _epoch_intersection_walk(a, b)
+    return _epoch_intersection_sweep(sorted_a, sorted_b)
+
+
+def _is_disjoint(a):
+    '''
+    True if the sorted occurrences in a all have positive length and do not
+    overlap (they may touch).
+    '''
+    return bool(np.all(a[:, 0] < a[:, 1]) and np.all(a[1:, 0] >= a[:-1, 1]))
+
+
+def _epoch_intersection_sweep(a, b):
+    '''
+    epoch_intersection for sorted, disjoint a and b, vectorized. Gives
+    exactly what _epoch_intersection_walk does for such input, including
+    its habit of keeping an occurrence of a whole when it starts inside an
+    occurrence of b.
+    '''
+    lb, ub = a[:, 0], a[:, 1]
+    lb_b, ub_b = b[:, 0], b[:, 1]
+    nb = len(b)
+
+    # The walk compares each occurrence of a with the first occurrence of b
+    # that has not ended before it starts. That is j0, unless the occurrence
+    # of b ending exactly at lb was already used up by the occurrence of a
+    # just before (touching at lb), in which case it is j1.
+    j0 = np.searchsorted(ub_b, lb, side='left')
+    j1 = np.searchsorted(ub_b, lb, side='right')
+    touching = np.r_[False, ub[:-1] == lb[1:]]
+    pinned = j1 > j0
+
+    # "sweep": a starts at or before that occurrence of b, so every b inside
+    # a is kept, plus the part of the b that a ends in. Otherwise a is kept
+    # whole. Whether a pinned, touching occurrence sweeps depends on
+    # whether the one before it did, so carry that forward.
+    sweep = (j0 < nb) & (lb_b[np.minimum(j0, nb-1)] >= lb)
+    inherit = pinned & touching
+    source = np.maximum.accumulate(np.where(inherit, 0, np.arange(len(a))))
+    sweep = sweep[source]
+    j = np.where(touching & np.r_[False, sweep[:-1]], j1, j0)
+    whole = ~sweep & (j < nb)
+
+    k = np.searchsorted(ub_b, ub, side='right')
+    inside = np.where(sweep, k - j, 0)
+    partial = sweep & (k < nb) & (lb_b[np.minimum(k, nb-1)] < ub)
+    count = whole + inside + partial
+    if count.sum() == 0:
+        return np.array([])
+
+    result = np.empty((count.sum(), 2), dtype=np.result_type(a, b))
+    offset = np.cumsum(count) - count
+    result[offset[whole]] = a[whole]
+    n_inside = inside.sum()
+    first = np.cumsum(inside) - inside
+    step = np.arange(n_inside) - np.repeat(first, inside)
+    result[np.repeat(offset, inside) + step] = b[np.repeat(j, inside) + step]
+    result[offset[partial] + inside[partial]] = np.stack(
+        [lb_b[k[partial]], ub[partial]], axis=1)
+    return result
+
+
+def _epoch_intersection_walk(a, b):
+    '''
+    epoch_intersection for any a and b, one pair of occurrences at a time.
+    '''
+    # Convert to a list and then sort in reversed order such that pop() walks
+    # through the occurences from earliest in time to latest in time.
     a = a.tolist()
     a.sort(reverse=True)
     b = b.tolist()
     b.sort(reverse=True)
 
     intersection = []
-    if len(a)==0 or len(b)==0:
-        # lists are empty, just exit
-        result = np.array([])
-        return result
-
     lb, ub = a.pop()
     lb_b, ub_b = b.pop()
-
     while True:
         if lb > ub_b:
             #           [ a ]
@@ -344,16 +456,6 @@ def epoch_intersection(a, b, precision=6):
     return result
 
 
-def _epoch_contains_mask(a, b):
-    '''
-    3d array. 1st dimension is index in a. Second dimension is index in b. Third
-    dimension is whether start (index 0) or end (index 1) in b falls within the
-    corresponding epoch in a.
-    '''
-    mask = [(b >= lb) & (b <= ub) for lb, ub in a]
-    return np.concatenate([m[np.newaxis] for m in mask], axis=0)
-
-
 def epoch_contains(a, b, mode):
     '''
     Tests whether an occurence of a contains an occurence of b.
@@ -379,20 +481,34 @@ def epoch_contains(a, b, mode):
         Boolean mask indicating whether the corresponding entry in a meets the
         test criteria.
     '''
-    mask = _epoch_contains_mask(a, b)
+    a = np.asarray(a).reshape(-1, 2)
+    b = np.asarray(b).reshape(-1, 2)
+    lb, ub = a[:, 0], a[:, 1]
     if mode == 'start':
-        return mask[:, :, 0].any(axis=1)
+        return _any_between(b[:, 0], lb, ub)
     elif mode == 'end':
-        return mask[:, :, 1].any(axis=1)
+        return _any_between(b[:, 1], lb, ub)
     elif mode == 'both':
-        return mask.all(axis=2).any(axis=1)
+        # b is inside a when its earlier bound is at or after lb and its
+        # later one at or before ub. Among the b whose earlier bound is at or
+        # after lb, look at the smallest later bound.
+        b_lb, b_ub = np.minimum(b[:, 0], b[:, 1]), np.maximum(b[:, 0], b[:, 1])
+        keep = b_lb == b_lb
+        order = np.argsort(b_lb[keep], kind='stable')
+        b_lb = b_lb[keep][order]
+        nearest = np.minimum.accumulate(b_ub[keep][order][::-1])[::-1]
+        k = np.searchsorted(b_lb, lb, side='left')
+        found = k < len(b_lb)
+        result = np.zeros(len(a), dtype=bool)
+        result[found] = nearest[k[found]] <= ub[found]
+        return result
     elif mode == 'any':
-        b_in_a = mask.any(axis=2).any(axis=1)
-        # This mask will not capture situations where an occurence of a is fully
-        # contained in an occurence of b. To test for this, we can flip the
-        # epochs and build a new mask to perform this special-case test.
-        mask = _epoch_contains_mask(b, a)
-        a_in_b = mask.any(axis=2).any(axis=0)
+        b_in_a = (_any_between(b[:, 0], lb, ub) |
+                  _any_between(b[:, 1], lb, ub))
+        # This does not capture situations where an occurence of a is fully
+        # contained in an occurence of b, so also test whether either bound
+        # of a falls inside b.
+        a_in_b = _spanned(lb, lb, b) | _spanned(ub, ub, b)
         return b_in_a | a_in_b
 
 
@@ -400,8 +516,9 @@ def epoch_contained(a, b):
     '''
     Tests whether an occurence of a is fully contained inside b
     '''
-    mask = _epoch_contains_mask(b, a)
-    return mask.all(axis=2).any(axis=0)
+    a = np.asarray(a).reshape(-1, 2)
+    lb, ub = np.minimum(a[:, 0], a[:, 1]), np.maximum(a[:, 0], a[:, 1])
+    return _spanned(lb, ub, b)
 
 
 def adjust_epoch_bounds(a, pre=0, post=0):
@@ -460,6 +577,394 @@ def epoch_names_matching(epochs, regex_str):
     return matches
 
 
+# DataFrames handed out by EpochTable.to_dataframe(), by id, so that passing
+# one back (e.g. RasterizedSignal(..., epochs=sig.epochs)) reuses the table
+# instead of encoding the DataFrame again.
+_tables_by_frame = weakref.WeakValueDictionary()
+
+
+def _read_only(a):
+    a.flags.writeable = False
+    return a
+
+
+class EpochTable:
+    '''
+    Immutable, array-backed epochs: float64 start and end times plus int32
+    codes into a list of names. Tables derived from one another share the
+    list of names, which is only ever appended to. Any columns besides
+    start, end and name are kept as they are.
+
+    to_dataframe() gives the usual epochs DataFrame, built once per table.
+    Do not modify that DataFrame in place.
+    '''
+    def __init__(self, start, end, codes, names, columns=None, extra=None):
+        self.start = _read_only(np.array(start, dtype=np.float64))
+        self.end = _read_only(np.array(end, dtype=np.float64))
+        self.codes = _read_only(np.array(codes, dtype=np.int32))
+        self.names = names
+        if columns is None:
+            columns = ['start', 'end', 'name']
+        self.columns = tuple(columns)
+        self.extra = extra or {}
+        self._frame = None
+
+    @classmethod
+    def from_dataframe(cls, epochs, names=None):
+        '''
+        Encodes an epochs DataFrame. If names is given, codes refer to it and
+        any new names are appended to it.
+        '''
+        if names is None:
+            names = []
+        lookup = {n: i for i, n in enumerate(names)}
+        values, uniques = pd.factorize(epochs['name'])
+        uniques = list(uniques)
+        if (values < 0).any():
+            # missing names get a code of their own
+            values = np.where(values < 0, len(uniques), values)
+            uniques.append(np.nan)
+        for n in uniques:
+            if n not in lookup:
+                lookup[n] = len(names)
+                names.append(n)
+        recode = np.array([lookup[n] for n in uniques], dtype=np.int32)
+        extra = {c: epochs[c].values for c in epochs.columns
+                 if c not in ('start', 'end', 'name')}
+        return cls(epochs['start'].values, epochs['end'].values,
+                   recode[values], names, epochs.columns, extra)
+
+    @classmethod
+    def of(cls, epochs, names=None):
+        '''
+        Returns epochs as an EpochTable: tables and None are returned as they
+        are, and a DataFrame made by to_dataframe() maps back to its table.
+        '''
+        if epochs is None or isinstance(epochs, EpochTable):
+            return epochs
+        table = _tables_by_frame.get(id(epochs))
+        if table is not None and table._frame is epochs:
+            return table
+        return cls.from_dataframe(epochs, names)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_frame'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for key in ['start', 'end', 'codes']:
+            _read_only(getattr(self, key))
+
+    @property
+    def name(self):
+        '''
+        The name of each epoch, as an object array.
+        '''
+        names = np.empty(len(self.names), dtype=object)
+        names[:] = self.names
+        return names[self.codes]
+
+    def max_end(self):
+        '''
+        Latest end time, ignoring NaN (NaN if there are no epochs).
+        '''
+        end = self.end[~np.isnan(self.end)]
+        return end.max() if len(end) else np.nan
+
+    def recoded(self, names):
+        '''
+        Returns the same epochs with codes into names, appending any of this
+        table's names that are missing from it.
+        '''
+        if names is self.names:
+            return self
+        lookup = {n: i for i, n in enumerate(names)}
+        for n in self.names:
+            if n not in lookup:
+                lookup[n] = len(names)
+                names.append(n)
+        recode = np.array([lookup[n] for n in self.names], dtype=np.int32)
+        return EpochTable(self.start, self.end, recode[self.codes], names,
+                          self.columns, self.extra)
+
+    def equals(self, other):
+        '''
+        True if other holds the same epochs, whatever names list it codes
+        into.
+        '''
+        if other is self:
+            return True
+        if (not isinstance(other, EpochTable) or len(other) != len(self) or
+                other.columns != self.columns):
+            return False
+        if not (np.array_equal(self.start, other.start, equal_nan=True) and
+                np.array_equal(self.end, other.end, equal_nan=True)):
+            return False
+        if other.names is self.names:
+            same_names = np.array_equal(self.codes, other.codes)
+        else:
+            # translate our codes into other's names; -1 where it lacks one
+            lookup = {n: i for i, n in enumerate(other.names)}
+            recode = np.array([lookup.get(n, -1) for n in self.names] + [-1],
+                              dtype=np.int32)
+            same_names = np.array_equal(recode[self.codes], other.codes)
+        return same_names and all(
+            pd.Series(v).equals(pd.Series(other.extra[k]))
+            for k, v in self.extra.items())
+
+    def to_dataframe(self):
+        '''
+        Returns the epochs as a DataFrame with a default index.
+        '''
+        if self._frame is None:
+            data = dict(self.extra, start=self.start.copy(),
+                        end=self.end.copy(), name=self.name)
+            self._frame = pd.DataFrame({c: data[c] for c in self.columns})
+            _tables_by_frame[id(self._frame)] = self
+        return self._frame
+
+
+class EpochIndex:
+    '''
+    Lookup table over an EpochTable (or epochs DataFrame) for a given
+    sampling rate. The bounds of each epoch name, rounded to the nearest
+    sample, are stored together and sorted by start time, so that fetching
+    them does not scan the whole table.
+
+    The index is immutable and the arrays it returns are read-only.
+    '''
+    def __init__(self, epochs, fs):
+        epochs = EpochTable.of(epochs)
+        codes = epochs.codes
+        bounds = np.stack([epochs.start, epochs.end], axis=1)
+        bounds = np.round(bounds * fs) / fs
+
+        order = np.lexsort((bounds[:, 1], bounds[:, 0], codes))
+        codes = codes[order]
+        self._bounds = bounds[order]
+        self._bounds.flags.writeable = False
+        # rows of name code i are _bounds[_offsets[i]:_offsets[i+1]]
+        self._offsets = np.searchsorted(codes,
+                                        np.arange(len(epochs.names) + 1))
+        # only the names that occur; the names list may be shared
+        present = np.flatnonzero(np.diff(self._offsets))
+        self._codes = {epochs.names[i]: i for i in present}
+        self._matches = {}
+
+    @property
+    def names(self):
+        return list(self._codes)
+
+    def bounds(self, name):
+        '''
+        Returns the (M x 2) rounded bounds of every occurrence of name.
+        '''
+        i = self._codes.get(name)
+        if i is None:
+            return self._bounds[:0]
+        return self._bounds[self._offsets[i]:self._offsets[i+1]]
+
+    def names_matching(self, regex_str):
+        '''
+        Same as epoch_names_matching, memoized per regex.
+        '''
+        matches = self._matches.get(regex_str)
+        if matches is None:
+            r = re.compile(regex_str)
+            matches = sorted(n for n in self._codes
+                             if isinstance(n, str) and r.match(n))
+            self._matches[regex_str] = matches
+        return list(matches)
+
+
+class IntervalMask:
+    '''
+    Boolean mask over ntimes samples, stored as the sorted, disjoint
+    [start, end) sample intervals where it is True. Adjacent intervals are
+    always merged, so two masks are equal exactly when their intervals are.
+
+    Union (|), intersection (&) and inversion (~) work on the intervals
+    alone, in time linear in their number. The dense boolean [1, ntimes]
+    array is only built by as_array(), once per mask.
+    '''
+    def __init__(self, intervals, ntimes):
+        '''
+        intervals : (N x 2) sample indices, in any order, possibly
+            overlapping; they are clipped to [0, ntimes] and merged.
+        '''
+        intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+        lb = np.clip(intervals[:, 0], 0, ntimes)
+        ub = np.clip(intervals[:, 1], 0, ntimes)
+        keep = ub > lb
+        lb, ub = lb[keep], ub[keep]
+        order = np.argsort(lb, kind='stable')
+        lb, ub = lb[order], ub[order]
+        # a new run starts wherever nothing before it reaches its start
+        reach = np.maximum.accumulate(ub)
+        first = np.ones(len(lb), dtype=bool)
+        first[1:] = lb[1:] > reach[:-1]
+        last = np.ones(len(lb), dtype=bool)
+        last[:-1] = first[1:]
+        self._set(lb[first], reach[last], ntimes)
+
+    def _set(self, starts, ends, ntimes):
+        self.starts = _read_only(np.asarray(starts, dtype=np.int64))
+        self.ends = _read_only(np.asarray(ends, dtype=np.int64))
+        self.ntimes = int(ntimes)
+        self._dense = None
+
+    @classmethod
+    def _from_sorted(cls, starts, ends, ntimes):
+        mask = cls.__new__(cls)
+        mask._set(starts, ends, ntimes)
+        return mask
+
+    @classmethod
+    def full(cls, ntimes, value=True):
+        if value and ntimes > 0:
+            return cls._from_sorted([0], [ntimes], ntimes)
+        return cls._from_sorted([], [], ntimes)
+
+    @classmethod
+    def from_array(cls, mask):
+        '''
+        Mask of the nonzero samples of a 1D array (or of the first row of a
+        2D one).
+        '''
+        mask = np.asarray(mask)
+        if mask.ndim == 2:
+            mask = mask[0]
+        mask = mask.astype(bool)
+        edges = np.diff(np.concatenate([[False], mask, [False]]).astype('i1'))
+        return cls._from_sorted(np.flatnonzero(edges == 1),
+                                np.flatnonzero(edges == -1), len(mask))
+
+    @classmethod
+    def from_slices(cls, bounds, ntimes):
+        '''
+        Mask that is True over mask[lb:ub] for each (lb, ub) in bounds,
+        with the usual meaning of negative slice bounds.
+        '''
+        bounds = np.asarray(bounds, dtype=np.int64).reshape(-1, 2)
+        bounds = np.where(bounds < 0, bounds + ntimes, bounds)
+        return cls(bounds, ntimes)
+
+    @property
+    def intervals(self):
+        return np.stack([self.starts, self.ends], axis=1)
+
+    @property
+    def shape(self):
+        return (1, self.ntimes)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_dense'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        _read_only(self.starts)
+        _read_only(self.ends)
+
+    def count(self):
+        '''
+        Number of True samples.
+        '''
+        return int(np.sum(self.ends - self.starts))
+
+    def all(self):
+        return self.count() == self.ntimes
+
+    def any(self):
+        return len(self.starts) > 0
+
+    def equals(self, other):
+        return (self.ntimes == other.ntimes and
+                np.array_equal(self.starts, other.starts) and
+                np.array_equal(self.ends, other.ends))
+
+    def _check_length(self, other):
+        if self.ntimes != other.ntimes:
+            raise ValueError('Masks have different lengths: {} and {}'
+                             .format(self.ntimes, other.ntimes))
+
+    def _sweep(self, other, depth):
+        '''
+        Intervals covered by at least depth of the two masks.
+        '''
+        self._check_length(other)
+        # Encode each boundary as 2 * index + order, where order decides
+        # which of a start and an end at the same index comes first: starts
+        # first for a union, so that touching intervals join, and ends first
+        # for an intersection, so that they do not overlap. Each of the
+        # four pieces is already sorted, which a stable sort runs through
+        # in linear time.
+        start_order = 0 if depth == 1 else 1
+        keys = np.sort(np.concatenate([
+            2 * self.starts + start_order, 2 * other.starts + start_order,
+            2 * self.ends + 1 - start_order, 2 * other.ends + 1 - start_order,
+        ]), kind='stable')
+        step = np.where(keys % 2 == start_order, 1, -1)
+        covered = np.cumsum(step) >= depth
+        was_covered = np.concatenate([[False], covered[:-1]])
+        index = keys // 2
+        return IntervalMask._from_sorted(index[covered & ~was_covered],
+                                         index[was_covered & ~covered],
+                                         self.ntimes)
+
+    def __or__(self, other):
+        return self._sweep(other, 1)
+
+    def __and__(self, other):
+        return self._sweep(other, 2)
+
+    def __invert__(self):
+        starts = np.concatenate([[0], self.ends])
+        ends = np.concatenate([self.starts, [self.ntimes]])
+        keep = ends > starts
+        return IntervalMask._from_sorted(starts[keep], ends[keep],
+                                         self.ntimes)
+
+    def as_array(self):
+        '''
+        Returns the dense, read-only boolean [1, ntimes] mask.
+        '''
+        if self._dense is None:
+            # +1 at each start and -1 at each end, summed up
+            step = np.zeros(self.ntimes + 1, dtype=np.int8)
+            step[self.starts] = 1
+            step[self.ends] = -1
+            dense = np.cumsum(step[:-1], dtype=np.int8).astype(bool)
+            self._dense = _read_only(dense[np.newaxis, :])
+        return self._dense
+
+    def covers(self, bounds):
+        '''
+        For each (lb, ub) sample range in bounds, whether the mask is True
+        over all of it (clipped to the mask; empty ranges are covered).
+        '''
+        bounds = np.asarray(bounds, dtype=np.int64).reshape(-1, 2)
+        lb = np.clip(bounds[:, 0], 0, self.ntimes)
+        ub = np.maximum(np.clip(bounds[:, 1], 0, self.ntimes), lb)
+        covered = ub == lb
+        if len(self.starts):
+            i = np.searchsorted(self.starts, lb, side='right') - 1
+            covered |= (i >= 0) & (ub <= self.ends[np.maximum(i, 0)])
+        return covered
+
+    def as_times(self, fs):
+        '''
+        Returns the (N x 2) start and end times of the intervals in seconds.
+        '''
+        return self.intervals / fs
+
+
 def epoch_occurrences(epochs, regex=None):
     '''
     Returns a dataframe of the number of occurrences of each epoch. Optionally,
@@ -487,6 +992,57 @@ def group_epochs_by_occurrence_counts(epochs, regex=None):
     return d
 
 
+def epoch_containment_join(parents, children):
+    '''
+    Pairs every occurrence in children with every occurrence in parents
+    that contains it, i.e. where the child starts at or after the parent
+    starts and ends at or before the parent ends.
+
+    Parameters
+    ----------
+    parents : 2D array of (M x 2)
+        The first column is the start time and second column is the end time.
+    children : 2D array of (N x 2)
+        The first column is the start time and second column is the end time.
+
+    Returns
+    -------
+    parent_index, child_index : 1D int arrays
+        Row indices into parents and children of each contained pair, sorted
+        by parent and then by child.
+    '''
+    parents = np.asarray(parents, dtype=float).reshape(-1, 2)
+    children = np.asarray(children, dtype=float).reshape(-1, 2)
+
+    # A valid child inside a parent also starts before the parent ends, so
+    # the candidates for each parent are one run of children sorted by
+    # start. Keep those that also end in time.
+    valid = np.flatnonzero(children[:, 0] <= children[:, 1])
+    order = valid[np.argsort(children[valid, 0], kind='stable')]
+    starts = children[order, 0]
+    lo = np.searchsorted(starts, parents[:, 0], side='left')
+    hi = np.searchsorted(starts, parents[:, 1], side='right')
+    count = np.maximum(hi - lo, 0)
+    parent_index = np.repeat(np.arange(len(parents)), count)
+    step = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    child_index = order[np.repeat(lo, count) + step]
+    keep = children[child_index, 1] <= parents[parent_index, 1]
+    parent_index, child_index = parent_index[keep], child_index[keep]
+
+    # Children that end before they start (there should be few, if any)
+    # are compared against every parent.
+    invalid = np.flatnonzero(~(children[:, 0] <= children[:, 1]))
+    if len(invalid):
+        inside = ((children[invalid, 0] >= parents[:, [0]]) &
+                  (children[invalid, 1] <= parents[:, [1]]))
+        p, c = np.nonzero(inside)
+        parent_index = np.concatenate([parent_index, p])
+        child_index = np.concatenate([child_index, invalid[c]])
+
+    order = np.lexsort((child_index, parent_index))
+    return parent_index[order], child_index[order]
+
+
 def find_common_epochs(epochs, epoch_name, d=12):
     '''
     Finds all epochs contained by `epoch_name` that are common to all
@@ -511,28 +1067,39 @@ def find_common_epochs(epochs, epoch_name, d=12):
         Epochs common to all occurances of `epoch_name`. The start and end
         times will reflect the time relative to the onset of the epoch.
     '''
-    # First, loop through all occurances of `epoch_name` and find all the
-    # epochs contained within that occurance. Be sure to adjust the start/end
-    # time so that they are relative to the beginning of the occurance of that
-    # epoch.
-    epoch_subsets = []
-    matches =  epochs.query('name == "{}"'.format(epoch_name))
-    for lb, ub in matches[['start', 'end']].values:
-        m = (epochs['start'] >= lb) & (epochs['end'] <= ub)
-        epoch_subset = epochs.loc[m].copy()
-        epoch_subset['start'] -= lb
-        epoch_subset['end'] -= lb
-        epoch_subset = set((n, round(s, d), round(e, d)) for (n, s, e) \
-                           in epoch_subset[['name', 'start', 'end']].values)
-        epoch_subsets.append(epoch_subset)
-
-    # Now, determine which epochs are common to all occurances.
-    common_epochs = epoch_subsets[0].copy()
-    for other_epoch in epoch_subsets[1:]:
-        common_epochs.intersection_update(other_epoch)
-
-    new_epochs = pd.DataFrame(list(common_epochs),
-                              columns=['name', 'start', 'end'])
+    # First, find all the epochs contained within each occurance of
+    # `epoch_name`. Be sure to adjust the start/end time so that they are
+    # relative to the beginning of the occurance of that epoch.
+    bounds = epochs[['start', 'end']].values.astype(float)
+    matches = np.flatnonzero(epochs['name'].values == epoch_name)
+    if len(matches) == 0:
+        raise IndexError('No occurrences of {}'.format(epoch_name))
+    parent, child = epoch_containment_join(bounds[matches], bounds)
+    lb = bounds[matches[parent], 0]
+    start = bounds[child, 0] - lb
+    end = bounds[child, 1] - lb
+    contained = pd.DataFrame({
+        'parent': parent,
+        'name': pd.factorize(epochs['name'].values[child])[0],
+        'start': np.round(start, d),
+        'end': np.round(end, d),
+        'row': np.arange(len(child)),
+        })
+
+    # Now, determine which epochs are common to all occurances: those found
+    # under as many distinct occurances as there are.
+    key = ['name', 'start', 'end']
+    contained = contained.drop_duplicates(key + ['parent'])
+    counts = contained.groupby(key, sort=False)['parent'].transform('size')
+    common = contained[counts.values == len(matches)].drop_duplicates(key)
+
+    # report times rounded the way round() does, as this always has
+    row = common['row'].values
+    new_epochs = pd.DataFrame({
+        'name': epochs['name'].values[child[row]],
+        'start': [round(s, d) for s in start[row].tolist()],
+        'end': [round(e, d) for e in end[row].tolist()],
+        })
     new_epochs.sort_values(['start', 'end'], inplace=True)
     return new_epochs
 
@@ -557,12 +1124,15 @@ def group_epochs_by_parent(epochs, epoch_name_regex):
     Example
     '''
 
-    m = epochs.name.str.match(epoch_name_regex)
-    for name, start, end in epochs.loc[m, ['name', 'start', 'end']].values:
-        m_lb = epochs['start'] >= start
-        m_ub = epochs['end'] <= end
-        m = m_lb & m_ub
-        yield (name, epochs.loc[m])
+    m = epochs.name.str.match(epoch_name_regex).fillna(False).values
+    bounds = epochs[['start', 'end']].values.astype(float)
+    parents = np.flatnonzero(m)
+    parent, child = epoch_containment_join(bounds[parents], bounds)
+    # children of parent i are child[split[i]:split[i+1]]
+    split = np.searchsorted(parent, np.arange(len(parents) + 1))
+    names = epochs['name'].values
+    for i, p in enumerate(parents):
+        yield (names[p], epochs.iloc[child[split[i]:split[i+1]]])
 
 
 def add_epoch(df, regex_a, regex_b, new_name=None, operation='intersection'):
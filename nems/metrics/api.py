@@ -1,4 +1,4 @@
-from .mse import mse, nmse, nmse_shrink, j_nmse
+from .mse import mse, nmse, nmse_shrink, j_nmse, mse_batch, nmse_batch
 from .corrcoef import corrcoef, j_corrcoef, r_floor, r_ceiling
 from .loglike import likelihood_poisson
 from .state import state_mod_index, j_state_mod_index
@@ -254,13 +254,20 @@ def r_ceiling(result, fullrec, pred_name='pred', resp_name='resp', N=100):
     epoch_regex = '^STIM_'
     epochs_to_extract = ep.epoch_names_matching(result[resp_name].epochs,
                                                 epoch_regex)
-    folded_resp = result[resp_name].extract_epochs(epochs_to_extract)
+    folded_resp = result[resp_name].extract_epochs(epochs_to_extract,
+                                                   copy=False)
 
     epochs_to_extract = ep.epoch_names_matching(result[pred_name].epochs,
                                                 epoch_regex)
-    folded_pred = result[pred_name].extract_epochs(epochs_to_extract)
+    folded_pred = result[pred_name].extract_epochs(epochs_to_extract,
+                                                   copy=False)
 
+    # single trials of every stimulus with data in result, extracted once
+    # for all channels
     resp = fullrec[resp_name].rasterize()
+    folded_full = resp.extract_epochs(
+        [k for k, d in folded_resp.items() if np.isfinite(d).any()],
+        copy=False)
 
     chancount = fullrec[resp_name].shape[0]
 
@@ -273,7 +280,7 @@ def r_ceiling(result, fullrec, pred_name='pred', resp_name='resp', N=100):
         for k, d in folded_resp.items():
             if np.sum(np.isfinite(d)) > 0:
 
-                Xall.append(resp.extract_epoch(k)[:, chanidx, :])
+                Xall.append(folded_full[k][:, chanidx, :])
                 p.append(folded_pred[k][:, chanidx, :])
                 reps.append(Xall[-1].shape[0])
                 preps.append(p[-1].shape[0])
@@ -18,6 +18,7 @@ def likelihood_poisson(result, pred_name='pred', resp_name='resp'):
     # norm LL copied from NARF:
     # - nanmean(r.*log(p) - p) ./ (nanmean(r)*log(nanmean(r)));
 
-    numer = np.mean(x2*np.log(x1) - x1)
-    denom = np.mean(x2) * np.log(np.mean(x2))
+    numer = np.mean(x2*np.log(x1) - x1, dtype=np.float64)
+    mean_resp = np.mean(x2, dtype=np.float64)
+    denom = mean_resp * np.log(mean_resp)
     return numer/denom
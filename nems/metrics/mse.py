@@ -37,7 +37,8 @@ def mse(result, pred_name='pred', resp_name='resp'):
     pred = result[pred_name].as_continuous()
     resp = result[resp_name].as_continuous()
     squared_errors = (pred-resp)**2
-    return np.nanmean(squared_errors)
+    # Accumulate in float64 even when signals are float32
+    return np.nanmean(squared_errors, dtype=np.float64)
 
 
 def nmse(result, pred_name='pred', resp_name='resp'):
@@ -58,12 +59,45 @@ def nmse(result, pred_name='pred', resp_name='resp'):
     X1 = X1[keepidx]
     X2 = X2[keepidx]
 
-    respstd = np.nanstd(X2)
+    respstd = np.nanstd(X2, dtype=np.float64)
     squared_errors = (X1-X2)**2
-    mse = np.sqrt(np.nanmean(squared_errors))
+    mse = np.sqrt(np.nanmean(squared_errors, dtype=np.float64))
     return mse / respstd
 
 
+def mse_batch(pred, resp):
+    '''
+    mse for a batch of predictions (batch x chans x time) of the same
+    response (chans x time) at once, as returned by
+    nems.modelspec.CompiledModelspec.evaluate_batch. Returns one value per
+    prediction.
+    '''
+    squared_errors = (pred - resp)**2
+    return np.nanmean(squared_errors.reshape(len(pred), -1), axis=1,
+                      dtype=np.float64)
+
+
+def nmse_batch(pred, resp):
+    '''
+    nmse for a batch of predictions of the same response, see mse_batch.
+    '''
+    keepidx = np.isfinite(pred) & np.isfinite(resp)
+    n = keepidx.reshape(len(pred), -1).sum(axis=1)
+    count = np.maximum(n, 1)[:, np.newaxis, np.newaxis]
+    # Like nmse, the std of resp only counts samples where pred is finite
+    resp = np.where(keepidx, resp, 0)
+    resp_mean = resp.sum(axis=(1, 2), keepdims=True, dtype=np.float64) / count
+    resp_var = np.where(keepidx, (resp - resp_mean)**2, 0).sum(
+            axis=(1, 2), dtype=np.float64) / count[:, 0, 0]
+    squared_errors = np.where(keepidx, (pred - resp)**2, 0)
+    mse = np.sqrt(squared_errors.sum(axis=(1, 2), dtype=np.float64) /
+                  count[:, 0, 0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = mse / np.sqrt(resp_var)
+    result[n == 0] = 1
+    return result
+
+
 def j_nmse(result, pred_name='pred', resp_name='resp', njacks=20):
     '''
     Jackknifed estimate of mean and SE on normalized MSE
@@ -128,9 +162,9 @@ def j_nmse(result, pred_name='pred', resp_name='resp', njacks=20):
                 X1 = pred[ff]
                 X2 = resp[ff]
 
-                respstd = np.nanstd(X2)
+                respstd = np.nanstd(X2, dtype=np.float64)
                 squared_errors = (X1-X2)**2
-                E = np.sqrt(np.nanmean(squared_errors))
+                E = np.sqrt(np.nanmean(squared_errors, dtype=np.float64))
                 jc[jj] = E / respstd
 
             mse[i] = np.nanmean(jc)
@@ -168,9 +202,10 @@ def nmse_shrink(result, pred_name='pred', resp_name='resp', shrink=0.1):
         if len(jj) == 0:
             log.info('No data in range?')
 
-        P = np.std(X2[jj])
+        P = np.std(X2[jj], dtype=np.float64)
         if P > 0:
-            E[ii] = np.sqrt(np.mean(np.square(X1[jj] - X2[jj]))) / P
+            E[ii] = np.sqrt(np.mean(np.square(X1[jj] - X2[jj]),
+                                    dtype=np.float64)) / P
         else:
             E[ii] = 1
     #print(E)
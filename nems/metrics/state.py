@@ -19,10 +19,10 @@ def state_mod_split(rec, epoch='REFERENCE', psth_name='pred', channel=None,
     #c = rec[psth_name].chans[chanidx]
     #full_psth = rec[psth_name].loc[c]
     full_psth = rec[psth_name]
-    folded_psth = full_psth.extract_epoch(epoch)[:, [chanidx], :] * fs
+    folded_psth = full_psth.extract_epoch(epoch, copy=False)[:, [chanidx], :] * fs
 
     full_var = rec[state_sig].loc[state_chan]
-    folded_var = np.squeeze(full_var.extract_epoch(epoch)) * fs
+    folded_var = np.squeeze(full_var.extract_epoch(epoch, copy=False)) * fs
 
     # compute the mean state for each occurrence
     g = (np.sum(np.isfinite(folded_var), axis=1) > 0)
@@ -41,7 +41,8 @@ def state_mod_split(rec, epoch='REFERENCE', psth_name='pred', channel=None,
             if (s.startswith('FILE') | s.startswith('ACTIVE') |
                 s.startswith('PASSIVE')) and s != state_chan:
                 full_var = rec[state_sig].loc[s]
-                folded_var = np.squeeze(full_var.extract_epoch(epoch))
+                folded_var = np.squeeze(full_var.extract_epoch(epoch,
+                                                               copy=False))
                 g = (np.sum(np.isfinite(folded_var), axis=1) > 0)
                 m0[g] += np.nanmean(folded_var[g, :], axis=1)
         ltidx = np.logical_not(gtidx) & np.logical_not(m0) & g
@@ -2,11 +2,15 @@ import re
 import os
 import copy
 import json
+import inspect
+import functools
 import importlib
+from collections import ChainMap
 import numpy as np
 import scipy.stats as st
 import nems.utils
 import nems.uri
+from nems.fitters.util import vector_to_phi
 
 # Functions for saving, loading, and evaluating modelspecs
 
@@ -197,7 +201,9 @@ def evaluate(rec, modelspec, start=None, stop=None):
     of the list (whereas a value of -1 for stop will not).
     '''
     # d = copy.deepcopy(rec)  # Paranoid, but 100% safe
-    d = copy.copy(rec)  # About 10x faster & fine if Signals are immutable
+    # Signals are immutable, so copying the dict of signals (not the signals)
+    # is enough for the new signals not to show up in rec
+    d = rec.copy()
     for m in modelspec[start:stop]:
         fn = _lookup_fn_at(m['fn'])
         fn_kwargs = m.get('fn_kwargs', {})
@@ -233,6 +239,302 @@ def evaluate(rec, modelspec, start=None, stop=None):
     return d
 
 
+def _same_values(a, b):
+    '''
+    True if a and b (nested dicts of scalars, strings and arrays, such as
+    phi or fn_kwargs) hold the same values.
+    '''
+    if isinstance(a, dict) or isinstance(b, dict):
+        return (isinstance(a, dict) and isinstance(b, dict) and
+                a.keys() == b.keys() and
+                all(_same_values(a[k], b[k]) for k in a))
+    try:
+        return bool(np.array_equal(a, b))
+    except (TypeError, ValueError):
+        return False
+
+
+def _first_change(old, new):
+    '''
+    Index of the first item of the list new that differs from the one at
+    the same position in old.
+    '''
+    for n, (a, b) in enumerate(zip(old, new)):
+        if not _same_values(a, b):
+            return n
+    return min(len(old), len(new))
+
+
+def caching_evaluator():
+    '''
+    Returns a drop-in replacement for evaluate() for fitters that only fit
+    some of the modules. It keeps the recording after each module of the
+    last call, and on the next call with the same recording starts from
+    the first module whose fn, fn_kwargs or phi changed, so modules
+    upstream of the ones being fit are not evaluated again. Changing a
+    frozen module (e.g. between module sets) makes it start from that
+    module instead.
+    '''
+    cached_rec = None
+    snapshots = []
+    stages = []
+
+    def cached_evaluate(rec, modelspec, start=None, stop=None):
+        nonlocal cached_rec
+        if start is not None or stop is not None:
+            return evaluate(rec, modelspec, start, stop)
+        if rec is not cached_rec:
+            cached_rec = rec
+            del snapshots[:], stages[:]
+
+        current = [{'fn': m['fn'], 'fn_kwargs': m.get('fn_kwargs', {}),
+                    'phi': m.get('phi', {})} for m in modelspec]
+        k = _first_change(snapshots, current)
+        del snapshots[k:], stages[k:]
+        d = stages[-1] if stages else rec
+        for j in range(k, len(modelspec)):
+            d = evaluate(d, modelspec, start=j, stop=j+1)
+            stages.append(d)
+            snapshots.append(copy.deepcopy(current[j]))
+        return d.copy()
+
+    return cached_evaluate
+
+
+def fit_evaluator(rec, modelspec):
+    '''
+    The evaluator fitters use on rec by default: a compiled modelspec if
+    every module has an array-level kernel, otherwise a
+    caching_evaluator(). Both skip modules upstream of the ones being fit.
+    '''
+    if can_compile(modelspec):
+        return compile(rec, modelspec).evaluate
+    return caching_evaluator()
+
+
+def _lookup_kernel(m, suffix='_kernel'):
+    '''
+    Returns the array-level kernel of module m, which by convention is its
+    fn with '_kernel' appended (e.g. nems.modules.fir.basic_kernel), or
+    None if it has none. Modules that normalize their output have none,
+    since the normalization is done on signals by evaluate().
+    '''
+    if 'norm' in m.keys():
+        return None
+    try:
+        return _lookup_fn_at(m['fn'] + suffix)
+    except (ImportError, AttributeError):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def _takes_rec(kernel):
+    return 'rec' in inspect.signature(kernel).parameters
+
+
+def _with_rec(kernel, signals, kwargs):
+    # kernels that read other signals are passed all of them as rec
+    if _takes_rec(kernel):
+        return {**kwargs, 'rec': signals}
+    return kwargs
+
+
+class _BoundArrays(dict):
+    '''
+    The data of the signals of a recording, read the first time each one
+    is asked for.
+    '''
+
+    def __init__(self, rec):
+        super().__init__()
+        self.recording = rec
+
+    def __missing__(self, name):
+        data = self.recording[name].rasterize().as_continuous()
+        self[name] = data
+        return data
+
+
+def _keep_precision(x, y):
+    # same precision as RasterizedSignal.transform
+    if (x.dtype.kind == 'f' and y.dtype.kind == 'f' and
+            y.dtype.itemsize > x.dtype.itemsize):
+        return y.astype(x.dtype)
+    return y
+
+
+def can_compile(modelspec):
+    '''
+    True if every module of modelspec has an array-level kernel, so that
+    compile() can be used on it.
+    '''
+    return all(_lookup_kernel(m) is not None for m in modelspec)
+
+
+class CompiledModelspec:
+    '''
+    A modelspec bound to the signals of one recording, as returned by
+    compile(). Calling it with a parameter vector, laid out the way
+    nems.fitters.mappers.simple_vector packs the whole modelspec, runs the
+    array-level kernel of each module on plain ndarrays and returns the
+    data of the output signal.
+
+    Kernels are functions of (x, out=None, **kwargs) that return the
+    module's output for input data x, where kwargs are the module's
+    fn_kwargs (less i and o) and phi. They write into out when they can;
+    each module gets the same out array on every call, so arrays
+    returned by a CompiledModelspec are only valid until the next call.
+    Kernels that read other signals (e.g. state) take a rec argument,
+    which maps signal names to their data, and those that depend on the
+    sampling rate (e.g. stp) take an fs argument.
+
+    evaluate_batch runs many parameter vectors at once, through each
+    module's '_batch_kernel'. These take the same arguments, less out,
+    but every phi value has a leading batch axis, as may x.
+    '''
+
+    def __init__(self, rec, modelspec, output='pred'):
+        self.recording = rec
+        self.output = output
+        self._phi_template = [m.get('phi', {}) for m in modelspec]
+        self._steps = []
+        self._batch_kernels = []
+        self._inputs = _BoundArrays(rec)
+        # signal that the metadata of each signal is copied from
+        self._templates = {}
+        for m in modelspec:
+            kernel = _lookup_kernel(m)
+            if kernel is None:
+                raise ValueError('No array-level kernel for module: {}'
+                                 .format(m['fn']))
+            params = inspect.signature(_lookup_fn_at(m['fn'])).parameters
+            kwargs = dict(m.get('fn_kwargs', {}))
+            i = kwargs.pop('i', params['i'].default)
+            o = kwargs.pop('o', params['o'].default)
+            if i not in self._templates:
+                self._templates[i] = rec[i].rasterize()
+            self._templates[o] = self._templates[i]
+            if 'fs' in inspect.signature(kernel).parameters:
+                kwargs['fs'] = self._templates[i].fs
+            self._steps.append((kernel, i, o, kwargs))
+            self._batch_kernels.append(_lookup_kernel(m, '_batch_kernel'))
+
+        self._outputs = list(dict.fromkeys(o for _, _, o, _ in self._steps))
+        if output not in self._outputs:
+            raise ValueError('Modelspec does not compute {}'.format(output))
+
+        # The first run allocates the output of each module
+        self._buffers = [None] * len(self._steps)
+        self._last_phi = []
+        self._last_outputs = []
+        self._run(self._phi_template)
+        self._buffers = list(self._last_outputs)
+
+    def _run(self, phi):
+        # Modules up to the first one whose phi changed since the last run
+        # (those frozen by the fitter) keep their last output
+        k = _first_change(self._last_phi, phi)
+        del self._last_phi[k:], self._last_outputs[k:]
+        signals = ChainMap({}, self._inputs)
+        for (_, _, o, _), y in zip(self._steps, self._last_outputs):
+            signals[o] = y
+
+        for n, ((kernel, i, o, kwargs), p) in enumerate(zip(self._steps[k:],
+                                                            phi[k:]), k):
+            x = signals[i]
+            out = self._buffers[n]
+            if out is not None and not out.flags.writeable:
+                # made read-only by a signal wrapped around a result
+                out = self._buffers[n] = out.copy()
+            y = kernel(x, out=out, **_with_rec(kernel, signals, kwargs), **p)
+            if y is not out:
+                y = _keep_precision(x, y)
+            signals[o] = y
+            self._last_outputs.append(y)
+            self._last_phi.append(copy.deepcopy(p))
+        return signals
+
+    def __call__(self, vector):
+        phi = vector_to_phi(vector, self._phi_template)
+        return self._run(phi)[self.output]
+
+    def can_batch(self):
+        '''
+        True if every module has a batch kernel, so that evaluate_batch
+        can be used.
+        '''
+        return all(k is not None for k in self._batch_kernels)
+
+    def _batch_phi(self, sigmas):
+        # vector_to_phi for each row of sigmas, keeping the batch axis
+        phi = []
+        offset = 0
+        for template in self._phi_template:
+            p = {}
+            for name in sorted(template):
+                shape = np.shape(template[name])
+                size = int(np.prod(shape))
+                p[name] = sigmas[:, offset:offset+size].reshape(
+                        (len(sigmas),) + shape)
+                offset += size
+            phi.append(p)
+        return phi
+
+    def evaluate_batch(self, sigmas, metric=None, resp='resp'):
+        '''
+        Evaluates the model for every row of sigmas (batch x parameters,
+        each row laid out like a vector passed to __call__) in one
+        vectorized pass, and returns the batch x chans x time predictions.
+        If metric is given (e.g. nems.metrics.mse.nmse_batch), returns
+        (predictions, metric(predictions, data of signal resp)) instead.
+        '''
+        if not self.can_batch():
+            raise ValueError('Not every module has a batch kernel')
+        sigmas = np.atleast_2d(np.asarray(sigmas, dtype=float))
+        signals = ChainMap({}, self._inputs)
+        for (_, i, o, kwargs), kernel, p in zip(self._steps,
+                                                self._batch_kernels,
+                                                self._batch_phi(sigmas)):
+            x = signals[i]
+            y = kernel(x, **_with_rec(kernel, signals, kwargs), **p)
+            signals[o] = _keep_precision(x, y)
+        pred = signals[self.output]
+        pred = np.broadcast_to(pred, (len(sigmas),) + pred.shape[-2:])
+        if metric is None:
+            return pred
+        return pred, metric(pred, self._inputs[resp])
+
+    def evaluate(self, rec, modelspec, start=None, stop=None):
+        '''
+        Drop-in replacement for evaluate() for fitters. If rec is the
+        recording this was compiled for, runs the kernels with the phi of
+        modelspec and returns a copy of rec with the module outputs
+        replaced. Otherwise falls back to evaluate().
+        '''
+        if (rec is not self.recording or start is not None or
+                stop is not None or len(modelspec) != len(self._steps)):
+            return evaluate(rec, modelspec, start, stop)
+        signals = self._run([m.get('phi', {}) for m in modelspec])
+        d = rec.copy()
+        for o in self._outputs:
+            # a view, so that the signal cannot make the buffer read-only
+            data = signals[o].view()
+            d.add_signal(self._templates[o]._modified_copy(data, name=o))
+        return d
+
+
+def compile(rec, modelspec, output='pred'):
+    '''
+    Looks up the array-level kernel of every module of modelspec and binds
+    the input signals of rec once, returning a CompiledModelspec that maps
+    a parameter vector straight to the data of signal output. Its
+    .evaluate method can stand in for evaluate() when fitting on rec.
+
+    Raises ValueError if a module has no kernel (see can_compile).
+    '''
+    return CompiledModelspec(rec, modelspec, output)
+
+
 def summary_stats(modelspecs, mod_key='fn', meta_include=[], stats_keys=[]):
     '''
     Generates summary statistics for a list of modelspecs.
@@ -1,5 +1,3 @@
-from itertools import chain, repeat
-
 import numpy as np
 import scipy.signal
 from scipy import interpolate
@@ -11,11 +9,26 @@ def get_zi(b, x):
     # filter operation.
     n_taps = len(b)
     null_data = np.full(n_taps*2, x[0])
-    zi = np.ones(n_taps-1)
-    return scipy.signal.lfilter(b, [1], null_data, zi=zi)[1]
+    zi = np.ones(n_taps-1, dtype=b.dtype)
+    a = np.ones(1, dtype=b.dtype)
+    return scipy.signal.lfilter(b, a, null_data, zi=zi)[1]
+
+
+# Filters at least this long are applied by overlap-add FFT convolution,
+# all channels at once, rather than by direct convolution.
+FFT_MIN_TAPS = 128
+
+
+def _pad_start(x, n_taps):
+    '''
+    Prepends n_taps - 1 copies of x[..., 0] to the last axis of x, which is
+    the initial state get_zi sets up for lfilter.
+    '''
+    return np.concatenate([np.repeat(x[..., :1], n_taps - 1, axis=-1), x],
+                          axis=-1)
 
 
-def per_channel(x, coefficients, bank_count=1):
+def per_channel(x, coefficients, bank_count=1, out=None):
     '''Private function used by fir_filter().
 
     Parameters
@@ -33,6 +46,8 @@ def per_channel(x, coefficients, bank_count=1):
         ``coefficients[filter_i * n_banks + bank_i]``.
     bank_count : int
         Number of filters in each bank.
+    out : {None, array (bank_count, n_times)}
+        Array to write the result into, allocated if None.
 
     Returns
     -------
@@ -40,22 +55,16 @@ def per_channel(x, coefficients, bank_count=1):
         Filtered signal.
     '''
     # Make sure the number of input channels (x) match the number FIR filters
-    # provided (we have a separate filter for each channel). The `zip` function
-    # doesn't require the iterables to be the same length.
+    # provided (we have a separate filter for each channel). Either:
+    # option 1: number of input channels is same as total channels in the
+    #   filterbank, allowing a different stimulus into each filter
+    # option 2: number of input channels is same as number of coefficients
+    #   in each fir filter, so that the same stimulus goes into each filter
+    # In both cases filter f reads input channel f % n_in.
     n_in = len(x)
     n_filters = len(coefficients)
     n_banks = int(n_filters / bank_count)
-    if n_filters == n_in:
-        # option 1: number of input channels is same as total channels in the
-        # filterbank, allowing a different stimulus into each filter
-        all_x = iter(x)
-    elif n_filters == n_in * bank_count:
-        # option 2: number of input channels is same as number of coefficients
-        # in each fir filter, so that the same stimulus goes into each
-        # filter
-        one_x = tuple(x)
-        all_x = chain.from_iterable([one_x for _ in range(bank_count)])
-    else:
+    if n_filters not in (n_in, n_in * bank_count):
         if bank_count == 1:
             desc = '%i FIR filters' % n_filters
         else:
@@ -63,18 +72,31 @@ def per_channel(x, coefficients, bank_count=1):
         raise ValueError(
             'Dimension mismatch. %s channels provided for %s.' % (n_in, desc))
 
-    c_iter = iter(coefficients)
-    out = np.zeros((bank_count, x.shape[1]))
-    for i_out in range(bank_count):
-        for i_bank in range(n_banks):
-            x_ = next(all_x)
-            c = next(c_iter)
-            # It is slightly more "correct" to use lfilter than convolve at
-            # edges, but but also about 25% slower (Measured on Intel Python
-            # Dist, using i5-4300M)
-            zi = get_zi(c, x_)
-            r, zf = scipy.signal.lfilter(c, [1], x_, zi=zi)
-            out[i_out] += r
+    # Filter in the precision of the input, so float32 signals stay float32
+    dtype = x.dtype if x.dtype.kind == 'f' else np.float64
+    c = np.asarray(coefficients, dtype=dtype)
+    if out is None:
+        out = np.empty((bank_count, x.shape[1]), dtype=dtype)
+
+    # It is slightly more "correct" to start from x[0] (as lfilter does with
+    # zi from get_zi) than from zeros as plain convolution would. Padding
+    # every channel once does the same without a dummy lfilter per filter.
+    xpad = _pad_start(np.asarray(x, dtype=dtype), c.shape[1])
+    rows = np.arange(n_filters) % n_in
+    # Overlap-add would spread a nan over a whole block rather than the
+    # n_taps samples lfilter blanks, so non-finite inputs are filtered
+    # directly.
+    if c.shape[1] >= FFT_MIN_TAPS and np.isfinite(xpad).all():
+        y = scipy.signal.oaconvolve(xpad[rows], c, mode='valid', axes=-1)
+        y = y.astype(dtype, copy=False).reshape(bank_count, n_banks, -1)
+        return np.sum(y, axis=1, out=out)
+
+    # np.convolve of one filter at a time beats any all-filters-at-once
+    # formulation tried (shifted sums over taps, einsum over sliding
+    # windows) for filters shorter than FFT_MIN_TAPS.
+    out[...] = 0
+    for f in range(n_filters):
+        out[f // n_banks] += np.convolve(xpad[rows[f]], c[f], mode='valid')
     return out
 
 
@@ -208,3 +230,43 @@ def filter_bank(rec, i='pred', o='pred', coefficients=[], bank_count=1):
 
     fn = lambda x: per_channel(x, coefficients, bank_count)
     return [rec[i].transform(fn, o)]
+
+
+#-------------------------------------------------------------------------------
+# Array-level kernels, see nems.modelspec.compile
+#-------------------------------------------------------------------------------
+def basic_kernel(x, coefficients, out=None):
+    return per_channel(x, coefficients, out=out)
+
+
+def fir_dexp_kernel(x, phi, n_coefs=10, out=None):
+    return per_channel(x, fir_dexp_coefficients(phi, n_coefs), out=out)
+
+
+def filter_bank_kernel(x, coefficients, bank_count=1, out=None):
+    return per_channel(x, coefficients, bank_count, out=out)
+
+
+def basic_batch_kernel(x, coefficients):
+    '''
+    basic_kernel for a batch of models: coefficients is (batch x n_channels
+    x n_taps) and x is (n_channels x n_times), or has a leading batch axis
+    too. Returns (batch x 1 x n_times).
+
+    Rather than one lfilter per channel and model, sums each tap over all
+    of them at once. Like per_channel (see get_zi), the input is taken to
+    be x[..., 0] before its start.
+    '''
+    n_batch, n_filters, n_taps = coefficients.shape
+    if n_filters != x.shape[-2]:
+        raise ValueError('Dimension mismatch. %i channels provided for %i '
+                         'FIR filters.' % (x.shape[-2], n_filters))
+    dtype = x.dtype if x.dtype.kind == 'f' else np.float64
+    c = np.asarray(coefficients, dtype=dtype)[:, np.newaxis]
+    n_times = x.shape[-1]
+    x = _pad_start(x, n_taps)
+    out = np.zeros((n_batch, 1, n_times), dtype=dtype)
+    for k in range(n_taps):
+        lag = n_taps - 1 - k
+        out += np.matmul(c[..., k], x[..., lag:lag + n_times])
+    return out
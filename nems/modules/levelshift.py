@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def levelshift(rec, i, o, level):
     '''
     Parameters
@@ -5,4 +8,17 @@ def levelshift(rec, i, o, level):
     level : a scalar to add to every element of the input signal.
     '''
     fn = lambda x: x + level
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
+
+
+def levelshift_kernel(x, level, out=None):
+    '''Array-level levelshift, see nems.modelspec.compile.'''
+    return np.add(x, level, out=out)
+
+
+def levelshift_batch_kernel(x, level):
+    '''levelshift_kernel with a leading batch axis on level.'''
+    # line each model's level up with its (chans x time) output
+    level = np.reshape(level, level.shape[:1] + (1,) * (3 - level.ndim) +
+                       level.shape[1:])
+    return x + level
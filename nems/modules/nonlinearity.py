@@ -11,7 +11,7 @@ def _logistic_sigmoid(x, base, amplitude, shift, kappa):
 def logistic_sigmoid(rec, i, o, base, amplitude, shift, kappa):
 
     fn = lambda x: _logistic_sigmoid(x, base, amplitude, shift, kappa)
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
 
 
 def _tanh(x, base, amplitude, shift, kappa):
@@ -20,7 +20,7 @@ def _tanh(x, base, amplitude, shift, kappa):
 
 def tanh(rec, i, o, base, amplitude, shift, kappa):
     fn = lambda x : _tanh(x, base, amplitude, shift, kappa)
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
 
 
 def _quick_sigmoid(x, base, amplitude, shift, kappa):
@@ -30,7 +30,7 @@ def _quick_sigmoid(x, base, amplitude, shift, kappa):
 
 def quick_sigmoid(rec, i, o, base, amplitude, shift, kappa):
     fn = lambda x : _quick_sigmoid(x, base, amplitude, shift, kappa)
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
 
 
 def _double_exponential(x, base, amplitude, shift, kappa):
@@ -57,7 +57,7 @@ def double_exponential(rec, i, o, base, amplitude, shift, kappa):
     # fn = lambda x : _quick_sigmoid(x, base, amplitude, shift, kappa)
     # fn = lambda x : _tanh(x, base, amplitude, shift, kappa)
     # fn = lambda x : _logistic_sigmoid(x, base, amplitude, shift, kappa)
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
 
 
 def _dlog(x, offset):
@@ -91,7 +91,7 @@ def dlog(rec, i, o, offset):
 
     fn = lambda x : _dlog(x, offset)
 
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
 
 
 def _relu(x, offset):
@@ -106,5 +106,48 @@ def relu(rec, i, o, offset):
 
     fn = lambda x : _relu(x, offset)
 
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
 
+
+#-------------------------------------------------------------------------------
+# Array-level kernels, see nems.modelspec.compile
+#-------------------------------------------------------------------------------
+def double_exponential_kernel(x, base, amplitude, shift, kappa, out=None):
+    # _double_exponential one step at a time, without temporaries
+    y = np.subtract(x, shift, out=out)
+    np.multiply(y, np.array(-exp(kappa)), out=y)
+    np.exp(y, out=y)
+    np.negative(y, out=y)
+    np.exp(y, out=y)
+    np.multiply(y, amplitude, out=y)
+    return np.add(y, base, out=y)
+
+
+def logistic_sigmoid_kernel(x, base, amplitude, shift, kappa, out=None):
+    return _logistic_sigmoid(x, base, amplitude, shift, kappa)
+
+
+def tanh_kernel(x, base, amplitude, shift, kappa, out=None):
+    return _tanh(x, base, amplitude, shift, kappa)
+
+
+def quick_sigmoid_kernel(x, base, amplitude, shift, kappa, out=None):
+    return _quick_sigmoid(x, base, amplitude, shift, kappa)
+
+
+def dlog_kernel(x, offset, out=None):
+    return _dlog(x, offset)
+
+
+def relu_kernel(x, offset, out=None):
+    return _relu(x, offset)
+
+
+def _batch_axis(p):
+    # line each model's parameter up with its (chans x time) output
+    return np.reshape(p, p.shape[:1] + (1,) * (3 - p.ndim) + p.shape[1:])
+
+
+def double_exponential_batch_kernel(x, base, amplitude, shift, kappa):
+    return _double_exponential(x, _batch_axis(base), _batch_axis(amplitude),
+                               _batch_axis(shift), _batch_axis(kappa))
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def scale(rec, i, o, a):
     '''
     Intended to be applied immediately preceding levelshift, so that the
@@ -9,4 +12,9 @@ def scale(rec, i, o, a):
     a : a scalar to multiply every element of the input signal by.
     '''
     fn = lambda x: x * a
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
+
+
+def scale_kernel(x, a, out=None):
+    '''Array-level scale, see nems.modelspec.compile.'''
+    return np.multiply(x, a, out=out)
@@ -40,7 +40,12 @@ def replicate_channels(rec, i='pred', o='pred', repcount=2):
     """
     fn = lambda x: np.tile(x,(repcount,1))
 
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
+
+
+def replicate_channels_kernel(x, repcount=2, out=None):
+    '''Array-level replicate_channels, see nems.modelspec.compile.'''
+    return np.tile(x, (repcount, 1))
 
 
 def _merge_states(x, state):
@@ -25,6 +25,19 @@ def state_dc_gain(rec, i='pred', o='pred', s='state', g=None, d=0):
     return [rec[i].transform(fn, o)]
 
 
+def state_dc_gain_kernel(x, rec, s='state', g=None, d=0, out=None):
+    '''
+    Array-level state_dc_gain, see nems.modelspec.compile. With a leading
+    batch axis on g and d, matmul evaluates every model at once.
+    '''
+    state = rec[s]
+    return np.matmul(g, state) * x + np.matmul(d, state)
+
+
+def state_dc_gain_batch_kernel(x, rec, s='state', g=None, d=0):
+    return state_dc_gain_kernel(x, rec, s, g, d)
+
+
 def state_segmented(rec, i='pred', o='pred', s='state'):
     '''
     2-segment linear DC/gain for each state applied to each predicted channel
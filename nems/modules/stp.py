@@ -1,6 +1,11 @@
 import numpy as np
 from numpy import exp
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 def short_term_plasticity(rec, i, o, u, tau, crosstalk=0):
     '''
     STP applied to each input channel.
@@ -13,12 +18,15 @@ def short_term_plasticity(rec, i, o, u, tau, crosstalk=0):
     return [rec[i].transform(fn, o)]
 
 
-def _stp(X, u, tau, crosstalk=0, fs=1):
+def _stp(X, u, tau, crosstalk=0, fs=1, backend=None):
     """
     STP core function
+
+    backend : {None, 'python', 'numpy', 'numba'}
+        How the depression/facilitation of each time bin is computed,
+        BACKEND if None.
     """
-    s = X.shape
-    tstim = X.copy()
+    tstim = X.astype(np.float64) if X.dtype.kind != 'f' else X.copy()
     tstim[np.isnan(tstim)] = 0
     tstim[tstim < 0] = 0
 
@@ -51,38 +59,148 @@ def _stp(X, u, tau, crosstalk=0, fs=1):
 
     # TODO : allow >1 STP channel per input?
 
-    # go through each stimulus channel
+    # go through each stimulus channel, except passthru ones (no STP)
+    ui = np.ravel(ui)
+    taui = np.ravel(taui)
+    active = ui != 0
     stim_out = tstim  # allocate scaling term
-    for i in range(0, s[0]):
-        td = 1  # initialize, dep state of previous time bin
-        a = 1/taui[i]
-        ustim = 1.0/taui[i] + ui[i] * tstim[i, :]
-        # ustim = ui[i] * tstim[i, :]
-        if ui[i] == 0:
-            # passthru, no STP, preserve stim_out = tstim
-            pass
-        elif ui[i] > 0:
-            # depression
-            for tt in range(1, s[1]):
-                # td = di[i, tt - 1]  # previous time bin depression
-                # delta = (1 - td) / taui[i] - ui[i] * td * tstim[i, tt - 1]
-                # delta = 1/taui[i] - td * (1/taui[i] - ui[i] * tstim[i, tt - 1])
-                # then a=1/taui[i] and ustim=1/taui[i] - ui[i] * tstim[i,:]
-                delta = a - td * ustim[tt - 1]
-                if td + delta > 0:
-                    td = td + delta
-                else:
-                    td = 0
-                # td = np.max([td, 0])
-                stim_out[i, tt] *= td
-        else:
-            # facilitation
-            for tt in range(1, s[1]):
-                delta = a - td * ustim[tt - 1]
-                td = td + delta
-                # td = np.min([td, 1])
-                stim_out[i, tt] *= td
+    stim_out[active] *= _BACKENDS[backend or BACKEND](
+        tstim[active], ui[active], taui[active])
     # print("(u,tau)=({0},{1})".format(ui,taui))
 
     stim_out[np.isnan(X)] = np.nan
     return stim_out
+
+
+def _stp_scale_loop(tstim, ui, taui):
+    '''
+    Depression (ui > 0) or facilitation (ui < 0) of each channel of tstim,
+    one time bin after another. Compiled, this is the numba backend.
+    '''
+    td = np.ones(tstim.shape)
+    for i in range(tstim.shape[0]):
+        a = 1 / taui[i]
+        d = 1.0  # dep state of previous time bin
+        for tt in range(1, tstim.shape[1]):
+            # delta = (1 - td) / taui[i] - ui[i] * td * tstim[i, tt - 1]
+            delta = a - d * (a + ui[i] * tstim[i, tt - 1])
+            d = d + delta
+            if ui[i] > 0 and not d > 0:
+                # depression can not go below 0
+                d = 0.0
+            td[i, tt] = d
+    return td
+
+
+def _compose(f, g):
+    '''
+    Composes f(g(d)), for functions d -> clip(m * (d - p), lo, hi) given as
+    (m, p, lo, hi) arrays. The result has the same form. Constant functions
+    have lo == hi and m = 0.
+
+    Writing them around the root p rather than as m * d + c keeps every
+    term finite when m overflows, as it does in strong depression: the
+    function then becomes a step at p.
+    '''
+    m2, p2, lo2, hi2 = f
+    m1, p1, lo1, hi1 = g
+    bound1 = m2 * (lo1 - p2)
+    bound2 = m2 * (hi1 - p2)
+    flip = m2 < 0
+    lo = np.minimum(np.maximum(np.where(flip, bound2, bound1), lo2), hi2)
+    hi = np.minimum(np.maximum(np.where(flip, bound1, bound2), lo2), hi2)
+    # where f is constant, 0 * inf bounds are nan
+    flat = m2 == 0
+    lo = np.where(flat, lo2, lo)
+    hi = np.where(flat, hi2, hi)
+    constant = lo == hi
+    m = np.where(constant, 0, m2 * m1)
+    p = np.where(constant, 0, p1 + p2 / m1)
+    return m, p, lo, hi
+
+
+def _apply(f, d):
+    '''
+    Evaluates f(d) for f as in _compose.
+    '''
+    m, p, lo, hi = f
+    # at the root of a step (m = inf), take the limit of m * 0
+    y = np.where(d == p, 0, m * (d - p))
+    return np.minimum(np.maximum(y, lo), hi)
+
+
+def _stp_scale_scan(tstim, ui, taui):
+    '''
+    Same as _stp_scale_loop, with NumPy operations on many time bins at
+    once instead of a loop over all of them.
+
+    Each time bin maps the state of the previous one through
+    d -> clip(m * d + a, lo, inf), with lo = 0 for depression. Functions of
+    that form compose into another one (see _compose), so the time bins are
+    split into about sqrt(n_times) blocks, the maps from the start of each
+    block to every time bin in it are composed for all blocks at once, and
+    only the states at block boundaries are then found one after another.
+    '''
+    n_chans, n_times = tstim.shape
+    if n_times < 2:
+        return np.ones((n_chans, n_times))
+    n_steps = n_times - 1
+    block = int(np.sqrt(n_steps)) + 1
+    n_blocks = -(-n_steps // block)
+    padded = (n_chans, n_blocks * block)
+
+    # the step into each time bin, padded with identity maps
+    a = (1 / taui)[:, np.newaxis]
+    m = np.ones(padded)
+    m[:, :n_steps] = 1 - (a + ui[:, np.newaxis] * tstim[:, :-1])
+    lo = np.full(padded, -np.inf)
+    lo[ui > 0, :n_steps] = 0
+    hi = np.full(padded, np.inf)
+    flat = m == 0
+    with np.errstate(divide='ignore'):
+        p = np.where(flat, 0, -a / m)
+    p[:, n_steps:] = 0
+    lo[flat] = np.maximum(np.broadcast_to(a, padded)[flat], lo[flat])
+    hi[flat] = lo[flat]
+    # (block x n_chans x n_blocks), so that each step j is contiguous
+    steps = [np.ascontiguousarray(
+        x.reshape(n_chans, n_blocks, block).transpose(2, 0, 1))
+        for x in (m, p, lo, hi)]
+
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        # map from the start of each block to each time bin in it
+        scan = [np.empty_like(x) for x in steps]
+        f = tuple(x[0] for x in steps)
+        for j in range(block):
+            if j > 0:
+                f = _compose(tuple(x[j] for x in steps), f)
+            for x, y in zip(scan, f):
+                x[j] = y
+
+        # state at the start of each block, starting from 1
+        start = np.ones((n_chans, n_blocks))
+        last = [x[-1].T.copy() for x in scan]
+        d = start[:, 0]
+        for k in range(1, n_blocks):
+            d = _apply([x[k - 1] for x in last], d)
+            start[:, k] = d
+
+        td = np.ones((n_chans, n_times))
+        td[:, 1:] = _apply(scan, start).transpose(1, 2, 0).reshape(
+            padded)[:, :n_steps]
+    return td
+
+
+_BACKENDS = {'python': _stp_scale_loop, 'numpy': _stp_scale_scan}
+if numba is not None:
+    _BACKENDS['numba'] = numba.njit(_stp_scale_loop)
+
+# Backend _stp uses unless told otherwise
+BACKEND = 'numba' if numba is not None else 'numpy'
+
+
+def short_term_plasticity_kernel(x, u, tau, crosstalk=0, fs=1, out=None):
+    '''
+    Array-level short_term_plasticity, see nems.modelspec.compile.
+    '''
+    return _stp(x, u, tau, crosstalk, fs)
@@ -6,4 +6,9 @@ def sum_channels(rec, i, o):
     (NaN-)sums all the channels together in signal i and saves it to signal o.
     '''
     fn = lambda x: np.nansum(x, axis=0, keepdims=True)
-    return [rec.add_signal(rec[i].transform(fn, o))]
+    return [rec.add_signal(rec[i].transform(fn, o, segmentwise=True))]
+
+
+def sum_channels_kernel(x, out=None):
+    '''Array-level sum_channels, see nems.modelspec.compile.'''
+    return np.nansum(x, axis=0, keepdims=True, out=out)
@@ -19,12 +19,28 @@ def gaussian_coefficients(mean, sd, n_chan_in, **kwargs):
     # mean[mean > 1] = 1
     sd = np.asanyarray(sd)[..., np.newaxis]
     coefficients = 1/(sd*(2*np.pi)**0.5) * np.exp(-0.5*((x-mean)/sd)**2)
-    csum = np.sum(coefficients, axis=1, keepdims=True)
+    csum = np.sum(coefficients, axis=-1, keepdims=True)
     csum[csum == 0] = 1
     coefficients /= csum
     return coefficients
 
 
+def _normalize_coefficients(coefficients):
+    # Scale each output channel's weights to sum to 1 in absolute value
+    c = coefficients.copy()
+    sc = np.sum(np.abs(c), axis=-1, keepdims=True)
+    sc[sc == 0] = 1
+    c /= sc
+    return c
+
+
+def _as_input_dtype(coefficients, x):
+    # Weight float32 inputs in float32 rather than promoting them to float64
+    if x.dtype.kind == 'f':
+        return np.asarray(coefficients, dtype=x.dtype)
+    return coefficients
+
+
 #-------------------------------------------------------------------------------
 # Module functions
 #-------------------------------------------------------------------------------
@@ -40,15 +56,12 @@ def basic(rec, i, o, coefficients, normalize_coefs=False):
         (e.g., `x.shape[-3] == coefficients.shape[-1]`).
     '''
     if normalize_coefs:
-        c = coefficients.copy()
-        sc = np.sum(np.abs(c), axis=1, keepdims=True)
-        sc[sc == 0] = 1
-        c /= sc
-        fn = lambda x: c @ x
+        c = _normalize_coefficients(coefficients)
+        fn = lambda x: _as_input_dtype(c, x) @ x
     else:
-        fn = lambda x: coefficients @ x
+        fn = lambda x: _as_input_dtype(coefficients, x) @ x
 
-    return [rec[i].transform(fn, o)]
+    return [rec[i].transform(fn, o, segmentwise=True)]
 
 
 def basic_with_offset(rec, i, o, coefficients, offset, normalize_coefs=False):
@@ -64,15 +77,12 @@ def basic_with_offset(rec, i, o, coefficients, offset, normalize_coefs=False):
     '''
 
     if normalize_coefs:
-        c = coefficients.copy()
-        sc = np.sum(np.abs(c), axis=1, keepdims=True)
-        sc[sc == 0] = 1
-        c /= sc
+        c = _normalize_coefficients(coefficients)
     else:
         c = coefficients
 
-    fn = lambda x: c @ x + offset
-    return [rec[i].transform(fn, o)]
+    fn = lambda x: _as_input_dtype(c, x) @ x + offset
+    return [rec[i].transform(fn, o, segmentwise=True)]
 
 
 def gaussian(rec, i, o, n_chan_in, mean, sd, **kw_args):
@@ -91,5 +101,35 @@ def gaussian(rec, i, o, n_chan_in, mean, sd, **kw_args):
         Standard deviation of Gaussian channel weights
     '''
     coefficients = gaussian_coefficients(mean, sd, n_chan_in)
-    fn = lambda x: coefficients @ x
-    return [rec[i].transform(fn, o)]
+    fn = lambda x: _as_input_dtype(coefficients, x) @ x
+    return [rec[i].transform(fn, o, segmentwise=True)]
+
+
+#-------------------------------------------------------------------------------
+# Array-level kernels, see nems.modelspec.compile
+#-------------------------------------------------------------------------------
+def basic_kernel(x, coefficients, normalize_coefs=False, out=None):
+    if normalize_coefs:
+        coefficients = _normalize_coefficients(coefficients)
+    return np.matmul(_as_input_dtype(coefficients, x), x, out=out)
+
+
+def basic_with_offset_kernel(x, coefficients, offset, normalize_coefs=False,
+                             out=None):
+    y = basic_kernel(x, coefficients, normalize_coefs, out=out)
+    return np.add(y, offset, out=y)
+
+
+def gaussian_kernel(x, n_chan_in, mean, sd, out=None, **kw_args):
+    coefficients = gaussian_coefficients(mean, sd, n_chan_in)
+    return np.matmul(_as_input_dtype(coefficients, x), x, out=out)
+
+
+# The coefficients of a batch of models stack along a leading axis, which
+# matmul broadcasts over.
+def basic_batch_kernel(x, coefficients, normalize_coefs=False):
+    return basic_kernel(x, coefficients, normalize_coefs)
+
+
+def gaussian_batch_kernel(x, n_chan_in, mean, sd, **kw_args):
+    return gaussian_kernel(x, n_chan_in, mean, sd)
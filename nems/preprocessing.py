@@ -33,7 +33,8 @@ def generate_average_sig(signal_to_average,
     #    and each value in the dictionary is (reps X cell X bins)
     epochs_to_extract = ep.epoch_names_matching(signal_to_average.epochs,
                                                 epoch_regex)
-    folded_matrices = signal_to_average.extract_epochs(epochs_to_extract)
+    folded_matrices = signal_to_average.extract_epochs(epochs_to_extract,
+                                                       copy=False)
 
     # 2. Average over all reps of each stim and save into dict called psth.
     per_stim_psth = dict()
@@ -124,7 +125,8 @@ def average_away_epoch_occurrences(recording, epoch_regex='^STIM_'):
 
         # Extract all occurances of each epoch, returning a dict where keys are
         # stimuli and each value in the dictionary is (reps X cell X bins)
-        epoch_data = signal.rasterize().extract_epochs(epoch_names)
+        epoch_data = signal.rasterize().extract_epochs(epoch_names,
+                                                       copy=False)
 
         # Average over all occurrences of each epoch
         for epoch_name, epoch in epoch_data.items():
@@ -415,9 +417,9 @@ def generate_psth_from_resp(rec, epoch_regex='^STIM_', smooth_resp=False):
     # compute spont rate during valid (non-masked) trials
     if 'mask' in newrec.signals.keys():
         prestimsilence = resp.extract_epoch('PreStimSilence',
-                                            mask=newrec['mask'])
+                                            mask=newrec['mask'], copy=False)
     else:
-        prestimsilence = resp.extract_epoch('PreStimSilence')
+        prestimsilence = resp.extract_epoch('PreStimSilence', copy=False)
 
     if len(prestimsilence.shape) == 3:
         spont_rate = np.nanmean(prestimsilence, axis=(0, 2))
@@ -439,11 +441,14 @@ def generate_psth_from_resp(rec, epoch_regex='^STIM_', smooth_resp=False):
     elif type(epoch_regex) == str:
         epochs_to_extract = ep.epoch_names_matching(resp.epochs, epoch_regex)
 
+    # smoothing below writes into the folded matrices
     if 'mask' in newrec.signals.keys():
         folded_matrices = resp.extract_epochs(epochs_to_extract,
-                                              mask=newrec['mask'])
+                                              mask=newrec['mask'],
+                                              copy=smooth_resp)
     else:
-        folded_matrices = resp.extract_epochs(epochs_to_extract)
+        folded_matrices = resp.extract_epochs(epochs_to_extract,
+                                              copy=smooth_resp)
 
     # 2. Average over all reps of each stim and save into dict called psth.
     per_stim_psth = dict()
@@ -517,7 +522,7 @@ def generate_psth_from_est_for_both_est_and_val(est, val,
     resp_val = val['resp'].rasterize()
 
     # compute PSTH response and spont rate during those valid trials
-    prestimsilence = resp_est.extract_epoch('PreStimSilence')
+    prestimsilence = resp_est.extract_epoch('PreStimSilence', copy=False)
     if len(prestimsilence.shape) == 3:
         spont_rate = np.nanmean(prestimsilence, axis=(0, 2))
     else:
@@ -525,7 +530,7 @@ def generate_psth_from_est_for_both_est_and_val(est, val,
 
     epochs_to_extract = ep.epoch_names_matching(resp_est.epochs, epoch_regex)
     folded_matrices = resp_est.extract_epochs(epochs_to_extract,
-                                              mask=est['mask'])
+                                              mask=est['mask'], copy=False)
 
     # 2. Average over all reps of each stim and save into dict called psth.
     per_stim_psth = dict()
@@ -4,18 +4,19 @@ import gzip
 import time
 import tarfile
 import logging
-import requests
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import copy
-import tempfile
-import shutil
 import json
 
-from nems.uri import local_uri, http_uri, targz_uri
+from nems.uri import local_uri, http_uri, targz_uri, open_http_resource, \
+    get_session, put_stream
 import nems.epoch as ep
+from nems import get_setting
 from nems.signal import SignalBase, RasterizedSignal, merge_selections, \
-                        list_signals, load_signal, load_signal_from_streams
+                        list_signals, load_signal, load_signal_from_parts, \
+                        read_signal_file
 from nems.utils import recording_filename_hash
 
 log = logging.getLogger(__name__)
@@ -47,6 +48,8 @@ class Recording:
         else:
             self.meta = {}
 
+        self._share_epoch_tables()
+
     def copy(self):
         '''
         Returns a copy of this recording.
@@ -59,21 +62,64 @@ class Recording:
             setattr(other, k, copy.copy(v))
         return other
 
+    def astype(self, dtype):
+        '''
+        Returns a copy of this recording with the floating point data of
+        every signal cast to dtype (see RasterizedSignal.astype).
+        '''
+        other = self.copy()
+        other.signals = {k: s.astype(dtype) for k, s in self.signals.items()}
+        return other
+
+    def _share_epoch_tables(self):
+        '''
+        Makes signals with equal epochs hold the same EpochTable, and has the
+        tables code into one list of names.
+        '''
+        tables = []
+        for signal in self.signals.values():
+            table = signal.epoch_table
+            if table is None or any(table is t for t in tables):
+                continue
+            for t in tables:
+                if table.equals(t):
+                    signal.epochs = t
+                    break
+            else:
+                if tables and table.names is not tables[0].names:
+                    table = table.recoded(tables[0].names)
+                    signal.epochs = table
+                tables.append(table)
+
     @property
     def epochs(self):
         '''
         The epochs of a recording is the superset of all signal epochs.
+        It is computed again only when the epochs of a signal change, so
+        do not modify it in place.
         '''
+        tables = [s.epoch_table for s in self.signals.values()]
+        cached = getattr(self, '_epochs_cache', None)
+        if cached is not None and len(cached[0]) == len(tables) and \
+                all(a is b for a, b in zip(cached[0], tables)):
+            return cached[1]
+
         # Merge the epochs. Be sure to ignore index since it's just a standard
         # sequential index for each signal's epoch (e.g., index 1 in signal1 has
         # no special meaning compared to index 1 in signal2). Drop all
         # duplicates since we sometimes replicate epochs across signals and
-        # return the sorted values.
-        epoch_set = [s.epochs for s in self.signals.values()]
+        # return the sorted values. Signals sharing a table would only add
+        # duplicates, so each table is included once.
+        distinct = []
+        for t in tables:
+            if t is not None and not any(t is d for d in distinct):
+                distinct.append(t)
+        epoch_set = [t.to_dataframe() for t in distinct]
         df = pd.concat(epoch_set, ignore_index=True)
         df.drop_duplicates(inplace=True)
         df.sort_values('start', inplace=True)
         df.index = np.arange(len(df))
+        self._epochs_cache = (tables, df)
         return df
 
     # Defining __getitem__ and __setitem__ make recording objects behave
@@ -127,7 +173,7 @@ class Recording:
         return rec
 
     @staticmethod
-    def load_dir(directory_or_targz):
+    def load_dir(directory_or_targz, workers=None):
         '''
         Loads all the signals (CSV/JSON pairs) found in DIRECTORY or
         .tgz file, and returns a Recording object containing all of them.
@@ -136,7 +182,7 @@ class Recording:
         if os.path.isdir(directory_or_targz):
             files = list_signals(directory_or_targz)
             basepaths = [os.path.join(directory_or_targz, f) for f in files]
-            signals = [load_signal(f) for f in basepaths]
+            signals = _map_workers(load_signal, basepaths, workers)
             signals_dict = {s.name: s for s in signals}
             return Recording(signals=signals_dict)
         else:
@@ -144,14 +190,14 @@ class Recording:
             raise ValueError(m)
 
     @staticmethod
-    def load_targz(targz):
+    def load_targz(targz, workers=None):
         '''
         Loads the recording object from a tgz file.
         DEPRECATED???
         '''
         if os.path.exists(targz):
             with open(targz, 'rb') as stream:
-                return load_recording_from_targz_stream(stream)
+                return load_recording_from_targz_stream(stream, workers)
         else:
             m = 'Not a .tgz file: {}'.format(targz)
             raise ValueError(m)
@@ -162,20 +208,19 @@ class Recording:
         Loads the recording object from a URL. File must be tgz format.
         DEPRECATED???
         '''
-        r = requests.get(url, stream=True)
-        if not (r.status_code == 200 and
-                (r.headers['content-type'] == 'application/gzip' or
-                 r.headers['content-type'] == 'text/plain' or
-                 r.headers['content-type'] == 'application/x-gzip' or
-                 r.headers['content-type'] == 'application/x-compressed' or
-                 r.headers['content-type'] == 'application/x-tar' or
-                 r.headers['content-type'] == 'application/x-tgz')):
-            log.info('got response: %s, %d', r.headers, r.status_code)
-            m = 'Error loading URL: {}'.format(url)
-            log.error(m)
-            raise Exception(m)
-        obj = io.BytesIO(r.raw.read()) # Not sure why I need this!
-        return load_recording_from_targz_stream(obj)
+        content_type, stream = open_http_resource(url)
+        with stream:
+            if not (content_type == 'application/gzip' or
+                    content_type == 'text/plain' or
+                    content_type == 'application/x-gzip' or
+                    content_type == 'application/x-compressed' or
+                    content_type == 'application/x-tar' or
+                    content_type == 'application/x-tgz'):
+                log.info('got content-type: %s', content_type)
+                m = 'Error loading URL: {}'.format(url)
+                log.error(m)
+                raise Exception(m)
+            return load_recording_from_targz_stream(stream)
 
     @staticmethod
     def load_from_arrays(arrays, rec_name, fs, sig_names=None,
@@ -344,10 +389,13 @@ class Recording:
         else:
             raise ValueError('Invalid URI: {}'.format(uri))
 
-    def save_dir(self, directory):
+    def save_dir(self, directory, data_format='npy'):
         '''
         Saves all the signals (CSV/JSON pairs) in this recording into
         DIRECTORY in a new directory named the same as this recording.
+
+        data_format is passed on to RasterizedSignal.save; use 'h5' for
+        recordings that should later be loaded lazily with mmap=True.
         '''
         # SVD moved recname adding to save
         #if os.path.isdir(directory):
@@ -360,12 +408,15 @@ class Recording:
         if not os.path.isdir(directory):
             os.makedirs(directory, exist_ok=True)
         for s in self.signals.values():
-            s.save(directory)
+            if isinstance(s, RasterizedSignal):
+                s.save(directory, data_format=data_format)
+            else:
+                s.save(directory)
 
         # Save meta dictionary to json file. Works?
         metafilepath = directory + os.sep + self.name + '.meta.json'
-        md_fh = open(metafilepath, 'w')
-        self._save_metadata(md_fh)
+        with open(metafilepath, 'w') as md_fh:
+            self._save_metadata(md_fh)
 
         return directory
 
@@ -379,9 +430,7 @@ class Recording:
             os.makedirs(directory, mode=0o0777)
         os.umask(0o0000)
         with open(uri, 'wb') as archive:
-            tgz = self.as_targz()
-            archive.write(tgz.read())
-            tgz.close()
+            self._write_targz(archive)
         return uri
 
     def as_targz(self):
@@ -396,23 +445,43 @@ class Recording:
                 tgz = rec.as_targz()
                 fh.write(tgz.read())
                 tgz.close()  # Don't forget to close it!
+
+        To avoid holding the whole archive in memory, use iter_targz().
         '''
         f = io.BytesIO()  # Create a buffer
-        tar = tarfile.open(fileobj=f, mode='w:gz')
-        # tar = tarfile.open('/home/ivar/poopy.tgz', mode='w:gz')
-        # With the tar buffer open, write meta data, then all signal files
+        self._write_targz(f)
+        f.seek(0)
+        return f
+
+    def iter_targz(self):
+        '''
+        Yields the rec's .tgz stream as successive chunks of bytes, one or
+        more per signal file, so that only a single signal is ever held in
+        memory. Suitable as the body of a chunked HTTP upload.
+        '''
+        sink = _ChunkSink()
+        tar = tarfile.open(fileobj=sink, mode='w|gz')
+        for info, stream in self._targz_members():
+            tar.addfile(info, stream)
+            yield from sink.drain()
+        tar.close()
+        yield from sink.drain()
+
+    def _write_targz(self, fileobj):
+        with tarfile.open(fileobj=fileobj, mode='w|gz') as tar:
+            for info, stream in self._targz_members():
+                tar.addfile(info, stream)
 
-        # save meta
+    def _targz_members(self):
+        '''
+        Yields (TarInfo, stream) for the meta data and then every signal
+        file, building each one only when it is needed.
+        '''
         metafilebase = self.name + '.meta.json'
         md_fh = io.StringIO()
         self._save_metadata(md_fh)
         stream = io.BytesIO(md_fh.getvalue().encode())
-        info = tarfile.TarInfo(os.path.join(self.name, metafilebase))
-        info.uname = 'nems'  # User name
-        info.gname = 'users'  # Group name
-        info.mtime = time.time()
-        info.size = stream.getbuffer().nbytes
-        tar.addfile(info, stream)
+        yield _tar_info(os.path.join(self.name, metafilebase), stream), stream
 
         for s in self.signals.values():
             d = s.as_file_streams()  # Dict mapping filenames to streams
@@ -421,16 +490,8 @@ class Recording:
                     stream = stringstream
                 else:
                     stream = io.BytesIO(stringstream.getvalue().encode())
-                info = tarfile.TarInfo(os.path.join(self.name, filename))
-                info.uname = 'nems'  # User name
-                info.gname = 'users'  # Group name
-                info.mtime = time.time()
-                info.size = stream.getbuffer().nbytes
-                tar.addfile(info, stream)
-
-        tar.close()
-        f.seek(0)
-        return f
+                info = _tar_info(os.path.join(self.name, filename), stream)
+                yield info, stream
 
     def save_url(self, uri, compressed=False):
         '''
@@ -442,7 +503,7 @@ class Recording:
         if not rec.save_url(url):
              rec.save('/tmp/')   # Save to /tmp as a fallback
         '''
-        r = requests.put(uri, data=self.as_targz())
+        r = put_stream(uri, self.iter_targz)
         if r.status_code == 200:
             return uri
         else:
@@ -481,6 +542,7 @@ class Recording:
                             " a Signal class. signal {} was type: {}"
                             .format(signal.name, type(signal)))
         self.signals[signal.name] = signal
+        self._share_epoch_tables()
 
     def _split_helper(self, fn):
         '''
@@ -601,13 +663,10 @@ class Recording:
 
         else:
             # only keep epoch matching mask
-            m_data = self['mask'].as_continuous().copy()
             all_epochs = self['mask'].get_epoch_indices(epoch_name)
-
-            epochs = np.zeros([0, 2], dtype=np.int32)
-            for lb, ub in all_epochs:
-                if np.sum(1 - (m_data[0, lb:ub])) == 0:
-                    epochs = np.append(epochs, [[lb, ub]], axis=0)
+            all_epochs = np.reshape(all_epochs, (-1, 2)).astype(np.int32)
+            covered = self['mask'].as_intervals().covers(all_epochs)
+            epochs = all_epochs[covered]
 
         return epochs
 
@@ -653,8 +712,7 @@ class Recording:
         else:
             rec = self.copy()
 
-        # initialize mask to be all True
-        m_data = rec['mask'].as_continuous().copy()
+        m = rec['mask'].as_intervals()
 
         # find all matching epochs
         epochs = self.get_epoch_indices(epoch_name)
@@ -681,19 +739,15 @@ class Recording:
             idx_data = idx_data.reshape(njacks, nrows)
 
         # jmask = bins that should be excluded, on top of whatever is already
-        # False in m_data
-        jmask = np.zeros_like(m_data, dtype=np.bool)
-        for idx in idx_data[jack_idx].tolist():
-            if idx < occurrences:
-                lb, ub = epochs[idx]
-                jmask[:, lb:ub] = True
+        # False in the mask
+        idx = idx_data[jack_idx]
+        jmask = ep.IntervalMask.from_slices(epochs[idx[idx < occurrences]],
+                                            m.ntimes)
 
         if invert:
             jmask = ~jmask
 
-        m_data[jmask] = False
-
-        rec['mask'] = rec['mask']._modified_copy(m_data)
+        rec['mask'] = rec['mask']._modified_copy(m & ~jmask)
 
         return rec
 
@@ -904,7 +958,7 @@ class Recording:
             sig_name = list(rec.signals.keys())[0]
             base_signal = rec[sig_name]
 
-        mask = base_signal.generate_epoch_mask(epoch)
+        mask = base_signal.generate_epoch_intervals(epoch)
 
         try:
             mask_sig = base_signal._modified_copy(mask)
@@ -932,14 +986,14 @@ class Recording:
             rec = self.create_mask(False)
         else:
             rec = self.copy()
-        or_mask = rec['mask'].generate_epoch_mask(epoch)
+        or_mask = rec['mask'].generate_epoch_intervals(epoch)
 
         # Invert
         if invert:
             or_mask = ~or_mask
 
         # apply or_mask to existing mask
-        m = rec['mask'].as_continuous()
+        m = rec['mask'].as_intervals()
         rec['mask'] = rec['mask']._modified_copy(m | or_mask)
 
         return rec
@@ -961,14 +1015,14 @@ class Recording:
             rec = self.create_mask(True)
         else:
             rec = self.copy()
-        and_mask = rec['mask'].generate_epoch_mask(epoch)
+        and_mask = rec['mask'].generate_epoch_intervals(epoch)
 
         # Invert
         if invert:
             and_mask = ~and_mask
 
         # apply and_mask to existing mask
-        m = rec['mask'].as_continuous()
+        m = rec['mask'].as_intervals()
         rec['mask'] = rec['mask']._modified_copy(m & and_mask)
 
         return rec
@@ -983,18 +1037,13 @@ class Recording:
 
         rec = self.copy()
         sig = rec['mask']
+        m = sig.as_intervals()
 
-        if np.sum(sig._data == False) == 0:
+        if m.all():
             # mask is all true, passthrough
             return rec
 
-        m = rec['mask']._data[0, :].copy()
-        z = np.array([0])
-        m = np.concatenate((z, m, z))
-        s, = np.nonzero(np.diff(m) > 0)
-        e, = np.nonzero(np.diff(m) < 0)
-
-        times = (np.vstack((s, e))/sig.fs).T
+        times = m.as_times(sig.fs)
         # if times[-1,1]==times[-1,0]:
         #    times = times[:-1,:]
         # log.info('masking')
@@ -1004,85 +1053,120 @@ class Recording:
         return newrec
 
 ## I/O functions
-def load_recording_from_targz(targz):
+def _tar_info(name, stream):
+    info = tarfile.TarInfo(name)
+    info.uname = 'nems'  # User name
+    info.gname = 'users'  # Group name
+    info.mtime = time.time()
+    info.size = stream.getbuffer().nbytes
+    return info
+
+
+class _ChunkSink(io.RawIOBase):
+    '''
+    Write-only file object that collects whatever is written to it until
+    drain() hands it back; lets tarfile produce an archive piece by piece.
+    '''
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def load_recording_from_targz(targz, workers=None):
     if os.path.exists(targz):
         with open(targz, 'rb') as stream:
-            return load_recording_from_targz_stream(stream)
+            return load_recording_from_targz_stream(stream, workers)
     else:
         m = 'Not a .tgz file: {}'.format(targz)
         raise ValueError(m)
 
 
-def load_recording_from_targz_stream(tgz_stream):
+def load_recording_from_targz_stream(tgz_stream, workers=None):
     '''
-    Loads the recording object from the given .tgz stream, which
-    is expected to be a io.BytesIO object.
-    For hdf5 files, copy to temporary directory and load with hdf5 utility
+    Loads the recording object from the given .tgz stream, which may be any
+    readable binary file object, including non-seekable ones such as the raw
+    body of an HTTP response.
+
+    The archive is read sequentially and each member is parsed as it is
+    reached: binary data is read straight into its final array, text files
+    are parsed incrementally and HDF5 members are opened from memory. Peak
+    memory is therefore close to the size of the loaded recording.
+
+    If workers is greater than 1, each member is instead read into memory
+    and handed to a pool of that many threads to parse, so that parsing
+    overlaps with decompressing the rest of the archive.
     '''
-    tpath=None
     meta = {}
-    streams = {}  # For holding file streams as we unpack
-    with tarfile.open(fileobj=tgz_stream, mode='r:gz') as t:
-        for member in t.getmembers():
-            if member.size == 0:  # Skip empty files
-                continue
-            basename = os.path.basename(member.name)
-            # Now put it in a subdict so we can find it again
-            signame = str(basename.split('.')[0:2])
-            if basename.endswith('meta.json'):
-                f = io.StringIO(t.extractfile(member).read().decode('utf-8'))
-                meta = json.load(f)
-                f = None
-            elif basename.endswith('epoch.csv'):
-                keyname = 'epoch_stream'
-                f = io.StringIO(t.extractfile(member).read().decode('utf-8'))
-
-            elif basename.endswith('.csv'):
-                keyname = 'data_stream'
-                f = io.StringIO(t.extractfile(member).read().decode('utf-8'))
-
-            elif basename.endswith('.h5'):
-                keyname = 'data_stream'
-                #f_in = io.BytesIO(t.extractfile(member).read())
-
-                # current non-optimal solution. extract hdf5 file to disk and then load
-                if not tpath:
-                    tpath=tempfile.mktemp()
-                t.extract(member,tpath)
-                f=tpath+'/'+member.name
-
-            elif basename.endswith('.json'):
-                keyname = 'json_stream'
-                f = io.StringIO(t.extractfile(member).read().decode('utf-8'))
-
-            else:
-                m = 'Unexpected file found in tgz: {} (size={})'.format(member.name, member.size)
-                raise ValueError(m)
-
-            if f is not None:
-                # Ensure that we can doubly nest the streams dict
-                if signame not in streams:
-                    streams[signame] = {}
-                # Read out a stringIO object for each file now while it's open
-                #f = io.StringIO(t.extractfile(member).read().decode('utf-8'))
-                streams[signame][keyname] = f
-
-    # Now that the streams are organized, convert them into signals
-    # log.debug({k: streams[k].keys() for k in streams})
-    signals = [load_signal_from_streams(**sg) for sg in streams.values()]
+    parts = {}  # For holding parsed signal files as we unpack
+    pending = []  # (signame, future) pairs when parsing in a pool
+    pool = ThreadPoolExecutor(workers) if workers and workers > 1 else None
+    try:
+        with tarfile.open(fileobj=tgz_stream, mode='r|gz') as t:
+            for member in t:
+                if member.size == 0:  # Skip empty files
+                    continue
+                basename = os.path.basename(member.name)
+                fileobj = t.extractfile(member)
+                if basename.endswith('meta.json'):
+                    meta = json.load(fileobj)
+                    continue
+
+                # Now put it in a subdict so we can find it again
+                signame = str(basename.split('.')[0:2])
+                if pool is None:
+                    part, value = read_signal_file(basename, fileobj)
+                    parts.setdefault(signame, {})[part] = value
+                else:
+                    buf = io.BytesIO(fileobj.read())
+                    future = pool.submit(read_signal_file, basename, buf)
+                    pending.append((signame, future))
+
+        for signame, future in pending:
+            part, value = future.result()
+            parts.setdefault(signame, {})[part] = value
+
+        # Now that the files are parsed, convert them into signals
+        signals = _map_workers(lambda p: load_signal_from_parts(**p),
+                               list(parts.values()), workers, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
     signals_dict = {s.name: s for s in signals}
 
-    rec = Recording(signals=signals_dict, meta=meta)
-
-    if tpath:
-        shutil.rmtree(tpath) # clean up if tpath is not None
+    return Recording(signals=signals_dict, meta=meta)
 
-    return rec
-
-def load_recording(uri):
+def load_recording(uri, mmap=False, workers=None, dtype=None):
     '''
     Loads from a local .tgz file, a local directory, from s3,
-    or from an HTTP URL containing a .tgz file. Examples:
+    or from an HTTP URL containing a .tgz file.
+
+    If mmap is True, uri must be a local directory (see
+    Recording.save(uri, uncompressed=True)). Each RasterizedSignal's data is
+    then a read-only np.memmap onto its .npy file, so data is only paged in
+    when a module or metric touches it, and processes loading the same
+    recording share it through the OS page cache. Signals saved with
+    save_dir(..., data_format='h5') are loaded as ChunkedRasterizedSignals
+    instead, which read only the time windows that are asked for.
+
+    If workers is given, up to that many signals are loaded and parsed
+    concurrently in a thread pool.
+
+    Floating point signal data is cast to dtype, which defaults to the
+    NEMS_SIGNAL_DTYPE setting. Use 'float32' to halve memory use; model
+    predictions then stay in float32 too. Memory-mapped data is copied if
+    it is not already stored in dtype.
+
+    Examples:
 
     # Load all signals in the gus016c-a2 directory
     rec = Recording.load('/home/myuser/gus016c-a2')
@@ -1100,58 +1184,99 @@ def load_recording(uri):
     # Load from S3:
     rec = Recording.load('s3://nems.lbhb... TODO')
     '''
+    if mmap and not (local_uri(uri) and not targz_uri(uri)):
+        m = ('Memory-mapping requires an uncompressed local recording '
+             'directory, got: {}').format(uri)
+        raise ValueError(m)
+
     if local_uri(uri):
         if targz_uri(uri):
-            rec = load_recording_from_targz(local_uri(uri))
+            rec = load_recording_from_targz(local_uri(uri), workers)
         else:
-            rec = load_recording_from_dir(local_uri(uri))
+            rec = load_recording_from_dir(local_uri(uri), mmap=mmap,
+                                          workers=workers)
     elif http_uri(uri):
-        rec = load_recording_from_url(http_uri(uri))
+        rec = load_recording_from_url(http_uri(uri), workers)
     elif uri[0:6] == 's3://':
         raise NotImplementedError
     else:
         raise ValueError('Invalid URI: {}'.format(uri))
+    if dtype is None:
+        dtype = get_setting('NEMS_SIGNAL_DTYPE')
+    rec = rec.astype(dtype)
     rec.uri = uri
 
     # TODO ? create copy of 'stim' to 'pred' ?
 
     return rec
 
-def load_recording_from_dir(directory_or_targz):
+def load_recording_from_dir(directory_or_targz, mmap=False, workers=None):
     '''
     Loads all the signals (CSV/JSON pairs) found in DIRECTORY or
     .tgz file, and returns a Recording object containing all of them.
+
+    If mmap is True, binary signal data is memory-mapped read-only rather
+    than read into memory (see load_recording). If workers is given, up to
+    that many signals are loaded concurrently in a thread pool.
     '''
     if os.path.isdir(directory_or_targz):
         files = list_signals(directory_or_targz)
         basepaths = [os.path.join(directory_or_targz, f) for f in files]
-        signals = [load_signal(f) for f in basepaths]
+        signals = _map_workers(lambda f: load_signal(f, mmap=mmap),
+                               basepaths, workers)
         signals_dict = {s.name: s for s in signals}
-        return Recording(signals=signals_dict)
+        meta = _load_dir_metadata(directory_or_targz)
+        return Recording(signals=signals_dict, meta=meta)
     else:
         m = 'Not a directory: {}'.format(directory_or_targz)
         raise ValueError(m)
 
-def load_recording_from_url(url):
+def _map_workers(fn, items, workers, pool=None):
+    '''
+    Returns [fn(item) for item in items], computed in a pool of `workers`
+    threads if workers is greater than 1. Loading is dominated by file I/O,
+    decompression and parsing, which release the GIL, so threads avoid the
+    cost of pickling every signal back from a process pool.
+    '''
+    if not workers or workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    if pool is not None:
+        return list(pool.map(fn, items))
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(fn, items))
+
+def _load_dir_metadata(directory):
+    '''
+    Returns the recording meta dictionary saved by Recording.save_dir, or an
+    empty dict if the directory does not contain a .meta.json file.
+    '''
+    meta = {}
+    for f in os.listdir(directory):
+        if f.endswith('.meta.json'):
+            with open(os.path.join(directory, f), 'r') as fh:
+                meta = json.load(fh)
+    return meta
+
+def load_recording_from_url(url, workers=None):
     '''
     Loads the recording object from a URL. File must be tgz format.
+    Downloads go through the local resource cache (see NEMS_CACHE_DIR),
+    so repeated loads of an unchanged recording are read from disk.
     '''
-    r = requests.get(url, stream=True)
-    if not (r.status_code == 200 and
-            (r.headers['content-type'] == 'application/gzip' or
-             r.headers['content-type'] == 'text/plain' or
-             r.headers['content-type'] == 'application/x-gzip' or
-             r.headers['content-type'] == 'application/x-compressed' or
-             r.headers['content-type'] == 'application/x-compressed-tar' or
-             r.headers['content-type'] == 'application/x-tar' or
-             r.headers['content-type'] == 'application/x-tgz')):
-        log.info('got response: {}, {}'.format(r.headers, r.status_code))
-        log.info('status_code: %d, content-type: %s', r.status_code, r.headers['content-type'])
-        m = 'Error loading URL: {}'.format(url)
-        log.error(m)
-        raise Exception(m)
-    obj = io.BytesIO(r.raw.read()) # Not sure why I need this!
-    return load_recording_from_targz_stream(obj)
+    content_type, stream = open_http_resource(url)
+    with stream:
+        if not (content_type == 'application/gzip' or
+                content_type == 'text/plain' or
+                content_type == 'application/x-gzip' or
+                content_type == 'application/x-compressed' or
+                content_type == 'application/x-compressed-tar' or
+                content_type == 'application/x-tar' or
+                content_type == 'application/x-tgz'):
+            log.info('content-type: %s', content_type)
+            m = 'Error loading URL: {}'.format(url)
+            log.error(m)
+            raise Exception(m)
+        return load_recording_from_targz_stream(stream, workers)
 
 def load_recording_from_arrays(arrays, rec_name, fs, sig_names=None,
                      signal_kwargs={}):
@@ -1357,7 +1482,7 @@ def get_demo_recordings(directory=None, name=None, unpack=False):
                           .format(local))
             else:
                 log.info("Saving file at {} to {}".format(uri, local))
-                r = requests.get(uri, stream=True)
+                r = get_session().get(uri, stream=True)
                 # TODO: clean this up, copied from recordings code.
                 #       All of these content-types have showed up *so far*
                 allowed_headers = [
@@ -11,12 +11,30 @@ import warnings
 import pandas as pd
 import numpy as np
 import h5py
+from numpy.lib.stride_tricks import sliding_window_view
 
 from nems.epoch import (remove_overlap, merge_epoch, epoch_contained,
-                        epoch_intersection, epoch_names_matching)
+                        epoch_intersection, EpochIndex, EpochTable,
+                        IntervalMask)
 
 log = logging.getLogger(__name__)
 
+# Version of the on-disk signal layout, stored in each JSON sidecar as
+# 'format_version'. Version 1 (sidecars without the key) wrote
+# RasterizedSignal data as a transposed (time x chans) CSV text file.
+# Version 2 writes the (chans x time) matrix as a little-endian .npy file
+# and records the choice under 'data_format'. Version 1 files can still
+# be read.
+SIGNAL_FORMAT_VERSION = 2
+
+# Formats that RasterizedSignal.save() and as_file_streams() can write.
+# 'h5' stores the matrix in an HDF5 dataset chunked along time, so that
+# ChunkedRasterizedSignal can read a window without touching the rest.
+RASTER_DATA_FORMATS = ('npy', 'csv', 'h5')
+
+# Approximate size in bytes of each time chunk of an 'h5' signal file
+H5_CHUNK_BYTES = 2**20
+
 
 ################################################################################
 # Utility methods
@@ -34,6 +52,91 @@ def _string_syntax_valid(s):
         return True
 
 
+def _slices_to_mask(bounds, ntimes):
+    '''
+    Boolean [1, ntimes] array that is True over mask[lb:ub] for each (lb, ub)
+    in bounds, built with one difference array and cumsum rather than one
+    slice assignment per row.
+    '''
+    bounds = np.asarray(bounds, dtype=np.int64).reshape(-1, 2)
+    # same meaning of negative and out of range bounds as a slice
+    bounds = np.where(bounds < 0, bounds + ntimes, bounds)
+    bounds = np.clip(bounds, 0, ntimes)
+    lb, ub = bounds[bounds[:, 1] > bounds[:, 0]].T
+    step = (np.bincount(lb, minlength=ntimes + 1) -
+            np.bincount(ub, minlength=ntimes + 1))
+    return (np.cumsum(step[:ntimes]) > 0)[np.newaxis, :]
+
+
+def _scatter_epochs(data, blocks):
+    '''
+    Writes each (indices, epoch_data) pair of blocks into data (chans x
+    time), in place. A 2D epoch_data (chans x time) goes into every
+    occurrence in indices; a 3D one (occurrence x chans x time) has one
+    segment per occurrence. Segments are truncated to the shorter of the
+    two and to the end of data, and where occurrences overlap the one
+    written last wins, as if they had been written one by one.
+
+    All segments are laid side by side in one source matrix and copied
+    with a single fancy-index assignment.
+    '''
+    n_chans, n_times = data.shape
+    sources, lb, start, n = [], [], [], []
+    offset = 0
+    for indices, epoch_data in blocks:
+        indices = np.reshape(indices, (-1, 2)).astype(np.int64)
+        width = epoch_data.shape[-1]
+        if epoch_data.ndim == 2:
+            tile, step = epoch_data, 0
+        else:
+            if len(indices) > epoch_data.shape[0]:
+                raise IndexError('{} occurrences to replace but only {} in '
+                                 'epoch_data'.format(len(indices),
+                                                     epoch_data.shape[0]))
+            tile = epoch_data[:len(indices)].transpose(1, 0, 2)
+            tile, step = tile.reshape(tile.shape[0], -1), width
+        sources.append(np.broadcast_to(tile, (n_chans, tile.shape[1])))
+        lb.append(indices[:, 0])
+        start.append(offset + step * np.arange(len(indices)))
+        n.append(np.minimum(np.minimum(indices[:, 1] - indices[:, 0], width),
+                            n_times - indices[:, 0]))
+        offset += tile.shape[1]
+    if not blocks:
+        return data
+
+    lb, start = np.concatenate(lb), np.concatenate(start)
+    n = np.maximum(np.concatenate(n), 0)
+    # column i of the run for occurrence j, for every occurrence at once
+    within = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    dst = np.repeat(lb, n) + within
+    src = np.repeat(start, n) + within
+
+    order = np.argsort(lb, kind='stable')
+    ends = np.maximum.accumulate((lb + n)[order])
+    if np.any(lb[order][1:] < ends[:-1]):
+        # overlapping occurrences: keep the last write to each column. dst
+        # is a series of increasing runs, which a stable sort merges quickly
+        keep = np.argsort(dst, kind='stable')
+        sorted_dst = dst[keep]
+        keep = keep[np.append(sorted_dst[1:] != sorted_dst[:-1], True)]
+        dst, src = dst[keep], src[keep]
+    if len(dst):
+        data[:, dst] = np.concatenate(sources, axis=1)[:, src]
+    return data
+
+
+def _apply_keeping_precision(fn, x):
+    '''
+    Returns fn(x). Parameters are usually float64, which would silently
+    promote float32 data; keep the output at the precision of the input.
+    '''
+    y = fn(x)
+    if (isinstance(y, np.ndarray) and x.dtype.kind == 'f' and
+            y.dtype.kind == 'f' and y.dtype.itemsize > x.dtype.itemsize):
+        y = y.astype(x.dtype)
+    return y
+
+
 ################################################################################
 # Indexing support
 ################################################################################
@@ -188,12 +291,15 @@ class SignalBase:
         self.norm_gain = norm_gain
 
         if epochs is not None:
-            max_epoch_time = self.epochs["end"].max()
+            max_epoch_time = self._epoch_table.max_end()
         else:
             max_epoch_time = 0
         if isinstance(data, dict):
             # max_event_times = [max(et) for et in self._data.values()]
             max_event_times = [0]
+        elif isinstance(data, list):
+            # segments of a RasterizedSignalSubset
+            max_event_times = [sum(d.shape[-1] for d in data) / fs]
         else:
             max_event_times = [data.shape[1] / fs]
         max_time = max(max_epoch_time, *max_event_times)
@@ -250,14 +356,68 @@ class SignalBase:
         # not implemented yet in epoch.py -- 2/4/2018
         # verify_epoch_integrity(self.epochs)
 
+    @property
+    def epochs(self):
+        '''
+        The epochs of this signal as a DataFrame (see EpochTable). It is
+        shared with every signal holding the same table, so replace it
+        rather than modifying it in place.
+        '''
+        if self._epoch_table is None:
+            return None
+        return self._epoch_table.to_dataframe()
+
+    @epochs.setter
+    def epochs(self, epochs):
+        # Epochs are replaced, never edited in place, so this is the only
+        # place the index can go stale. New names go into the names list
+        # of the table being replaced.
+        names = getattr(getattr(self, '_epoch_table', None), 'names', None)
+        self._epoch_table = EpochTable.of(epochs, names)
+        self._epoch_index = None
+
+    @property
+    def epoch_table(self):
+        '''
+        The EpochTable behind self.epochs.
+        '''
+        return self._epoch_table
+
+    def _get_epoch_index(self):
+        '''
+        Returns the EpochIndex of this signal, building it on first use.
+        '''
+        if self._epoch_index is None:
+            self._epoch_index = EpochIndex(self._epoch_table, self.fs)
+        return self._epoch_index
+
+    def _share_epoch_index(self, signal):
+        '''
+        Hands the epoch index on to a copy of this signal that kept the same
+        epochs, and returns the copy.
+        '''
+        if (signal._epoch_table is self._epoch_table and
+                signal.fs == self.fs):
+            signal._epoch_index = self._epoch_index
+        return signal
+
+    def epoch_names_matching(self, regex_str):
+        '''
+        Returns a sorted list of the epoch names that regex match regex_str.
+        '''
+        return self._get_epoch_index().names_matching(regex_str)
+
     ##
     ## I/O method(s)
     ##
-    def _save_metadata(self, epoch_fh, md_fh, fmt='%.18e'):
+    def _save_metadata(self, epoch_fh, md_fh, fmt='%.18e', data_format=None):
         '''
         Save this signal to a CSV file + JSON sidecar. If desired,
         you may use optional parameter fmt (for example, fmt='%1.3e')
         to alter the precision of the floating point matrices.
+
+        data_format, if given, is recorded in the JSON sidecar so that the
+        loader knows how to parse the accompanying data file.
         '''
 
         self.epochs.to_csv(epoch_fh, sep=',', index=False)
@@ -266,9 +426,13 @@ class SignalBase:
         attributes['segments'] = attributes['segments'].tolist()
         attributes['norm_baseline'] = attributes['norm_baseline'].tolist()
         attributes['norm_gain'] = attributes['norm_gain'].tolist()
+        attributes['format_version'] = SIGNAL_FORMAT_VERSION
+        if data_format is not None:
+            attributes['data_format'] = data_format
         json.dump(attributes, md_fh)
 
-    def _save_metadata_to_dirpath(self, dirpath, fmt='%.18e'):
+    def _save_metadata_to_dirpath(self, dirpath, fmt='%.18e',
+                                  data_format=None):
         # create files
         if not os.path.isdir(dirpath):
             os.makedirs(dirpath, mode=0o0777)
@@ -278,7 +442,7 @@ class SignalBase:
         jsonfilepath = basepath + '.json'
         epochfilepath = basepath + '.epoch.csv'
         with open(jsonfilepath, 'w') as md_fh, open(epochfilepath, 'w') as epoch_fh:
-            self._save_metadata(epoch_fh, md_fh, fmt)
+            self._save_metadata(epoch_fh, md_fh, fmt, data_format)
         return (jsonfilepath, epochfilepath)
 
     def _save_data_to_h5(self, dirpath):
@@ -339,9 +503,7 @@ class SignalBase:
             if self.epochs is None:
                 m = "Signal does not have any epochs defined"
                 raise ValueError(m)
-            mask = self.epochs['name'] == epoch
-            bounds = self.epochs.loc[mask, ['start', 'end']].values
-            bounds = np.round(bounds.astype(float) * self.fs) / self.fs
+            bounds = self._get_epoch_index().bounds(epoch)
         else:
             bounds = epoch
 
@@ -417,58 +579,40 @@ class SignalBase:
         bounds = self.get_epoch_bounds(epoch, boundary_mode, fix_overlap,
                                        overlapping_epoch)
 
-        # Indices of segments and epochs
-        s = 0
-        e = 0
-
-        # Running list of segment offsets
-        o = 0
-        n_segments = len(self.segments)
-        n_epochs = len(bounds)
-        indices = []
-        while True:
-            if s >= n_segments:
-                break
-            if e >= n_epochs:
-                break
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 2)
+        segments = np.asarray(self.segments, dtype=float).reshape(-1, 2)
+        s_lb, s_ub = segments[:, 0], segments[:, 1]
+
+        # Sample offset of each segment once the segments are concatenated.
+        # Round each length before summing, otherwise an index of
+        # 1.999...999 will get converted to 1 rather than 2.
+        lengths = np.round((s_ub - s_lb) * self.fs)
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+        # Bounds are sorted, so each epoch falls in the same or a later
+        # segment than the one before it. Epochs are kept up to the first one
+        # that does not start inside any segment.
+        s = np.searchsorted(s_lb, bounds[:, 0], side='right') - 1
+        inside = (s >= 0) & (bounds[:, 0] < s_ub[np.maximum(s, 0)])
+        n = len(bounds) if inside.all() else np.argmin(inside)
+        bounds, s = bounds[:n], s[:n]
+
+        lb = np.round((bounds[:, 0] - s_lb[s]) * self.fs) + offsets[s]
+        ub = np.round((bounds[:, 1] - s_lb[s]) * self.fs) + offsets[s]
+        if n:
+            indices = np.stack([lb, ub], axis=1).astype('i')
+        else:
+            indices = np.asarray([], dtype='i')
 
-            s_lb, s_ub = self.segments[s]
-            while True:
-                # For given segment, loop through epochs that fall within that
-                # segment and calculate correct indices.
-                e_lb, e_ub = bounds[e]
-                if s_lb <= e_lb < s_ub:
-                    # Be sure to round otherwise an index of 1.999...999 will
-                    # get converted to 1 rather than 2.
-                    lb = round((e_lb-s_lb)*self.fs) + o
-                    ub = round((e_ub-s_lb)*self.fs) + o
-                    indices.append((lb, ub))
-                    e += 1
-                else:
-                    # We are now at an epoch that falls in a different segment.
-                    # Update the running offset. Break out of the loop and pull
-                    # out the next segment.
-                    s += 1
-                    o += round((s_ub-s_lb)*self.fs)
-                    break
-                if e >= n_epochs:
-                    break
-
-        indices = np.asarray(indices, dtype='i')
-
-        if mask is not None:
+        if mask is not None and n:
             # remove instances of the epoch that do not fall in the mask
-            m_data = mask.as_continuous()
-            keepidx = []
-            for i, (lb, ub) in enumerate(indices):
-                #                samples = ub-lb
-                if np.all(m_data[0, lb:ub]):
-                    keepidx.append(i)
-            if len(keepidx) > 0:
-                keepidx = np.array(keepidx)
-                indices = indices[keepidx]
+            keep = mask.as_intervals().covers(indices)
+            if keep.any():
+                indices = indices[keep]
             else:
                 indices = np.array([])
+        elif mask is not None:
+            indices = np.array([])
 
         return indices
 
@@ -505,7 +649,9 @@ class SignalBase:
         md_attributes = ['name', 'chans', 'fs', 'meta', 'recording', 'epochs',
                          'segments', 'signal_type', 'normalization',
                          'norm_baseline', 'norm_gain']
-        return {name: getattr(self, name) for name in md_attributes}
+        # epochs are passed on as the table itself, so that copies share it
+        return {name: self._epoch_table if name == 'epochs'
+                else getattr(self, name) for name in md_attributes}
 
     def add_epoch(self, epoch_name, epoch):
         '''
@@ -603,7 +749,7 @@ class SignalBase:
         epoch_names : list OR string
             if list, list of epoch names to extract. These will be keys in the
             result dictionary.
-            if string, will find matches via nems.epoch.epoch_names_matching
+            if string, will find matches via self.epoch_names_matching
 
         chans : {None, iterable of strings}
             Names of channels to return. If None, return the full set of
@@ -629,7 +775,7 @@ class SignalBase:
 
         if type(epoch_names) is str:
             epoch_regex = epoch_names
-            epoch_names = epoch_names_matching(self.epochs, epoch_regex)
+            epoch_names = self.epoch_names_matching(epoch_regex)
 
         data = {}
         for name in epoch_names:
@@ -648,56 +794,64 @@ class SignalBase:
         #                                 mask=mask)
         #        for name in epoch_names}
 
-    def generate_epoch_mask(self, epoch=True):
+    def _epoch_mask_bounds(self, epoch):
         '''
-        inputs:
-            epoch: {None, boolean, ndarray, string, list}
-             if None, defaults to False
-             if False, initialize mask signal to False for all times
-             if True, initialize mask signal to False for all times
-             if Tx1 ndarray, True where ndarray is true, False elsewhere
-             if Nx2 ndarray, True in N epoch times
-             if string (eoch name), mask is True for epochs with .name==string
-             if list of strings (epoch names), mask is OR combo of all strings
-             if list of tuples (epoch times), mask is OR combo of all epoch times
+        Returns the (N x 2) sample slices that generate_epoch_mask sets to
+        True, for any of the epoch formats it takes.
         '''
-        
-        mask = np.zeros([1, self.ntimes], dtype=np.bool)
         if (epoch is None) or (epoch is False):
-            pass    
+            return np.zeros([0, 2], dtype=np.int64)
 
         elif type(epoch) is str:
             # assuming defaults for boundary_mask and fix_overlap!
-            indices = self.get_epoch_indices(epoch)
-            for lb, ub in indices:
-                mask[:, lb:ub] = True
+            return self.get_epoch_indices(epoch)
 
         elif (type(epoch) is list) and (type(epoch[0]) is tuple):
             #epoch is a list of indicies
-            for (lb, ub) in epoch:
-                mask[:, lb:ub] = True
-                
+            return epoch
+
         elif (type(epoch) is list) and (type(epoch[0]) is str):
             #epoch is a list of epochs
-            mask = self.generate_epoch_mask(epoch[0])
-            for e in epoch [1:]:
-                mask = mask | self.generate_epoch_mask(e)
-                
+            return np.concatenate([np.reshape(self.get_epoch_indices(e),
+                                              (-1, 2)) for e in epoch])
+
         elif (type(epoch) is np.ndarray) and (epoch.ndim==2):
             #epoch is an array of indicies
-            for (lb, ub) in epoch:
-                mask[:, lb:ub] = True
+            return epoch
 
         elif (type(epoch) is np.ndarray) and (epoch.ndim==1):
-            #epoch is an 1darray
-            mask[0, epoch] = True
+            #epoch is an 1darray, of indices or booleans
+            idx = np.arange(self.ntimes)[epoch]
+            return np.stack([idx, idx + 1], axis=1)
 
         elif epoch == True:
-            mask[:] = 1
-            
+            return np.array([[0, self.ntimes]])
+
         else:
             raise RuntimeError('Invalid epoch passed to generate_epoch_mask')
-        return mask
+
+    def generate_epoch_mask(self, epoch=True):
+        '''
+        inputs:
+            epoch: {None, boolean, ndarray, string, list}
+             if None, defaults to False
+             if False, initialize mask signal to False for all times
+             if True, initialize mask signal to False for all times
+             if Tx1 ndarray, True where ndarray is true, False elsewhere
+             if Nx2 ndarray, True in N epoch times
+             if string (eoch name), mask is True for epochs with .name==string
+             if list of strings (epoch names), mask is OR combo of all strings
+             if list of tuples (epoch times), mask is OR combo of all epoch times
+        '''
+        return _slices_to_mask(self._epoch_mask_bounds(epoch), self.ntimes)
+
+    def generate_epoch_intervals(self, epoch=True):
+        '''
+        Same as generate_epoch_mask, but returns an IntervalMask rather than
+        a dense [1, ntimes] array.
+        '''
+        return IntervalMask.from_slices(self._epoch_mask_bounds(epoch),
+                                        self.ntimes)
 
     def epoch_to_signal(self, epoch, indices=None, boundary_mode='exclude',
                         fix_overlap='merge', onsets_only=False, shift=0):
@@ -723,19 +877,20 @@ class SignalBase:
             # find matching epoch periods
             indices = self.get_epoch_indices(epoch, boundary_mode, fix_overlap)
 
-        data = np.zeros([1, self.ntimes], dtype=np.bool)
-        for lb, ub in indices:
-            if onsets_only:
-                data[:, lb] = True
-            else:
-                data[:, lb:ub] = True
+        indices = np.reshape(indices, (-1, 2)).astype(np.int64)
+        if onsets_only:
+            data = np.zeros([1, self.ntimes], dtype=np.bool)
+            data[0, indices[:, 0]] = True
+        else:
+            data = _slices_to_mask(indices, self.ntimes)
         if shift:
             data = np.roll(data, shift, axis=1)
 
         epoch_name = epoch if isinstance(epoch, str) else 'epoch'
         attributes = self._get_attributes()
         attributes['chans'] = [epoch_name]
-        return RasterizedSignal(data=data, safety_checks=False, **attributes)
+        return self._share_epoch_index(
+            RasterizedSignal(data=data, safety_checks=False, **attributes))
         # return self._modified_copy(data, chans=[epoch_name])
 
     @property
@@ -801,6 +956,28 @@ class SignalBase:
         '''
         raise NotImplementedError
 
+    def astype(self, dtype):
+        '''
+        Returns a copy of this signal with its floating point data cast to
+        dtype. Signals that do not hold a data array are returned as is.
+        '''
+        return self
+
+    def _sliceable_data(self):
+        '''
+        Returns the (chans x time) data as an array-like object that supports
+        reading windows with [..., lb:ub]. Subclasses that keep their data on
+        disk return a handle that only reads the requested window.
+        '''
+        return self.as_continuous()
+
+    def as_intervals(self):
+        '''
+        Returns the nonzero samples of the first channel as an IntervalMask.
+        Mostly useful for mask signals.
+        '''
+        return IntervalMask.from_array(self._sliceable_data()[0, :])
+
     def as_matrix(self, epoch_names, overlapping_epoch=None, mask=None):
         """
         Inputs:
@@ -925,51 +1102,59 @@ class RasterizedSignal(SignalBase):
         self.channel_var = np.nanvar(self._data, axis=-1, keepdims=True)
         self.channel_std = np.nanstd(self._data, axis=-1, keepdims=True)
 
-    def as_file_streams(self, fmt='%.18e'):
+    def as_file_streams(self, fmt='%.18e', data_format='npy'):
         '''
-        Returns 3 filestreams for this signal: the csv, json, and epoch.
-        TODO: Better docs and a refactoring of this and save()
+        Returns 3 filestreams for this signal: the data, json, and epoch.
+
+        data_format selects how the data matrix is written: 'npy' (the
+        default) writes a lossless binary .npy stream, 'h5' a time-chunked
+        HDF5 file (see ChunkedRasterizedSignal), and 'csv' the legacy text
+        format using fmt for each value.
         '''
-        # TODO: actually compute these instead of cheating with a tempfile
         files = {}
         filebase = self.recording + '.' + self.name
-        csvfile = filebase + '.csv'
+        datafile = filebase + '.' + data_format
         jsonfile = filebase + '.json'
         epochfile = filebase + '.epoch.csv'
         # Create three streams
-        files[csvfile] = io.BytesIO()
+        files[datafile] = io.BytesIO()
         files[jsonfile] = io.StringIO()
         files[epochfile] = io.StringIO()
         # Write to those streams
-        # Write the CSV file to a bytesIO buffer
-        mat = self.as_continuous()
-        mat = np.swapaxes(mat, 0, 1)
-        np.savetxt(files[csvfile], mat, delimiter=",", fmt=fmt)
-        files[csvfile].seek(0)  # Seek back to start of file
+        _write_rasterized_data(files[datafile], self.as_continuous(),
+                               data_format, fmt)
+        files[datafile].seek(0)  # Seek back to start of file
 
-        self._save_metadata(files[epochfile],files[jsonfile], fmt)
+        self._save_metadata(files[epochfile], files[jsonfile], fmt,
+                            data_format)
 
         return files
 
-    def save(self, dirpath, fmt='%.18e'):
+    def save(self, dirpath, fmt='%.18e', data_format='npy'):
         '''
-        Save this signal to a CSV file + JSON sidecar. If desired,
-        you may use optional parameter fmt (for example, fmt='%1.3e')
-        to alter the precision of the floating point matrices.
+        Save this signal to a data file + JSON sidecar + epoch CSV.
+
+        By default the data is written as a lossless binary .npy file. Pass
+        data_format='h5' for an HDF5 file chunked along time, which can be
+        loaded lazily for recordings too long to hold in memory (see
+        load_signal). Pass data_format='csv' to write the legacy text format
+        instead, in which case optional parameter fmt (for example,
+        fmt='%1.3e') may be used to alter the precision of the floating
+        point matrices.
         '''
 
-        jsonfilepath,epochfilepath=self._save_metadata_to_dirpath(dirpath)
+        jsonfilepath, epochfilepath = self._save_metadata_to_dirpath(
+                dirpath, fmt, data_format)
 
         filebase = self.recording + '.' + self.name
         basepath = os.path.join(dirpath, filebase)
-        csvfilepath = basepath + '.csv'
+        datafilepath = basepath + '.' + data_format
 
-        mat = self.as_continuous()
-        mat = np.swapaxes(mat, 0, 1)
-        # TODO: Why does numpy not support fileobjs like streams?
-        np.savetxt(csvfilepath, mat, delimiter=",", fmt=fmt)
+        # HDF5 needs to read back and seek within the file as it writes
+        with open(datafilepath, 'w+b' if data_format == 'h5' else 'wb') as f:
+            _write_rasterized_data(f, self.as_continuous(), data_format, fmt)
 
-        return (csvfilepath, jsonfilepath, epochfilepath)
+        return (datafilepath, jsonfilepath, epochfilepath)
 
     @staticmethod
     def load(basepath):
@@ -1012,7 +1197,7 @@ class RasterizedSignal(SignalBase):
     @staticmethod
     def list_signals(directory):
         '''
-        Returns a list of all CSV/JSON pairs files found in DIRECTORY,
+        Returns a list of all data/JSON pairs files found in DIRECTORY,
         Paths are relative, not absolute.
         '''
         files = os.listdir(directory)
@@ -1022,12 +1207,14 @@ class RasterizedSignal(SignalBase):
     def _csv_and_json_pairs(files):
         '''
         Given a list of files, return the file basenames (i.e. no extensions)
-        that for which a .CSV and a .JSON file exists.
+        for which a data file (.npy or legacy .csv) and a .JSON file exists.
         '''
         just_fileroot = lambda f: os.path.splitext(os.path.basename(f))[0]
-        csvs = [just_fileroot(f) for f in files if f.endswith('.csv')]
+        datafiles = [just_fileroot(f) for f in files
+                     if f.endswith('.csv') or f.endswith('.npy')
+                     or f.endswith('.h5')]
         jsons = [just_fileroot(f) for f in files if f.endswith('.json')]
-        overlap = set.intersection(set(csvs), set(jsons))
+        overlap = set.intersection(set(datafiles), set(jsons))
         return list(overlap)
 
     def copy(self):
@@ -1042,11 +1229,19 @@ class RasterizedSignal(SignalBase):
         '''
         attributes = self._get_attributes()
         attributes.update(kwargs)
-        return RasterizedSignal(data=data, safety_checks=False, **attributes)
+        if isinstance(data, IntervalMask):
+            signal = MaskSignal(data=data, safety_checks=False, **attributes)
+        elif isinstance(data, list):
+            signal = RasterizedSignalSubset(data=data, safety_checks=False,
+                                            **attributes)
+        else:
+            signal = RasterizedSignal(data=data, safety_checks=False,
+                                      **attributes)
+        return self._share_epoch_index(signal)
 
     def extract_epoch(self, epoch, boundary_mode='exclude',
                       fix_overlap='first', allow_empty=False,
-                      overlapping_epoch=None, mask=None):
+                      overlapping_epoch=None, mask=None, copy=True):
         '''
         Extracts all occurances of epoch from the signal.
 
@@ -1070,6 +1265,12 @@ class RasterizedSignal(SignalBase):
             if provided, onlye extract epochs overlapping periods where
             mask.as_continuous()==True in all time bins
 
+        copy: {True, boolean}
+            if False, the result may be a read-only view of the signal data
+            (when all occurrences have the same length and are evenly
+            spaced, e.g. back to back trials). Use it when the result is
+            only read.
+
         Returns
         -------
         epoch_data : 3D array
@@ -1098,30 +1299,118 @@ class RasterizedSignal(SignalBase):
                 raise IndexError("No matching epochs to extract for: %s\n"
                                  "In signal: %s", epoch, self.name)
 
-        n_samples = np.max(epoch_indices[:, 1]-epoch_indices[:, 0])
+        if not copy:
+            view = self._epoch_view(epoch_indices)
+            if view is not None:
+                return view
+        return self._gather_epochs(epoch_indices)
+
+    def _epoch_view(self, epoch_indices):
+        '''
+        Returns the occurrences in epoch_indices as a read-only (O x C x T)
+        view of the data, or None unless they all have the same length, are
+        evenly spaced and lie inside the signal.
+        '''
+        data = self._sliceable_data()
+        if not (isinstance(data, np.ndarray) and
+                data.dtype in (bool, np.float64)):
+            return None
+        lb, ub = epoch_indices[:, 0], epoch_indices[:, 1]
+        n_samples = ub[0] - lb[0]
+        step = np.diff(lb)
+        if (n_samples <= 0 or np.any(ub - lb != n_samples) or lb[0] < 0 or
+                ub[-1] > data.shape[-1] or np.any(step != step[:1]) or
+                (len(step) and step[0] <= 0)):
+            return None
+        # (C x windows x T); picking every step'th window is still a view
+        windows = sliding_window_view(data, n_samples, axis=-1)
+        step = step[0] if len(step) else 1
+        view = windows[:, lb[0]:lb[-1]+1:step]
+        return view.transpose(1, 0, 2)
+
+    def _gather_epochs(self, epoch_indices, n_samples=None):
+        '''
+        Copies the occurrences in epoch_indices into a new (O x C x T)
+        array, T being n_samples or else the longest occurrence. Shorter
+        occurrences, and those running past the end of the signal, are
+        padded with NaN (False for boolean data).
+        '''
+        lb, ub = epoch_indices[:, 0], epoch_indices[:, 1]
+        if n_samples is None:
+            n_samples = np.max(ub - lb)
         n_epochs = len(epoch_indices)
 
-        data = self.as_continuous()
-        n_chans = data.shape[0]
+        data = self._sliceable_data()
+        n_chans, n_times = data.shape
         if data.dtype == bool:
-            epoch_data = np.full((n_epochs, n_chans, n_samples), False,
-                                 dtype=bool)
+            dtype, fill = bool, False
         else:
-            epoch_data = np.full((n_epochs, n_chans, n_samples), np.nan)
-        # print(epoch)
-
-        for i, (lb, ub) in enumerate(epoch_indices):
-            if ub>data.shape[-1]:
-                ub=data.shape[-1]
-            samples = ub-lb
-            #print(samples)
-            #print([lb, ub])
-            #print(data[..., lb:ub].shape)
-            #print(epoch_data[i, ..., :samples].shape)
-            epoch_data[i, ..., :samples] = data[..., lb:ub]
-
+            dtype, fill = np.float64, np.nan
+
+        if not isinstance(data, np.ndarray):
+            # e.g. an HDF5 dataset, read one window at a time
+            epoch_data = np.full((n_epochs, n_chans, n_samples), fill,
+                                 dtype=dtype)
+            for i, (lb, ub) in enumerate(epoch_indices):
+                if ub>n_times:
+                    ub=n_times
+                samples = ub-lb
+                epoch_data[i, ..., :samples] = data[..., lb:ub]
+            return epoch_data
+
+        # one gather of every sample of every occurrence
+        t = np.arange(n_samples)
+        idx = lb[:, np.newaxis] + t
+        valid = t < (np.minimum(ub, n_times) - lb)[:, np.newaxis]
+        idx = np.where(valid, idx, 0)
+        chans = np.arange(n_chans)[np.newaxis, :, np.newaxis]
+        epoch_data = data[chans, idx[:, np.newaxis, :]].astype(dtype,
+                                                                copy=False)
+        if not valid.all():
+            invalid = np.broadcast_to(~valid[:, np.newaxis, :],
+                                      epoch_data.shape)
+            epoch_data[invalid] = fill
         return epoch_data
 
+    def extract_epochs(self, epoch_names, overlapping_epoch=None, mask=None,
+                       copy=True):
+        '''
+        Same as SignalBase.extract_epochs, but gathers the occurrences of
+        all epochs at once: one gather per distinct epoch length rather than
+        one copy per occurrence. See extract_epoch for copy.
+        '''
+        if type(epoch_names) is str:
+            epoch_regex = epoch_names
+            epoch_names = self.epoch_names_matching(epoch_regex)
+
+        data = {}
+        indices = {}
+        for name in epoch_names:
+            # same defaults as extract_epoch
+            v = self.get_epoch_indices(name, boundary_mode='exclude',
+                                       fix_overlap='first', mask=mask)
+            # only return matrices for epochs with non-empty data matrices
+            # (deal with possibility that some stimuli are masked out)
+            if v.size == 0 or np.max(v[:, 1] - v[:, 0]) <= 0:
+                continue
+            view = None if copy else self._epoch_view(v)
+            if view is not None:
+                data[name] = view
+            else:
+                indices[name] = v
+
+        names = list(indices)
+        widths = np.array([np.max(v[:, 1] - v[:, 0]) for v in indices.values()])
+        for width in np.unique(widths):
+            group = [n for n, w in zip(names, widths) if w == width]
+            gathered = self._gather_epochs(
+                np.concatenate([indices[n] for n in group]), width)
+            split = np.cumsum([len(indices[n]) for n in group])[:-1]
+            data.update(zip(group, np.split(gathered, split)))
+
+        # in the order asked for
+        return {name: data[name] for name in epoch_names if name in data}
+
     def normalize(self, normalization='minmax'):
         '''
         Returns a copy of this signal with each channel normalized to have a
@@ -1180,13 +1469,12 @@ class RasterizedSignal(SignalBase):
         split_idx = max(1, int(self.ntimes * fraction))
         split_time = split_idx/self.fs
 
-        data = self.as_continuous()
-        ldata = data[..., :split_idx]
-        rdata = data[..., split_idx:]
+        ldata = self._segments_between(0, split_idx)
+        rdata = self._segments_between(split_idx, self.ntimes)
 
         lepochs, repochs = self._split_epochs(split_time)
-        lsignal = self._modified_copy(ldata, epochs=lepochs)
-        rsignal = self._modified_copy(rdata, epochs=repochs)
+        lsignal = self._from_segments(ldata, epochs=lepochs)
+        rsignal = self._from_segments(rdata, epochs=repochs)
 
         return lsignal, rsignal
 
@@ -1319,15 +1607,15 @@ class RasterizedSignal(SignalBase):
             split_end = self.ntimes
         else:
             split_end = (jack_idx + 1) * splitsize
-        m = self.as_continuous().copy()
         if excise:
             if invert:
-                o = np.empty((self.nchans, split_end - split_start))
-                o = m[:, split_start:split_end]
+                o = self._segments_between(split_start, split_end)
             else:
-                o = np.delete(m, slice(split_start, split_end), axis=-1)
-            return self._modified_copy(o.reshape(self.nchans, -1))
+                o = (self._segments_between(0, split_start) +
+                     self._segments_between(split_end, self.ntimes))
+            return self._from_segments(o)
         else:
+            m = self.as_continuous().copy()
             if not invert:
                 m[..., split_start:split_end] = np.nan
             else:
@@ -1447,15 +1735,12 @@ class RasterizedSignal(SignalBase):
         if indices.size == 0:
             warnings.warn("No occurrences of epoch were found: \n{}\n"
                           "Nothing to replace.".format(epoch))
-        if epoch_data.ndim == 2:
-            for lb, ub in indices:
-                data[:, lb:ub] = epoch_data
-        else:
-            ii = 0
-            for lb, ub in indices:
-                n = ub-lb
-                data[:, lb:ub] = epoch_data[ii, :, :n]
-                ii += 1
+        elif epoch_data.ndim == 2 and np.any(
+                np.diff(indices, axis=1) != epoch_data.shape[1]):
+            raise ValueError('epoch_data is {} samples long, which does not '
+                             'match every occurrence of {}'
+                             .format(epoch_data.shape[1], epoch))
+        _scatter_epochs(data, [(indices, epoch_data)])
 
         if preserve_nan:
             data[:, nan_bins] = np.nan
@@ -1487,43 +1772,11 @@ class RasterizedSignal(SignalBase):
         if preserve_nan:
             nan_bins = np.isnan(data[0, :])
 
-        # intialize with nans so that any subsequent prediction will be
-        # restricted to the specified epochs
-        # TODO - remove this - not necessary anymore?
-#        if data.dtype == bool:
-#            data[:] = False
-#        else:
-#            data[:] = np.nan
-
-        for epoch, epoch_data in epoch_dict.items():
-            indices = self.get_epoch_indices(epoch, mask=mask)
-            if epoch_data.ndim == 2:
-                # ndim==2: single PSTH to be inserted in every matching epoch
-                for lb, ub in indices:
-                    # SVD kludge to deal with rounding from floating-point time
-                    # to integer bin index --- DEPRECATED????
-#                    if ub-lb < epoch_data.shape[1]:
-#                        # epoch data may be too long bc padded with nans,
-#                        # truncate!
-#                        epoch_data = epoch_data[:, 0:(ub-lb)]
-#                        # ub += epoch_data.shape[1]-(ub-lb)
-#                    elif ub-lb > epoch_data.shape[1]:
-#                        ub -= (ub-lb)-epoch_data.shape[1]
-                    if ub-lb > epoch_data.shape[1]:
-                        ub = lb + epoch_data.shape[1]
-                        #epoch_data = epoch_data[:, 0:(ub-lb)]
-                    #print(ub-lb)
-                    #print(epoch_data.shape)
-                    data[:, lb:ub] = epoch_data[:, :(ub-lb)]
-
-            else:
-                # ndim==3: different segment to insert for each epoch
-                # (assume epoch_data.shape[1] == len(indices))
-                ii = 0
-                for lb, ub in indices:
-                    n = ub-lb
-                    data[:, lb:ub] = epoch_data[ii, :, :n]
-                    ii += 1
+        # ndim==2: single PSTH to be inserted in every matching epoch
+        # ndim==3: different segment to insert for each epoch
+        blocks = [(self.get_epoch_indices(epoch, mask=mask), epoch_data)
+                  for epoch, epoch_data in epoch_dict.items()]
+        _scatter_epochs(data, blocks)
 
         if preserve_nan:
             data[:, nan_bins] = np.nan
@@ -1594,7 +1847,7 @@ class RasterizedSignal(SignalBase):
             'name': 'trial'
         })
 
-    def transform(self, fn, newname=None):
+    def transform(self, fn, newname=None, segmentwise=False):
         '''
         Applies this signal's 2d .as_continuous() matrix representation to
         function fn, which must be a pure (curried) function of one argument.
@@ -1603,15 +1856,31 @@ class RasterizedSignal(SignalBase):
         identical to this one but with different data.
 
         Optional argument newname allows a new signal name to be returned.
+
+        Set segmentwise=True when each output sample only depends on the
+        input at the same time (weighting channels, nonlinearities...): a
+        RasterizedSignalSubset then applies fn to its segments one at a
+        time rather than joining them first.
         '''
         # x = self.as_continuous()   # Always Safe but makes a copy
         x = self._data  # Much faster; TODO: Test if throws warnings
-        y = fn(x)
-        newsig = self._modified_copy(y)
+        newsig = self._modified_copy(_apply_keeping_precision(fn, x))
         if newname:
             newsig.name = newname
         return newsig
 
+    def astype(self, dtype):
+        '''
+        Returns a copy of this signal with its data cast to dtype, e.g.
+        'float32' to halve memory use. Boolean and integer data are left
+        alone, as is data that already has the requested dtype.
+        '''
+        dtype = np.dtype(dtype)
+        current = self._sliceable_data().dtype
+        if current.kind != 'f' or current == dtype:
+            return self
+        return self._modified_copy(self._data.astype(dtype))
+
     def shuffle_time(self, rand_seed=None, mask=None):
         '''
         Applies this signal's 2d .as_continuous() matrix representation to
@@ -1685,11 +1954,12 @@ class RasterizedSignal(SignalBase):
 
         times = np.asarray(times)
         indices = np.round(times*self.fs).astype('i')
-        data = self.as_continuous()
+        if not len(indices):
+            raise ValueError('No times to select')
 
-        subsets = [data[..., lb:ub] for lb, ub in indices]
-        data = np.concatenate(subsets, axis=-1)
-        return self._modified_copy(data, segments=times)
+        subsets = [s for lb, ub in indices
+                   for s in self._segments_between(lb, ub)]
+        return self._from_segments(subsets, segments=times)
 
     def nan_times(self, times, padding=0):
 
@@ -1711,6 +1981,24 @@ class RasterizedSignal(SignalBase):
         """
         return self
 
+    def _segments_between(self, lb, ub):
+        '''
+        Returns samples lb:ub of the data as a list of (chans x time)
+        arrays, which are views wherever the data allows it.
+        '''
+        return [self._sliceable_data()[..., lb:ub]]
+
+    def _from_segments(self, pieces, **kwargs):
+        '''
+        Like _modified_copy, but for a list of pieces of data such as
+        _segments_between returns. Several pieces make a
+        RasterizedSignalSubset instead of being concatenated.
+        '''
+        pieces = [p for p in pieces if p.shape[-1]] or pieces[:1]
+        if len(pieces) == 1:
+            return self._modified_copy(pieces[0], **kwargs)
+        return self._modified_copy(pieces, **kwargs)
+
     def as_continuous(self, mask=None):
         '''
         For SignalBase, return a signal _data variable. -- NOT COPIED!
@@ -1724,20 +2012,156 @@ class RasterizedSignal(SignalBase):
             return self._data[:, mask.as_continuous()[0, :]]
 
 
+class _H5File:
+    '''
+    The open h5py.File behind a ChunkedRasterizedSignal, shared by the
+    signal and its copies and closed once the last of them is dropped.
+    '''
+    def __init__(self, f):
+        self.file = f
+
+    def close(self):
+        # an h5py.File is falsy once closed
+        if self.file:
+            self.file.close()
+
+    def __del__(self):
+        self.close()
+
+
+class ChunkedRasterizedSignal(RasterizedSignal):
+    '''
+    A RasterizedSignal whose data stays on disk in an HDF5 dataset chunked
+    along time (see RasterizedSignal.save(..., data_format='h5')), for
+    recordings too long to hold in memory.
+
+    select_times, extract_epoch, get_epoch_indices and as_continuous(mask)
+    read only the chunks overlapping the requested times, and return
+    ordinary in-memory signals or arrays. Anything else that needs the
+    whole matrix (as_continuous(), transform, ...) reads it in full each
+    time it is called.
+    '''
+    def __init__(self, fs, data, name, recording, chans=None, epochs=None,
+                 segments=None, meta=None, safety_checks=True,
+                 normalization='none', **other_attributes):
+        '''
+        Parameters
+        ----------
+        data : h5py.Dataset, 2 dimensional (chans x time)
+        '''
+        SignalBase.__init__(self, fs, data, name, recording, chans, epochs,
+                            segments, meta, safety_checks, normalization)
+        self.iloc = SimpleSignalIndexer(self)
+        self.loc = LabelSignalIndexer(self)
+        self.nchans, self.ntimes = data.shape
+        self.signal_type = str(RasterizedSignal)
+        self._h5file = _H5File(data.file)
+
+    def close(self):
+        '''
+        Closes the HDF5 file now rather than when the signal (and every copy
+        of it, which share the file) is dropped. The signal cannot be read
+        afterwards.
+        '''
+        self._h5file.close()
+
+    @property
+    def _data(self):
+        data = self._dataset[...]
+        data.flags.writeable = False
+        return data
+
+    @_data.setter
+    def _data(self, dataset):
+        self._dataset = dataset
+
+    def _sliceable_data(self):
+        return self._dataset
+
+    def as_continuous(self, mask=None):
+        '''
+        Reads the whole matrix into memory, or, if a mask signal is given,
+        only the runs of time where the mask is True.
+        '''
+        if mask is None:
+            return self._data
+        m = mask.as_intervals()
+        subsets = [self._dataset[:, lb:ub] for lb, ub in m.intervals]
+        if not subsets:
+            return np.empty((self.nchans, 0), dtype=self._dataset.dtype)
+        return np.concatenate(subsets, axis=-1)
+
+    def __getstate__(self):
+        # Open HDF5 handles cannot be pickled; reopen the file by name
+        state = self.__dict__.copy()
+        dataset = state.pop('_dataset')
+        del state['_h5file']
+        state['_h5_source'] = (dataset.file.filename, dataset.name)
+        return state
+
+    def __setstate__(self, state):
+        filename, key = state.pop('_h5_source')
+        self.__dict__.update(state)
+        self._dataset = h5py.File(filename, 'r')[key]
+        self._h5file = _H5File(self._dataset.file)
+
+
+class MaskSignal(RasterizedSignal):
+    '''
+    A one-channel boolean RasterizedSignal whose data is an IntervalMask,
+    as made by Recording.create_mask and friends. Masks are combined as
+    intervals; the dense [1, ntimes] array is only built when something
+    reads the data, and is saved like any other RasterizedSignal.
+    '''
+    def __init__(self, fs, data, name, recording, chans=None, epochs=None,
+                 segments=None, meta=None, safety_checks=True,
+                 normalization='none', **other_attributes):
+        '''
+        Parameters
+        ----------
+        data : IntervalMask
+        '''
+        SignalBase.__init__(self, fs, data, name, recording, chans, epochs,
+                            segments, meta, safety_checks, normalization)
+        self.iloc = SimpleSignalIndexer(self)
+        self.loc = LabelSignalIndexer(self)
+        self.nchans, self.ntimes = data.shape
+        self.signal_type = str(RasterizedSignal)
+
+    @property
+    def _data(self):
+        return self._intervals.as_array()
+
+    @_data.setter
+    def _data(self, intervals):
+        self._intervals = intervals
+
+    def as_intervals(self):
+        return self._intervals
+
+
 class PointProcess(SignalBase):
     '''
     Expects data to be a dictionary of the form:
         {<string>: <ndarray of spike times, one dimensional>}
+
+    Rasters are memoized per sampling rate. Replacing _data or epochs
+    discards them; neither should be modified in place.
     '''
-#    @property
-#    def _data(self):
-#        if self._cached_data is not None:
-#            pass
-#        else:
-#            log.info("matrix doesn't exist yet, "
-#                     "generating from time dict")
-#            self._generate_data()
-#        return self._cached_data
+    @property
+    def _data(self):
+        return self._event_times
+
+    @_data.setter
+    def _data(self, data):
+        self._event_times = data
+        # Rebind rather than clear, since copies share the dict
+        self._rasters = {}
+
+    @SignalBase.epochs.setter
+    def epochs(self, epochs):
+        SignalBase.epochs.fset(self, epochs)
+        self._rasters = {}
 
     def __init__(self, fs, data, name, recording, chans=None, epochs=None,
                  segments=None, meta=None, safety_checks=True,
@@ -1770,7 +2194,8 @@ class PointProcess(SignalBase):
         """
         attributes = self._get_attributes()
         attributes.update(kwargs)
-        return PointProcess(data=data, safety_checks=False, **attributes)
+        return self._share_epoch_index(
+            PointProcess(data=data, safety_checks=False, **attributes))
 
 
     def rasterize(self, fs=None):
@@ -1780,33 +2205,50 @@ class PointProcess(SignalBase):
 
         by default, fs=self.fs, which can be preset to match other signals in a
         recording
+
+        The raster is computed once per fs and then reused.
         """
         if not fs:
             fs=self.fs
 
+        raster = self._rasters.get(fs)
+        if raster is None:
+            raster = self._rasterize(fs)
+            self._rasters[fs] = raster
+        return raster
+
+    def _rasterize(self, fs):
         if self.epochs is not None:
-            max_epoch_time = self.epochs["end"].max()
+            max_epoch_time = self._epoch_table.max_end()
         else:
             max_epoch_time = 0
 
         if max_epoch_time==0:
-            max_event_times = [max(et) for et in self._data.values()]
+            max_event_times = [np.max(et) for et in self._data.values()]
             max_time = max(max_epoch_time, *max_event_times)
         else:
             max_time=max_epoch_time
 
         max_bin = np.int(np.ceil(fs*max_time))
         unit_count = len(self._data.keys())
-        raster = np.zeros([unit_count, max_bin])
 
         # _data dictionary has one entry per cell.
         # The output raster should be cell X time
         cellids = sorted(self._data)
-        for i, key in enumerate(cellids):
-            for t in self._data[key]:
-                b = int(np.floor(t*fs))
-                if b < max_bin:
-                    raster[i, b] += 1
+        times = [np.asarray(self._data[key], dtype=np.float64).ravel()
+                 for key in cellids]
+        if times:
+            bins = np.floor(np.concatenate(times) * fs).astype(np.int64)
+            units = np.repeat(np.arange(unit_count), [len(t) for t in times])
+        else:
+            bins = units = np.zeros(0, dtype=np.int64)
+
+        # Count every spike of every cell in one pass over a flattened
+        # (cell, bin) index
+        keep = (bins >= 0) & (bins < max_bin)
+        flat = units[keep] * max_bin + bins[keep]
+        raster = np.bincount(flat, minlength=unit_count * max_bin)
+        raster = raster.reshape(unit_count, max_bin).astype(np.float64)
 
         return RasterizedSignal(fs=self.fs, data=raster, name=self.name,
                                 recording=self.recording, chans=cellids,
@@ -1815,10 +2257,11 @@ class PointProcess(SignalBase):
     def as_continuous(self):
         return self.rasterize()._data
 
-    def transform(self, fn, newname=None):
+    def transform(self, fn, newname=None, segmentwise=False):
         '''
         Rasterize this signal then apply fn and return the result as
-        a new signal.
+        a new signal. segmentwise is accepted for compatibility with
+        RasterizedSignal.transform; the raster is never segmented.
         '''
         x = self.rasterize()
         y = fn(x._data)
@@ -2011,7 +2454,24 @@ class TiledSignal(SignalBase):
     '''
     Expects data to be a dictionary of the form:
         {<string>: <ndarray of stim data, two dimensional>}
+
+    The raster is memoized. Replacing _data or epochs discards it; neither
+    should be modified in place.
     '''
+    @property
+    def _data(self):
+        return self._tiles
+
+    @_data.setter
+    def _data(self, data):
+        self._tiles = data
+        self._raster = None
+
+    @SignalBase.epochs.setter
+    def epochs(self, epochs):
+        SignalBase.epochs.fset(self, epochs)
+        self._raster = None
+
     def __init__(self, fs, data, name, recording, chans=None, epochs=None,
                  segments=None, meta=None, safety_checks=True,
                  normalization='none', **other_attributes):
@@ -2048,34 +2508,41 @@ class TiledSignal(SignalBase):
         Create a rasterized version of the signal and return it
 
         fs is not used but in parameters for compatibility with PointProcess
+
+        The raster is built once and then reused until _data or epochs are
+        replaced.
         '''
-        maxtime = np.max(self.epochs["end"])
+        if self._raster is None:
+            self._raster = self._rasterize()
+        return self._raster
+
+    def _rasterize(self):
+        maxtime = self._epoch_table.max_end()
         maxbin = self.shape[1]
         if self.fs*maxtime > maxbin:
-            maxbin = self.fs*maxtime
+            maxbin = int(np.ceil(self.fs*maxtime))
         tags = list(self._data.keys())
         chancount = self._data[tags[0]].shape[0]
 
-        z = np.zeros([chancount, maxbin])
-        zsig = RasterizedSignal(fs=self.fs, data=z, name=self.name,
+        # Assume that NaN tiles were valid but zero
+        blocks = [(self.get_epoch_indices(tag),
+                   np.nan_to_num(np.asarray(self._data[tag], dtype=np.float64),
+                                 nan=0, posinf=np.inf, neginf=-np.inf))
+                  for tag in tags]
+        z = _scatter_epochs(np.zeros([chancount, maxbin]), blocks)
+
+        return RasterizedSignal(fs=self.fs, data=z, name=self.name,
                                 recording=self.recording, chans=self.chans,
                                 epochs=self.epochs, meta=self.meta)
-        signal = zsig.replace_epochs(self._data)
-
-        # replace nans with zeros. Assume that the signal was valid but zero
-        s = signal._data.copy()
-        s[np.isnan(signal._data)] = 0
-        signal = signal._modified_copy(s)
-
-        return signal
 
     def as_continuous(self):
         return self.rasterize()._data
 
-    def transform(self, fn, newname=None):
+    def transform(self, fn, newname=None, segmentwise=False):
         '''
         Rasterize this signal then apply fn and return the result as
-        a new signal.
+        a new signal. segmentwise is accepted for compatibility with
+        RasterizedSignal.transform; the raster is never segmented.
         '''
         x = self.rasterize()
         y = fn(x._data)
@@ -2235,11 +2702,81 @@ class TiledSignal(SignalBase):
         )
 
 
-class RasterizedSignalSubset(SignalBase):
+class RasterizedSignalSubset(RasterizedSignal):
     '''
-    Expects data to be a list of lists.
+    A RasterizedSignal whose data is a list of (chans x time) segments, as
+    made by select_times, Recording.apply_mask, split_at_time and
+    jackknife_by_time(..., excise=True). The segments are usually views
+    into the data of the signal they were cut from, so making a subset
+    copies nothing, but it does keep that signal's data alive.
+
+    The segments are joined into one matrix the first time anything reads
+    _data or as_continuous(), and the result is kept. Cutting a subset
+    again, or transforming it with segmentwise=True, works on the
+    segments directly.
     '''
-    pass
+    def __init__(self, fs, data, name, recording, chans=None, epochs=None,
+                 segments=None, meta=None, safety_checks=True,
+                 normalization='none', **other_attributes):
+        '''
+        Parameters
+        ----------
+        data : list of ndarrays, 2 dimensional (chans x time)
+        '''
+        SignalBase.__init__(self, fs, data, name, recording, chans, epochs,
+                            segments, meta, safety_checks, normalization)
+        self.iloc = SimpleSignalIndexer(self)
+        self.loc = LabelSignalIndexer(self)
+        self.nchans = self._subsets[0].shape[0]
+        self.ntimes = int(self._bounds[-1])
+        self.signal_type = str(RasterizedSignal)
+
+    @property
+    def _data(self):
+        if self._joined is None:
+            if len(self._subsets) == 1:
+                joined = self._subsets[0]
+            else:
+                joined = np.concatenate(self._subsets, axis=-1)
+            joined.flags.writeable = False
+            self._joined = joined
+        return self._joined
+
+    @_data.setter
+    def _data(self, subsets):
+        if not subsets:
+            raise ValueError('A signal subset needs at least one segment')
+        if len({s.shape[0] for s in subsets}) > 1:
+            raise ValueError('All segments must have the same number of '
+                             'channels')
+        self._subsets = list(subsets)
+        self._bounds = np.cumsum([0] + [s.shape[-1] for s in subsets])
+        self._joined = None
+
+    def _segments_between(self, lb, ub):
+        lb, ub = max(lb, 0), min(ub, self.ntimes)
+        first = max(np.searchsorted(self._bounds, lb, side='right') - 1, 0)
+        pieces = []
+        for start, data in zip(self._bounds[first:], self._subsets[first:]):
+            if start >= ub:
+                break
+            pieces.append(data[..., max(lb - start, 0):ub - start])
+        return pieces or [self._subsets[0][..., :0]]
+
+    def transform(self, fn, newname=None, segmentwise=False):
+        if not segmentwise:
+            return super().transform(fn, newname)
+        newsig = self._modified_copy([_apply_keeping_precision(fn, x)
+                                      for x in self._subsets])
+        if newname:
+            newsig.name = newname
+        return newsig
+
+    def __getstate__(self):
+        # no need to pickle the data twice
+        state = self.__dict__.copy()
+        state['_joined'] = None
+        return state
 
 # -----------------------------------------------------------------------------
 # Functions that work on multiple signal objects
@@ -2255,84 +2792,231 @@ def list_signals(directory):
 def _list_json_files(files):
     '''
     Given a list of files, return the file basenames (i.e. no extensions)
-    that for which a .CSV and a .JSON file exists.
+    of the signal JSON sidecars. Recording metadata (.meta.json) is skipped.
     '''
     just_fileroot = lambda f: os.path.splitext(os.path.basename(f))[0]
-    jsons = [just_fileroot(f) for f in files if f.endswith('.json')]
+    jsons = [just_fileroot(f) for f in files
+             if f.endswith('.json') and not f.endswith('.meta.json')]
     return list(jsons)
 
-def load_signal(basepath):
+def _write_rasterized_data(fh, data, data_format='npy', fmt='%.18e'):
     '''
-    Generic signal loader. Load JSON file, figure out signal type and
-    call appropriate loader
+    Writes the (chans x time) matrix data to the binary file object fh in
+    data_format ('npy' or the legacy transposed 'csv').
     '''
-    csvfilepath = basepath + '.csv'
-    h5filepath = basepath + '.h5'
-    epochfilepath = basepath + '.epoch.csv'
-    jsonfilepath = basepath + '.json'
-    if os.path.isfile(epochfilepath):
-        epochs = pd.read_csv(epochfilepath)
+    if data_format == 'npy':
+        # Always little-endian on disk so files are portable across hosts.
+        data = np.asarray(data)
+        data = data.astype(data.dtype.newbyteorder('<'), copy=False)
+        np.save(fh, data, allow_pickle=False)
+    elif data_format == 'h5':
+        data = np.asarray(data)
+        with h5py.File(fh, 'w') as f:
+            f.create_dataset('data', data=data,
+                             chunks=_h5_chunk_shape(data.shape, data.dtype))
+    elif data_format == 'csv':
+        mat = np.swapaxes(data, 0, 1)
+        np.savetxt(fh, mat, delimiter=",", fmt=fmt)
     else:
-        epochs = None
-    # TODO: reduce code duplication and call load_from_streams
-    with open(jsonfilepath, 'r') as f:
-        js = json.load(f)
+        m = 'Unsupported data_format {}, expected one of {}'
+        raise ValueError(m.format(data_format, RASTER_DATA_FORMATS))
 
+def _h5_chunk_shape(shape, dtype):
+    '''
+    Chunks hold every channel for a run of about H5_CHUNK_BYTES worth of
+    time samples, so reading a time window touches only the chunks in it.
+    '''
+    nchans, ntimes = shape
+    if nchans == 0 or ntimes == 0:
+        return None
+    samples = H5_CHUNK_BYTES // (nchans * np.dtype(dtype).itemsize)
+    return (nchans, int(max(1, min(ntimes, samples))))
+
+def _data_format_from_json(js):
+    '''
+    Returns the data format of a saved RasterizedSignal given its parsed JSON
+    sidecar. Sidecars written before format versioning are CSV.
+    '''
+    version = js.get('format_version', 1)
+    if version > SIGNAL_FORMAT_VERSION:
+        m = ('Signal {} was saved with format version {}, but this version '
+             'of NEMS only reads up to version {}. Please upgrade NEMS.')
+        raise ValueError(m.format(js.get('name'), version,
+                                  SIGNAL_FORMAT_VERSION))
+    return js.get('data_format', 'csv')
+
+def _read_rasterized_data(source, data_format, mmap=False):
+    '''
+    Reads a (chans x time) matrix from source (a file path or file object)
+    stored in data_format.
+
+    If mmap is True and source is the path to a .npy file, a read-only
+    np.memmap onto the file is returned instead of reading it into memory.
+    For an .h5 file, the open h5py dataset is returned, from which windows
+    are read on demand (see ChunkedRasterizedSignal). Other formats cannot
+    be mapped and are read normally.
+    '''
+    if data_format == 'npy':
+        if isinstance(source, str):
+            mmap_mode = 'r' if mmap else None
+            mat = np.load(source, mmap_mode=mmap_mode, allow_pickle=False)
+        else:
+            # read_array never seeks backwards, and fills a preallocated
+            # array in fixed-size chunks, so it works on streams.
+            mat = np.lib.format.read_array(source, allow_pickle=False)
+    elif data_format == 'h5':
+        f = h5py.File(source, 'r')
+        if mmap and isinstance(source, str):
+            # Left open for ChunkedRasterizedSignal, which closes it
+            return f['data']
+        with f:
+            mat = f['data'][...]
+    elif data_format == 'csv':
+        if mmap:
+            log.warning("Signal data in %s is in legacy CSV format and "
+                        "cannot be memory-mapped; loading into memory.",
+                        source)
+        mat = pd.read_csv(source, header=None).values
+        mat = mat.astype('float')
+        mat = np.swapaxes(mat, 0, 1)
+    else:
+        m = 'Unsupported data_format {}, expected one of {}'
+        raise ValueError(m.format(data_format, RASTER_DATA_FORMATS))
+    return mat
+
+def _read_h5_data(source):
+    '''
+    Reads the dictionary of arrays saved by SignalBase._save_data_to_h5 from
+    source, which may be a file path or a seekable binary file object.
+    '''
+    with h5py.File(source, 'r') as f:
+        data = {}
+        for key, dataset in f.items():
+            data[key] = np.array(dataset[:])
+    return data
+
+class _ForwardOnlyReader(io.RawIOBase):
+    '''
+    Presents any object with a read() method as a non-seekable raw stream.
+    Members of tar archives opened in streaming mode only implement part of
+    the io interface, which trips up io.TextIOWrapper and pandas.
+    '''
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._fileobj.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+
+def read_signal_file(filename, fileobj):
+    '''
+    Parses one of the files making up a saved signal from the binary file
+    object fileobj, dispatching on the extension of filename. fileobj does
+    not need to be seekable (e.g., a member of a streamed tar archive);
+    text and .npy files are parsed incrementally rather than buffered.
+
+    Returns a tuple of (part, value), where part is the keyword argument of
+    load_signal_from_parts that value should be passed as.
+    '''
+    raw = _ForwardOnlyReader(fileobj)
+    if filename.endswith('.epoch.csv'):
+        text = io.TextIOWrapper(io.BufferedReader(raw), 'utf-8')
+        return 'epochs', pd.read_csv(text)
+    elif filename.endswith('.csv'):
+        text = io.TextIOWrapper(io.BufferedReader(raw), 'utf-8')
+        return 'data', _read_rasterized_data(text, 'csv')
+    elif filename.endswith('.npy'):
+        # Unbuffered on purpose: numpy would otherwise treat a buffered
+        # reader as a real file and try to use its file descriptor.
+        return 'data', _read_rasterized_data(raw, 'npy')
+    elif filename.endswith('.h5'):
+        # HDF5 needs random access, so the member is held in memory rather
+        # than extracted to a temporary file.
+        return 'data', _read_h5_data(io.BytesIO(fileobj.read()))
+    elif filename.endswith('.json'):
+        return 'js', json.load(raw)
+    else:
+        raise ValueError('Unexpected signal file: {}'.format(filename))
+
+def load_signal_from_parts(js, data, epochs=None):
+    '''
+    Builds a signal from its already-parsed parts: the JSON sidecar
+    dictionary js, the data (an array for RasterizedSignal, a dictionary of
+    arrays otherwise) and the epochs DataFrame.
+    '''
     if 'signal_type' in js.keys():
         signal_type=js['signal_type']
     else:
         signal_type="nems.signal.RasterizedSignal"
 
     if 'RasterizedSignal' in signal_type:
-        mat = pd.read_csv(csvfilepath, header=None).values
-        mat = mat.astype('float')
-        mat = np.swapaxes(mat, 0, 1)
-
-        s = RasterizedSignal(name=js['name'],
-                    chans=js.get('chans', None),
-                    epochs=epochs,
-                    recording=js['recording'],
-                    fs=js['fs'],
-                    meta=js['meta'],
-                    data=mat)
-
+        if isinstance(data, dict) and 'data' in data:
+            # An 'h5' data file parsed without its sidecar, e.g. from a tgz
+            data = data['data']
+        if isinstance(data, h5py.Dataset):
+            cls = ChunkedRasterizedSignal
+        else:
+            cls = RasterizedSignal
     elif 'PointProcess' in signal_type:
-        with h5py.File(h5filepath, 'r') as f:
-            data = {}
-            for key, dataset in f.items():
-                data[key] = np.array(dataset[:])
-
-        s = PointProcess(name=js['name'],
-                    chans=js.get('chans', None),
-                    epochs=epochs,
-                    recording=js['recording'],
-                    fs=js['fs'],
-                    meta=js['meta'],
-                    data=data)
-
+        cls = PointProcess
     elif 'TiledSignal' in signal_type:
-        with h5py.File(h5filepath, 'r') as f:
-            data = {}
-            for key, dataset in f.items():
-                data[key] = np.array(dataset[:])
-
-        s = TiledSignal(name=js['name'],
-                    chans=js.get('chans', None),
-                    epochs=epochs,
-                    recording=js['recording'],
-                    fs=js['fs'],
-                    meta=js['meta'],
-                    data=data)
-
+        cls = TiledSignal
     else:
         raise ValueError('signal_type unknown')
 
+    if isinstance(data, dict) and not data:
+        warnings.warn("Data for signal {0} ended up empty. "
+                      "Potential bug upstream?".format(js['name']))
+
+    s = cls(name=js['name'],
+            chans=js.get('chans', None),
+            epochs=epochs,
+            recording=js['recording'],
+            fs=js['fs'],
+            meta=js['meta'],
+            data=data)
+
     # NOTE: Moved this outside of call to initializer because
     #       some saved signals don't have segments in their json sidecar.
     s.segments = np.array(js.get('segments', s.segments))
 
     return s
 
+def load_signal(basepath, mmap=False):
+    '''
+    Generic signal loader. Load JSON file, figure out signal type and
+    call appropriate loader
+
+    If mmap is True, RasterizedSignal data saved in the binary format is
+    returned as a read-only np.memmap, so it is only paged in from disk
+    when it is touched. Data saved with data_format='h5' is instead loaded
+    as a ChunkedRasterizedSignal, which reads time windows from the file
+    as they are needed.
+    '''
+    epochfilepath = basepath + '.epoch.csv'
+    jsonfilepath = basepath + '.json'
+    if os.path.isfile(epochfilepath):
+        epochs = pd.read_csv(epochfilepath)
+    else:
+        epochs = None
+    with open(jsonfilepath, 'r') as f:
+        js = json.load(f)
+
+    if 'RasterizedSignal' in js.get('signal_type', 'RasterizedSignal'):
+        data_format = _data_format_from_json(js)
+        data = _read_rasterized_data(basepath + '.' + data_format,
+                                     data_format, mmap=mmap)
+    else:
+        data = _read_h5_data(basepath + '.h5')
+
+    return load_signal_from_parts(js, data, epochs)
+
 def load_signal_from_streams(data_stream, json_stream, epoch_stream=None):
     ''' Loads from BytesIO objects rather than files. epoch stream was formerly
         csv stream, but this could be an hdf5 file (or something else?)
@@ -2342,88 +3026,35 @@ def load_signal_from_streams(data_stream, json_stream, epoch_stream=None):
     # Read the json metadata
     js = json.load(json_stream)
 
-    if 'signal_type' in js.keys():
-        signal_type=js['signal_type']
-    else:
-        signal_type="nems.signal.RasterizedSignal"
-
-    if 'RasterizedSignal' in signal_type:
-        mat = pd.read_csv(data_stream, header=None).values
-        mat = mat.astype('float')
-        mat = np.swapaxes(mat, 0, 1)
-
-        s = RasterizedSignal(name=js['name'],
-                    chans=js.get('chans', None),
-                    epochs=epochs,
-                    recording=js['recording'],
-                    fs=js['fs'],
-                    meta=js['meta'],
-                    data=mat)
-
-    elif 'PointProcess' in signal_type:
-        with h5py.File(data_stream, 'r') as f:
-            data = {}
-            for key, dataset in f.items():
-                data[key] = np.array(dataset[:])
-
-        if not data:
-            warnings.warn("Tried to load data stream {0} but data object"
-                             "ended up empty. Potential bug upstream?"
-                             .format(data_stream))
-
-        s = PointProcess(name=js['name'],
-                    chans=js.get('chans', None),
-                    epochs=epochs,
-                    recording=js['recording'],
-                    fs=js['fs'],
-                    meta=js['meta'],
-                    data=data)
-
-    elif 'TiledSignal' in signal_type:
-        with h5py.File(data_stream, 'r') as f:
-            data = {}
-            for key, dataset in f.items():
-                data[key] = np.array(dataset[:])
-
-        s = TiledSignal(name=js['name'],
-                    chans=js.get('chans', None),
-                    epochs=epochs,
-                    recording=js['recording'],
-                    fs=js['fs'],
-                    meta=js['meta'],
-                    data=data)
-
+    if 'RasterizedSignal' in js.get('signal_type', 'RasterizedSignal'):
+        data = _read_rasterized_data(data_stream, _data_format_from_json(js))
     else:
-        raise ValueError('signal_type unknown')
+        data = _read_h5_data(data_stream)
 
-    s.segments = np.array(js.get('segments', s.segments))
-
-    return s
+    return load_signal_from_parts(js, data, epochs)
 
 
 def load_rasterized_signal(basepath):
-    csvfilepath = basepath + '.csv'
     epochfilepath = basepath + '.epoch.csv'
     jsonfilepath = basepath + '.json'
     # TODO: reduce code duplication and call load_from_streams
-    mat = pd.read_csv(csvfilepath, header=None).values
     if os.path.isfile(epochfilepath):
         epochs = pd.read_csv(epochfilepath)
     else:
         epochs = None
-    mat = mat.astype('float')
-    mat = np.swapaxes(mat, 0, 1)
     with open(jsonfilepath, 'r') as f:
         js = json.load(f)
-        s = RasterizedSignal(name=js['name'],
-                    chans=js.get('chans', None),
-                    epochs=epochs,
-                    recording=js['recording'],
-                    fs=js['fs'],
-                    meta=js['meta'],
-                    data=mat)
-        s.segments = js.get('segments', s.segments)
-        return s
+    data_format = _data_format_from_json(js)
+    mat = _read_rasterized_data(basepath + '.' + data_format, data_format)
+    s = RasterizedSignal(name=js['name'],
+                chans=js.get('chans', None),
+                epochs=epochs,
+                recording=js['recording'],
+                fs=js['fs'],
+                meta=js['meta'],
+                data=mat)
+    s.segments = js.get('segments', s.segments)
+    return s
 
 
 
@@ -2501,16 +3132,45 @@ def jackknife_inverse_merge(sig_list):
 
 
 def join_signal_subsets(subsets):
-    # TODO
-    raise NotImplementedError
-    return Signal(...)
+    '''
+    Joins signals cut from the same signal (by split_signal_to_subsets,
+    select_times, ...) back into one RasterizedSignalSubset, in the order
+    given, without copying their data. The epochs are those of the first
+    signal.
+    '''
+    if not subsets:
+        raise ValueError('No signals to join')
+    first = subsets[0]
+    for s in subsets[1:]:
+        if s.fs != first.fs:
+            raise ValueError('All signals must have the same fs')
+        if s.nchans != first.nchans:
+            raise ValueError('All signals must have the same number of '
+                             'channels')
+    pieces = [p for s in subsets for p in s._segments_between(0, s.ntimes)]
+    segments = np.vstack([s.segments for s in subsets])
+    return first._from_segments(pieces, segments=segments)
 
 
 def split_signal_to_subsets(signal):
-    # TODO
-    # Maybe just existing jackknifing method with minor changes?
-    raise NotImplementedError
-    return [SignalSubset(...) for data, fakepochs in something]
+    '''
+    Returns one signal per row of signal.segments (start and end times,
+    in seconds, of each stretch of time the signal was cut from), each a
+    view of the matching samples of signal. All of them share the epochs
+    of signal.
+    '''
+    if len(signal.segments) == 1:
+        return [signal]
+    # same rounding as get_epoch_indices
+    lengths = np.round(np.diff(signal.segments, axis=1)[:, 0] *
+                       signal.fs).astype(int)
+    if lengths.sum() != signal.ntimes:
+        raise ValueError('Segments of {} do not add up to its length'
+                         .format(signal.name))
+    bounds = np.cumsum(np.append(0, lengths))
+    return [signal._from_segments(signal._segments_between(lb, ub),
+                                  segments=signal.segments[[i]])
+            for i, (lb, ub) in enumerate(zip(bounds[:-1], bounds[1:]))]
 
 
 def concatenate_channels(cls, signals):
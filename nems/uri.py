@@ -2,12 +2,25 @@ import re
 import io
 import os
 import json as jsonlib
+import time
+import hashlib
 import logging
+import tempfile
 import requests
 import numpy as np
 import base64
+import contextlib
 
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
+from urllib3.util.retry import Retry
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (e.g. on Windows); the cache is then only safe for
+    # one process at a time
+    fcntl = None
+from nems import get_setting
 from nems.distributions.distribution import Distribution
 from nems.registry import KeywordRegistry
 
@@ -135,6 +148,67 @@ def targz_uri(uri):
         return None
 
 
+################################################################################
+# Pooled HTTP sessions
+################################################################################
+_RETRY_STATUS = (500, 502, 503, 504)
+
+_sessions = {}
+
+
+def get_session(retry=True):
+    '''
+    Returns the requests.Session shared by this process, so that repeated
+    requests to the same host reuse keep-alive connections from a pool of
+    NEMS_HTTP_POOL_SIZE. Failed requests are retried NEMS_HTTP_RETRIES times
+    with exponential backoff, unless retry is False.
+    '''
+    pid = os.getpid()
+    if any(p != pid for p, _ in _sessions):
+        # Pooled sockets must not be shared with a parent process
+        _sessions.clear()
+    session = _sessions.get((pid, retry))
+    if session is None:
+        if retry:
+            max_retries = Retry(total=get_setting('NEMS_HTTP_RETRIES'),
+                                backoff_factor=get_setting('NEMS_HTTP_BACKOFF'),
+                                status_forcelist=_RETRY_STATUS,
+                                raise_on_status=False)
+        else:
+            max_retries = 0
+        pool_size = get_setting('NEMS_HTTP_POOL_SIZE')
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=max_retries)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _sessions[(pid, retry)] = session
+    return session
+
+
+def put_stream(uri, chunks):
+    '''
+    PUTs the bytes yielded by chunks() to uri with chunked transfer encoding,
+    so the body never has to be held in memory, and returns the response.
+    A generator cannot be rewound, so rather than relying on the session's
+    retries, chunks is called again to restart the body on each attempt.
+    '''
+    retries = get_setting('NEMS_HTTP_RETRIES')
+    backoff = get_setting('NEMS_HTTP_BACKOFF')
+    for attempt in range(retries + 1):
+        try:
+            r = get_session(retry=False).put(uri, data=chunks())
+        except ConnectionError:
+            if attempt == retries:
+                raise
+        else:
+            if r.status_code not in _RETRY_STATUS or attempt == retries:
+                return r
+        log.info('HTTP PUT to %s failed, retrying', uri)
+        time.sleep(backoff * 2**attempt)
+
+
 def save_resource(uri, data=None, json=None):
     '''
     For saving a resource to a URI. Throws an exception if there was a
@@ -147,7 +221,7 @@ def save_resource(uri, data=None, json=None):
             s = jsonlib.dumps(json, cls=NumpyEncoder)
             js = jsonlib.loads(s)
             try:
-                r = requests.put(uri, json=js)
+                r = get_session().put(uri, json=js)
                 if r.status_code != 200:
                     err = 'HTTP PUT failed. Got {}: {}'.format(r.status_code,
                                                                r.text)
@@ -171,7 +245,7 @@ def save_resource(uri, data=None, json=None):
     elif data:
         if http_uri(uri):
             try:
-                r = requests.put(uri, data=data)
+                r = get_session().put(uri, data=data)
                 if r.status_code != 200:
                     err = 'HTTP PUT failed. Got {}: {}'.format(r.status_code,
                                                                r.text)
@@ -201,27 +275,229 @@ def save_resource(uri, data=None, json=None):
     return err
 
 
+################################################################################
+# Local cache of remote resources
+################################################################################
+# HTTP bodies are stored once per content hash under NEMS_CACHE_DIR, and an
+# index maps each URI to the hash plus the validators (ETag, Last-Modified)
+# needed to ask the server whether our copy is still current.
+
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                'bytes_downloaded': 0}
+
+
+def cache_stats():
+    '''Returns a dict of hit/miss/eviction counters for the resource cache.'''
+    return dict(_cache_stats)
+
+
+def reset_cache_stats():
+    '''Zeroes the resource cache counters.'''
+    for k in _cache_stats:
+        _cache_stats[k] = 0
+
+
+def _cache_settings():
+    cache_dir = get_setting('NEMS_CACHE_DIR')
+    if not cache_dir:
+        return None, None, None
+    max_bytes = get_setting('NEMS_CACHE_MAX_BYTES') or None
+    max_age = get_setting('NEMS_CACHE_MAX_AGE') or 0
+    return cache_dir, max_bytes, max_age
+
+
+def _cache_blob_path(cache_dir, digest):
+    return os.path.join(cache_dir, digest[:2], digest)
+
+
+def _read_cache_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'index.json'), 'r') as f:
+            return jsonlib.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache_index(cache_dir, index):
+    # Write then rename, so concurrent readers never see a partial index
+    fh, tmppath = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fh, 'w') as f:
+        jsonlib.dump(index, f)
+    os.replace(tmppath, os.path.join(cache_dir, 'index.json'))
+
+
+@contextlib.contextmanager
+def _locked_cache(cache_dir):
+    '''
+    Holds an exclusive advisory lock on cache_dir. Every read-modify-write
+    of the index, and every creation or deletion of a blob, happens under
+    it, so processes sharing the cache neither lose each other's index
+    entries nor evict a blob that another one is about to open.
+    '''
+    with open(os.path.join(cache_dir, 'index.lock'), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _evict_cache_entries(cache_dir, index, max_bytes, keep):
+    '''
+    Deletes least recently used blobs (and every URI pointing at them)
+    until the cache fits in max_bytes. The blob named by keep is never
+    evicted.
+    '''
+    blobs = {}
+    for entry in index.values():
+        d = entry['sha256']
+        blobs[d] = (max(entry['accessed'], blobs.get(d, (0, 0))[0]),
+                    entry['size'])
+    total = sum(size for _, size in blobs.values())
+    for digest, (_, size) in sorted(blobs.items(), key=lambda kv: kv[1][0]):
+        if total <= max_bytes:
+            break
+        if digest == keep:
+            continue
+        try:
+            os.remove(_cache_blob_path(cache_dir, digest))
+        except FileNotFoundError:
+            pass
+        for u in [u for u, e in index.items() if e['sha256'] == digest]:
+            del index[u]
+        total -= size
+        _cache_stats['evictions'] += 1
+        log.debug('Evicted %s from resource cache', digest)
+
+
+def _download_to_cache(cache_dir, r):
+    '''
+    Streams the body of response r into a temporary file in the cache,
+    returning (path, hash). The caller moves it into place with
+    _store_blob.
+    '''
+    sha = hashlib.sha256()
+    fh, tmppath = tempfile.mkstemp(dir=cache_dir, suffix='.part')
+    try:
+        with os.fdopen(fh, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=1024*1024):
+                sha.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+    return tmppath, sha.hexdigest()
+
+
+def _store_blob(cache_dir, tmppath, digest):
+    blobpath = _cache_blob_path(cache_dir, digest)
+    os.makedirs(os.path.dirname(blobpath), exist_ok=True)
+    os.replace(tmppath, blobpath)
+
+
+def open_http_resource(url):
+    '''
+    Fetches url and returns (content_type, fileobj) for its body.
+
+    If NEMS_CACHE_DIR is set, the body is served from the local cache when
+    the server confirms (by ETag or Last-Modified) that it has not changed,
+    or when the cached copy is younger than NEMS_CACHE_MAX_AGE seconds.
+    Otherwise it is downloaded into the cache first. Raises ConnectionError
+    if the server does not answer with 200 (or 304 for a cached copy).
+    '''
+    cache_dir, max_bytes, max_age = _cache_settings()
+    if cache_dir is None:
+        r = get_session().get(url, stream=True)
+        if r.status_code != 200:
+            raise ConnectionError('HTTP GET failed. Got {}: {}'
+                                  .format(r.status_code, r.text))
+        r.raw.decode_content = True
+        return r.headers.get('content-type'), r.raw
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # The index is replaced atomically, so it can be read without the lock
+    # here; it is read again under the lock before being changed.
+    entry = _read_cache_index(cache_dir).get(url)
+    if entry and not os.path.exists(_cache_blob_path(cache_dir,
+                                                     entry['sha256'])):
+        entry = None
+
+    now = time.time()
+    tmppath = None
+    if entry and now - entry['fetched'] < max_age:
+        hit = True
+    else:
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        r = get_session().get(url, headers=headers, stream=True)
+        if entry and r.status_code == 304:
+            r.close()
+            hit = True
+            entry['fetched'] = now
+        elif r.status_code == 200:
+            hit = False
+            tmppath, digest = _download_to_cache(cache_dir, r)
+            size = os.path.getsize(tmppath)
+            entry = {'sha256': digest,
+                     'size': size,
+                     'etag': r.headers.get('etag'),
+                     'last_modified': r.headers.get('last-modified'),
+                     'content_type': r.headers.get('content-type'),
+                     'fetched': now}
+            _cache_stats['bytes_downloaded'] += size
+        else:
+            raise ConnectionError('HTTP GET failed. Got {}: {}'
+                                  .format(r.status_code, r.text))
+
+    with _locked_cache(cache_dir):
+        if tmppath is not None:
+            _store_blob(cache_dir, tmppath, entry['sha256'])
+        try:
+            # Opened under the lock: once open, an eviction by another
+            # process no longer affects it.
+            fileobj = open(_cache_blob_path(cache_dir, entry['sha256']), 'rb')
+        except FileNotFoundError:
+            fileobj = None
+        else:
+            index = _read_cache_index(cache_dir)
+            entry['accessed'] = now
+            index[url] = entry
+            if max_bytes:
+                _evict_cache_entries(cache_dir, index, max_bytes,
+                                     entry['sha256'])
+            _write_cache_index(cache_dir, index)
+
+    if fileobj is None:
+        # evicted by another process since we looked it up; fetch it again
+        return open_http_resource(url)
+
+    if hit:
+        _cache_stats['hits'] += 1
+        log.debug('Resource cache hit: %s', url)
+    else:
+        _cache_stats['misses'] += 1
+        log.debug('Resource cache miss: %s', url)
+    return entry['content_type'], fileobj
+
+
 def load_resource(uri):
     '''
     Loads and returns the resource (probably a JSON) found at URI.
     '''
     if http_uri(uri):
-        r = requests.get(uri)
-        if r.status_code != 200:
-            err = 'HTTP GET failed. Got {}: {}'.format(r.status_code,
-                                                       r.text)
-            raise ConnectionError(err)
-        if hasattr(r, 'data'):
-            return r.data
-        else:
-            try:
-                return r.json(object_hook=json_numpy_obj_hook)
-            except jsonlib.decoder.JSONDecodeError as e:
-                log.warn("Decode error when retrieving json from: \n{}\n."
-                         "Response payload from server may have been empty\n."
-                         "Make sure the uri is correct!"
-                         .format(uri))
-                log.exception(e)
+        content_type, f = open_http_resource(uri)
+        with f:
+            body = f.read()
+        try:
+            return jsonlib.loads(body.decode(),
+                                 object_hook=json_numpy_obj_hook)
+        except jsonlib.decoder.JSONDecodeError as e:
+            log.warn("Decode error when retrieving json from: \n{}\n."
+                     "Response payload from server may have been empty\n."
+                     "Make sure the uri is correct!"
+                     .format(uri))
+            log.exception(e)
     elif local_uri(uri):
         filepath = local_uri(uri)
         try:
@@ -256,7 +532,7 @@ def list_targz_in_nginx_dir(uri):
     that manages 'batches'. Ideally, such a database would return a JSON
     containing a list of URIs.
     '''
-    r = requests.get(uri)
+    r = get_session().get(uri)
 
     if r.status_code != 200:
         return None
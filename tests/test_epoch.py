@@ -3,9 +3,13 @@ import pytest
 import numpy as np
 import pandas as pd
 
+import nems.epoch
 from nems.epoch import (epoch_union, epoch_difference, epoch_intersection,
                         epoch_contains, epoch_contained, adjust_epoch_bounds,
-                        remove_overlap, find_common_epochs, add_epoch)
+                        remove_overlap, find_common_epochs, add_epoch,
+                        epoch_names_matching, EpochIndex, EpochTable,
+                        merge_epoch, epoch_containment_join,
+                        epoch_intersection_full, IntervalMask)
 
 @pytest.fixture()
 def epoch_a():
@@ -319,6 +323,68 @@ def group_epochs_by_parent(epoch_df):
     assert n2 == 'parent_2'
 
 
+def _loop_find_common_epochs(epochs, epoch_name, d=12):
+    subsets = []
+    matches = epochs.query('name == "{}"'.format(epoch_name))
+    for lb, ub in matches[['start', 'end']].values:
+        m = (epochs['start'] >= lb) & (epochs['end'] <= ub)
+        subset = epochs.loc[m].copy()
+        subset['start'] -= lb
+        subset['end'] -= lb
+        subsets.append(set((n, round(s, d), round(e, d)) for (n, s, e)
+                           in subset[['name', 'start', 'end']].values))
+    return set.intersection(*subsets)
+
+
+def _trial_epochs(rng, n_trials):
+    '''
+    Trials with a stimulus that is either the common one or a random one,
+    at slightly jittered (floating point) offsets.
+    '''
+    rows = []
+    t = 0.0
+    for i in range(n_trials):
+        length = rng.choice([2.0, 3.0])
+        rows.append(['TRIAL', t, t + length])
+        rows.append(['PreStimSilence', t, t + 0.5])
+        stim = 'STIM_common' if rng.rand() < 0.8 else 'STIM_{}'.format(i)
+        rows.append([stim, t + 0.5, t + 1.5])
+        rows.append(['LICK', t + rng.rand() * length, t + length + 0.5])
+        t += length + 0.1 * rng.randint(3)
+    return pd.DataFrame(rows, columns=['name', 'start', 'end'])
+
+
+def test_epoch_containment_join():
+    rng = np.random.RandomState(0)
+    for trial in range(200):
+        parents = _random_epochs(rng, rng.randint(0, 10))
+        children = _random_epochs(rng, rng.randint(0, 20))
+        p, c = epoch_containment_join(parents, children)
+        inside = ((children[:, 0] >= parents[:, [0]]) &
+                  (children[:, 1] <= parents[:, [1]]))
+        expected_p, expected_c = np.nonzero(inside)
+        assert np.array_equal(p, expected_p)
+        assert np.array_equal(c, expected_c)
+
+
+def test_find_common_epochs_matches_loop():
+    rng = np.random.RandomState(0)
+    for trial in range(20):
+        epochs = _trial_epochs(rng, 30)
+        result = find_common_epochs(epochs, 'TRIAL')
+        assert set(map(tuple, result.values)) == \
+            _loop_find_common_epochs(epochs, 'TRIAL')
+        assert list(result.columns) == ['name', 'start', 'end']
+
+
+def test_group_epochs_by_parent(epoch_df):
+    result = list(nems.epoch.group_epochs_by_parent(epoch_df,
+                                                    r'^parent_\d+'))
+    assert [name for name, _ in result] == ['parent_1', 'parent_2']
+    for (name, subset), (lb, ub) in zip(result, [(1, 11), (30, 40)]):
+        m = (epoch_df['start'] >= lb) & (epoch_df['end'] <= ub)
+        assert subset.equals(epoch_df.loc[m])
+
 def test_add_epoch(epoch_df):
     result = add_epoch(epoch_df, 'parent', 'child_a')
     assert len(result) == (len(epoch_df) + 2)
@@ -329,3 +395,197 @@ def test_add_epoch(epoch_df):
     expected = [[1, 2], [30, 31]]
     values = result.loc[m, ['start', 'end']].values
     assert np.array_equal(expected, values)
+
+
+def test_epoch_table(epoch_df):
+    epochs = epoch_df.copy()
+    epochs['label'] = np.arange(len(epochs))
+    epochs.loc[3, 'name'] = np.nan
+    table = EpochTable.from_dataframe(epochs)
+    assert table.codes.dtype == np.int32
+    assert len(table.names) == len(set(epochs['name'].dropna())) + 1
+
+    df = table.to_dataframe()
+    assert list(df.columns) == list(epochs.columns)
+    assert df.equals(epochs.astype({'start': float, 'end': float}))
+    assert table.to_dataframe() is df
+    assert EpochTable.of(df) is table
+    assert EpochTable.of(epochs) is not table
+    assert EpochTable.of(epochs).equals(table)
+    with pytest.raises(ValueError):
+        table.start[0] = 1
+
+    recoded = table.recoded(['other', 'names'])
+    assert recoded.names[:2] == ['other', 'names']
+    assert recoded.equals(table)
+    assert recoded.to_dataframe().equals(df)
+
+def test_epoch_index():
+    rng = np.random.RandomState(0)
+    start = rng.randint(0, 1000, 500) / 7
+    epochs = pd.DataFrame({
+        'start': start,
+        'end': start + rng.randint(1, 50, 500) / 7,
+        'name': rng.choice(['TRIAL', 'STIM_a', 'STIM_b', 'REFERENCE'], 500),
+        })
+    index = EpochIndex(epochs, fs=100)
+
+    for name in ['TRIAL', 'STIM_a', 'missing']:
+        mask = epochs['name'] == name
+        expected = epochs.loc[mask, ['start', 'end']].values
+        expected = np.round(expected.astype(float) * 100) / 100
+        bounds = index.bounds(name)
+        assert bounds.shape == expected.shape
+        assert np.array_equal(bounds, expected[np.lexsort(expected.T[::-1])])
+        assert np.all(np.diff(bounds[:, 0]) >= 0)
+
+    assert index.names_matching('^STIM_') == \
+        epoch_names_matching(epochs, '^STIM_')
+    assert index.names_matching('^STIM_') == ['STIM_a', 'STIM_b']
+    with pytest.raises(ValueError):
+        index.bounds('TRIAL')[0, 0] = 0
+
+
+# Reference implementations: the quadratic / per-occurrence versions that the
+# vectorized ones in nems.epoch replaced.
+
+def _loop_remove_overlap(a):
+    a = a.copy()
+    a.sort(axis=0)
+    i, n, trimmed = 0, len(a), []
+    while i < n:
+        lb, ub = a[i]
+        i += 1
+        trimmed.append((lb, ub))
+        while (i < n) and (ub > a[i, 0]):
+            i += 1
+    return np.array(trimmed)
+
+
+def _loop_merge_epoch(a):
+    a = a.copy()
+    a.sort(axis=0)
+    i, n, merged = 0, len(a), []
+    while i < n:
+        lb, ub = a[i]
+        i += 1
+        while (i < n) and (ub >= a[i, 0]):
+            ub = a[i, 1]
+            i += 1
+        merged.append((lb, ub))
+    return np.array(merged)
+
+
+def _contains_mask(a, b):
+    return np.array([(b >= lb) & (b <= ub) for lb, ub in a])
+
+
+def _loop_epoch_contains(a, b, mode):
+    mask = _contains_mask(a, b)
+    if mode == 'start':
+        return mask[:, :, 0].any(axis=1)
+    elif mode == 'end':
+        return mask[:, :, 1].any(axis=1)
+    elif mode == 'both':
+        return mask.all(axis=2).any(axis=1)
+    b_in_a = mask.any(axis=2).any(axis=1)
+    a_in_b = _contains_mask(b, a).any(axis=2).any(axis=0)
+    return b_in_a | a_in_b
+
+
+def _loop_intersection_full(a, b):
+    a = sorted(a.tolist())
+    b = sorted(b.tolist())
+    return np.array([[lb, ub] for lb, ub in a
+                     if any(lb >= lb_b and ub <= ub_b for lb_b, ub_b in b)])
+
+
+def _random_epochs(rng, n, span=30, disjoint=False):
+    '''
+    Integer bounds on a small grid, so that shared and touching bounds are
+    common. With disjoint=True, occurrences have positive length and do not
+    overlap.
+    '''
+    if disjoint:
+        edges = np.sort(rng.choice(span * 2, 2 * n, replace=False))
+        # let about half of the occurrences touch the one before
+        edges[2::2] = np.where(rng.rand(n - 1) < 0.5, edges[1:-1:2],
+                               edges[2::2])
+        a = edges.reshape(n, 2)
+        return a[rng.permutation(n)].astype(float)
+    lb = rng.randint(0, span, n)
+    return np.stack([lb, lb + rng.randint(-2, 8, n)], axis=1).astype(float)
+
+
+def _same(result, expected):
+    return result.shape == expected.shape and np.array_equal(result, expected)
+
+
+def test_interval_algebra_matches_loops():
+    rng = np.random.RandomState(0)
+    for trial in range(500):
+        a = _random_epochs(rng, rng.randint(0, 12))
+        b = _random_epochs(rng, rng.randint(1, 12))
+        assert _same(remove_overlap(a), _loop_remove_overlap(a))
+        assert _same(merge_epoch(a), _loop_merge_epoch(a))
+        assert _same(epoch_intersection_full(a, b),
+                     _loop_intersection_full(a, b))
+        if len(a):
+            for mode in ['start', 'end', 'both', 'any']:
+                assert _same(epoch_contains(a, b, mode),
+                             _loop_epoch_contains(a, b, mode))
+            assert _same(epoch_contained(a, b),
+                         _contains_mask(b, a).all(axis=2).any(axis=0))
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_intersection_sweep_matches_walk():
+    rng = np.random.RandomState(0)
+    for trial in range(1000):
+        disjoint = trial % 4 != 0
+        a = _random_epochs(rng, rng.randint(1, 10), disjoint=disjoint)
+        b = _random_epochs(rng, rng.randint(1, 10), disjoint=disjoint)
+        if trial % 2:
+            a, b = a / 10, b / 10
+        expected = nems.epoch._epoch_intersection_walk(np.around(a, 6),
+                                                       np.around(b, 6))
+        assert _same(epoch_intersection(a, b), expected)
+
+
+def test_benchmark_epoch_contained(benchmark):
+    rng = np.random.RandomState(0)
+    lb = np.sort(rng.rand(10**5)) * 10**4
+    a = np.stack([lb, lb + rng.rand(10**5)], axis=1)
+    segments = np.array([[0, 5000], [5000.5, 10**4]])
+    contained = benchmark(epoch_contained, a, segments)
+    assert contained.sum() > 0.9 * len(a)
+
+
+def test_interval_mask_matches_dense():
+    rng = np.random.RandomState(0)
+    for trial in range(500):
+        n = rng.randint(0, 40)
+        a = rng.rand(n) < rng.rand()
+        b = rng.rand(n) < rng.rand()
+        ma, mb = IntervalMask.from_array(a), IntervalMask.from_array(b)
+        for result, expected in [(ma | mb, a | b), (ma & mb, a & b),
+                                 (~ma, ~a)]:
+            assert result.equals(IntervalMask.from_array(expected))
+            assert np.array_equal(result.as_array(), expected[np.newaxis])
+        assert ma.count() == a.sum() and ma.all() == a.all()
+
+        slices = rng.randint(-n - 2, n + 2, (4, 2))
+        dense = np.zeros(n, dtype=bool)
+        for lb, ub in slices:
+            dense[lb:ub] = True
+        assert IntervalMask.from_slices(slices, n).equals(
+            IntervalMask.from_array(dense))
+
+        bounds = rng.randint(0, n + 2, (6, 2))
+        expected = [a[lb:ub].all() for lb, ub in bounds]
+        assert ma.covers(bounds).tolist() == expected
+
+
+def test_interval_mask_length_mismatch():
+    with pytest.raises(ValueError):
+        IntervalMask.full(10) | IntervalMask.full(11)
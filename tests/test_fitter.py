@@ -3,6 +3,12 @@ import pytest
 import numpy as np
 
 from nems.fitters.mappers import simple_vector, to_bounds_array
+from nems.recording import Recording
+from nems.initializers import from_keywords
+from nems.priors import set_mean_phi
+from nems.analysis.fit_basic import fit_basic
+import nems.modelspec as ms
+import nems.metrics.api as metrics
 
 
 def test_simple_vector_subset(simple_modelspec_with_phi):
@@ -166,3 +172,41 @@ def test_partial_definition(bounds_modelspec):
     # Don't need to assert anything here, just shouldn't get an error
     # for leaving 'sd' bounds undefined.
     x = bounds(bounds_modelspec)
+
+
+def test_fit_float32_drift():
+    '''
+    Fitting on float32 signals should land close to the float64 fit.
+    '''
+    rng = np.random.RandomState(0)
+    stim = rng.rand(18, 2000)
+    true = set_mean_phi(from_keywords('wc.18x1.g-fir.1x10-lvl.1'))
+    true[0]['phi']['mean'] = np.array([0.4])
+    true[0]['phi']['sd'] = np.array([0.1])
+    true[1]['phi']['coefficients'] = \
+        np.array([[0, 1, .8, .5, .2, 0, -.1, -.1, 0, 0]])
+    rec = Recording.load_from_arrays([stim, stim[:1]], 'drift', 100,
+                                     sig_names=['stim', 'resp'])
+    rec['pred'] = rec['stim']
+    resp = ms.evaluate(rec, true)['pred'].as_continuous()
+    resp = resp + 0.05 * rng.randn(*resp.shape)
+    rec = Recording.load_from_arrays([stim, resp], 'drift', 100,
+                                     sig_names=['stim', 'resp'])
+    rec['pred'] = rec['stim']
+    init = set_mean_phi(from_keywords('wc.18x1.g-fir.1x10-lvl.1'))
+
+    results = {}
+    for dtype in ['float64', 'float32']:
+        data = rec.astype(dtype)
+        fit = fit_basic(data, init, fit_kwargs={'options': {'maxiter': 200}})
+        pred = ms.evaluate(data, fit[0])
+        assert pred['pred'].as_continuous().dtype == dtype
+        results[dtype] = (metrics.nmse(pred), fit[0],
+                          pred['pred'].as_continuous())
+
+    nmse64, fit64, pred64 = results['float64']
+    nmse32, fit32, pred32 = results['float32']
+    assert abs(nmse32 - nmse64) < 1e-3
+    assert np.allclose(fit32[1]['phi']['coefficients'],
+                       fit64[1]['phi']['coefficients'], atol=0.02)
+    assert np.max(np.abs(pred32 - pred64)) < 0.02
@@ -1,6 +1,14 @@
+import numpy as np
 import pytest
 
-from nems.modelspec import get_best_modelspec, sort_modelspecs
+import nems.modelspec
+from nems.fitters.util import phi_to_vector
+from nems.metrics.mse import nmse, mse_batch, nmse_batch
+from nems.initializers import from_keywords
+from nems.modelspec import get_best_modelspec, sort_modelspecs, evaluate, \
+    compile, can_compile, caching_evaluator
+from nems.priors import set_mean_phi
+from nems.recording import Recording
 
 
 @pytest.fixture()
@@ -31,3 +39,174 @@ def test_best(modelspecs):
     best = get_best_modelspec(modelspecs, metakey='r_test',
                               comparison='least')
     assert best[0][0]['fn'] == 'three'
+
+
+def _ln_data(dtype='float64'):
+    rng = np.random.RandomState(0)
+    rec = Recording.load_from_arrays([rng.rand(18, 2000), rng.rand(1, 2000)],
+                                     'ln', 100, sig_names=['stim', 'resp'])
+    modelspec = set_mean_phi(from_keywords('wc.18x2.g-fir.2x15-lvl.1-dexp.1'))
+    modelspec[1]['phi']['coefficients'] = rng.randn(2, 15)
+    return rec.astype(dtype), modelspec
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_compile_matches_evaluate(dtype):
+    rec, modelspec = _ln_data(dtype)
+    assert can_compile(modelspec)
+    plan = compile(rec, modelspec)
+    expected = evaluate(rec, modelspec)['pred'].as_continuous()
+
+    vector = phi_to_vector([m['phi'] for m in modelspec])
+    for _ in range(2):
+        pred = plan(vector)
+        assert pred.dtype == dtype
+        assert np.allclose(pred, expected, rtol=1e-5 if dtype == 'float32'
+                           else 1e-12)
+    result = plan.evaluate(rec, modelspec)
+    assert np.array_equal(result['pred'].as_continuous(), pred)
+    assert result['pred'].name == 'pred'
+
+    # anything else goes through evaluate
+    other = rec.copy()
+    assert np.array_equal(plan.evaluate(other, modelspec)['pred']
+                          .as_continuous(), expected)
+
+
+def test_compile_stp():
+    rec, _ = _ln_data()
+    modelspec = set_mean_phi(
+        from_keywords('wc.18x2.g-stp.2-fir.2x15-lvl.1-dexp.1'))
+    modelspec[1]['phi']['u'] = np.array([0.5, -0.1])
+    assert can_compile(modelspec)
+    plan = compile(rec, modelspec)
+    expected = evaluate(rec, modelspec)['pred'].as_continuous()
+    pred = plan(phi_to_vector([m['phi'] for m in modelspec]))
+    assert np.allclose(pred, expected, rtol=1e-9)
+
+
+def test_compile_needs_kernels():
+    rec, modelspec = _ln_data()
+    modelspec[0]['norm'] = {'type': 'none', 'recalc': 0}
+    assert not can_compile(modelspec)
+    with pytest.raises(ValueError):
+        compile(rec, modelspec)
+
+
+def test_benchmark_compiled_cost(benchmark):
+    rec, modelspec = _ln_data()
+    plan = compile(rec, modelspec)
+    vector = phi_to_vector([m['phi'] for m in modelspec])
+    resp = rec['resp'].as_continuous()
+    benchmark(lambda: np.mean((plan(vector) - resp)**2))
+
+
+def test_caching_evaluator(monkeypatch):
+    rng = np.random.RandomState(1)
+    rec, _ = _ln_data()
+    modelspec = set_mean_phi(
+        from_keywords('wc.18x2.g-stp.2-fir.2x15-lvl.1-dexp.1'))
+    # modules that normalize their output have no kernel
+    modelspec[1]['norm'] = {'type': 'none', 'recalc': 1}
+    assert not can_compile(modelspec)
+
+    evaluated = []
+    real_evaluate = nems.modelspec.evaluate
+
+    def counting_evaluate(rec, modelspec, start=None, stop=None):
+        evaluated.extend(range(len(modelspec))[start:stop])
+        return real_evaluate(rec, modelspec, start, stop)
+
+    cached = caching_evaluator()
+    monkeypatch.setattr(nems.modelspec, 'evaluate', counting_evaluate)
+    for changed in [None, 3, 3, 2, 0, None]:
+        if changed is not None:
+            for v in modelspec[changed]['phi'].values():
+                v += 0.01 * rng.randn(*np.shape(v))
+        del evaluated[:]
+        pred = cached(rec, modelspec)['pred'].as_continuous()
+        first = 0 if not evaluated else evaluated[0]
+        assert first == (changed or 0) or not evaluated
+        assert np.allclose(pred, real_evaluate(rec, modelspec)['pred']
+                           .as_continuous(), equal_nan=True)
+    # nothing changed in the last call
+    assert evaluated == []
+
+    # frozen parameters moved into fn_kwargs are checked too
+    modelspec[1]['fn_kwargs'].update(modelspec[1]['phi'])
+    modelspec[1]['phi'] = {}
+    cached(rec, modelspec)
+    assert evaluated == [1, 2, 3, 4]
+
+
+def test_fit_module_sets_caches_upstream(monkeypatch):
+    from nems.analysis.fit_iteratively import fit_module_sets
+    rec, _ = _ln_data()
+    modelspec = set_mean_phi(
+        from_keywords('wc.18x2.g-stp.2-fir.2x15-lvl.1-dexp.1'))
+    modelspec[1]['norm'] = {'type': 'none', 'recalc': 1}
+    assert not can_compile(modelspec)
+
+    evaluated = []
+    real_evaluate = nems.modelspec.evaluate
+
+    def counting_evaluate(rec, modelspec, start=None, stop=None):
+        evaluated.extend(range(len(modelspec))[start:stop])
+        return real_evaluate(rec, modelspec, start, stop)
+
+    # the default evaluator is whatever nems.modelspec.evaluate is
+    monkeypatch.setattr(nems.modelspec, 'evaluate', counting_evaluate)
+    fit_module_sets(rec, modelspec, evaluator=counting_evaluate,
+                    module_sets=[[3]], max_iter=3)
+    # modules upstream of lvl are only evaluated once
+    assert evaluated.count(3) > 1
+    assert [evaluated.count(i) for i in range(3)] == [1, 1, 1]
+
+
+def test_compile_skips_frozen_modules():
+    rec, modelspec = _ln_data()
+    plan = compile(rec, modelspec)
+    vector = np.array(phi_to_vector([m['phi'] for m in modelspec]))
+    before = plan(vector).copy()
+    fir_out = plan._last_outputs[1]
+    # perturb the last parameter, the shift of dexp
+    vector[-1] += 0.1
+    assert not np.array_equal(plan(vector), before)
+    assert plan._last_outputs[1] is fir_out
+    modelspec[3]['phi']['shift'] = modelspec[3]['phi']['shift'] + 0.1
+    assert np.allclose(plan(vector),
+                       evaluate(rec, modelspec)['pred'].as_continuous())
+
+
+def test_evaluate_batch_matches_loop():
+    rng = np.random.RandomState(2)
+    rec, _ = _ln_data()
+    rec['state'] = rec['resp']._modified_copy(
+        np.vstack([np.ones(2000), rng.rand(2000)]), name='state')
+    modelspec = set_mean_phi(
+        from_keywords('wc.18x2.g-fir.2x15-lvl.1-stategain.2-dexp.1'))
+    plan = compile(rec, modelspec)
+    assert plan.can_batch()
+
+    vector = np.array(phi_to_vector([m['phi'] for m in modelspec]))
+    sigmas = vector + 0.05 * rng.randn(6, len(vector))
+    pred, errors = plan.evaluate_batch(sigmas, metric=nmse_batch)
+    assert pred.shape == (6, 1, 2000)
+    for p, e, sigma in zip(pred, errors, sigmas):
+        expected = plan(sigma)
+        assert np.allclose(p, expected)
+        data = rec.copy()
+        data['pred'] = data['resp']._modified_copy(expected, name='pred')
+        assert np.isclose(e, nmse(data))
+    assert np.allclose(mse_batch(pred, rec['resp'].as_continuous()),
+                       [np.mean((p - rec['resp'].as_continuous())**2)
+                        for p in pred])
+
+
+def test_benchmark_evaluate_batch(benchmark):
+    rng = np.random.RandomState(3)
+    rec, modelspec = _ln_data()
+    plan = compile(rec, modelspec)
+    vector = np.array(phi_to_vector([m['phi'] for m in modelspec]))
+    sigmas = vector + 0.05 * rng.randn(50, len(vector))
+    benchmark(plan.evaluate_batch, sigmas, metric=nmse_batch)
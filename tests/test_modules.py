@@ -1,5 +1,6 @@
-#import pytest
+import pytest
 import numpy as np
+import scipy.signal
 
 import nems.recording as recording
 import nems.signal as signal
@@ -67,6 +68,74 @@ def test_stp():
     # Y = stp._stp(X, u, tau)
 
 
+def _loop_stp(X, u, tau, fs):
+    # The per-sample loop _stp used before it had backends
+    tstim = X.copy()
+    tstim[np.isnan(tstim)] = 0
+    tstim[tstim < 0] = 0
+    ui = u.copy()
+    taui = np.absolute(tau.copy()) * fs
+    taui[taui < 2] = 2
+    rat = ui**2 / taui
+    ui[rat > 0.1] = np.sqrt(0.1 * taui[rat > 0.1])
+    stim_out = tstim
+    for i in range(X.shape[0]):
+        td = 1
+        a = 1/taui[i]
+        ustim = 1.0/taui[i] + ui[i] * tstim[i, :]
+        if ui[i] == 0:
+            continue
+        for tt in range(1, X.shape[1]):
+            delta = a - td * ustim[tt - 1]
+            if ui[i] > 0:
+                td = td + delta if td + delta > 0 else 0
+            else:
+                td = td + delta
+            stim_out[i, tt] *= td
+    stim_out[np.isnan(X)] = np.nan
+    return stim_out
+
+
+@pytest.mark.parametrize('backend', sorted(stp._BACKENDS))
+def test_stp_backends(backend):
+    rng = np.random.RandomState(0)
+    X = rng.randn(5, 1000)
+    X[:, 200:300] *= 20
+    X[1, 500:510] = np.nan
+    # depression, strong depression that reaches 0, passthru, facilitation
+    u = np.array([0.5, 5.0, 0.0, -0.1, -0.02])
+    tau = np.array([0.1, 0.02, 0.1, 0.1, 0.3])
+    expected = _loop_stp(X, u, tau, 100)
+    assert (expected[1, 1:] == 0).any()
+
+    Y = stp._stp(X, u, tau, fs=100, backend=backend)
+    np.testing.assert_allclose(Y, expected, rtol=1e-9, atol=1e-12)
+    np.testing.assert_array_equal(np.isnan(Y), np.isnan(X))
+    assert stp._stp(X.astype(np.float32), u, tau, fs=100,
+                    backend=backend).dtype == np.float32
+
+
+@pytest.mark.parametrize('backend', sorted(stp._BACKENDS))
+def test_stp_strong_depression(backend):
+    # steps far steeper than 1, whose products overflow within a block
+    rng = np.random.RandomState(1)
+    X = np.abs(rng.randn(1, 20000)) * 500
+    u = np.array([1.0])
+    tau = np.array([0.2])
+    expected = _loop_stp(X, u, tau, 100)
+    Y = stp._stp(X, u, tau, fs=100, backend=backend)
+    assert np.isfinite(Y).all()
+    np.testing.assert_allclose(Y, expected, rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('backend', sorted(stp._BACKENDS))
+def test_benchmark_stp(benchmark, backend):
+    X = np.random.rand(2, 20000)
+    u = np.array([0.1, -0.05])
+    tau = np.array([0.1, 0.2])
+    benchmark(stp._stp, X, u, tau, fs=100, backend=backend)
+
+
 def test_firbank():
     n_banks = 2
     bank_count = 3
@@ -90,6 +159,55 @@ def test_firbank():
     np.testing.assert_array_equal(y2, y)
 
 
+def _loop_per_channel(x, coefficients, bank_count=1):
+    # One lfilter per filter, started from get_zi as per_channel used to be
+    n_filters = len(coefficients)
+    n_banks = n_filters // bank_count
+    out = np.zeros((bank_count, x.shape[1]))
+    for f in range(n_filters):
+        c = coefficients[f]
+        x_ = x[f % len(x)]
+        r, _ = scipy.signal.lfilter(c, [1], x_, zi=fir.get_zi(c, x_))
+        out[f // n_banks] += r
+    return out
+
+
+@pytest.mark.parametrize('n_taps', [1, 15, fir.FFT_MIN_TAPS + 8])
+@pytest.mark.parametrize('n_in,bank_count', [(6, 1), (6, 3), (2, 3)])
+def test_per_channel_matches_lfilter(n_taps, n_in, bank_count):
+    x = np.random.randn(n_in, 500)
+    coefficients = np.random.randn(6, n_taps)
+    expected = _loop_per_channel(x, coefficients, bank_count)
+    y = fir.per_channel(x, coefficients, bank_count)
+    np.testing.assert_allclose(y, expected, rtol=1e-9, atol=1e-10)
+
+    out = np.full_like(expected, np.nan)
+    assert fir.per_channel(x, coefficients, bank_count, out=out) is out
+    np.testing.assert_allclose(out, expected, rtol=1e-9, atol=1e-10)
+
+    y32 = fir.per_channel(x.astype(np.float32), coefficients, bank_count)
+    assert y32.dtype == np.float32
+    np.testing.assert_allclose(y32, expected, rtol=1e-3, atol=1e-3)
+
+    # a nan blanks the n_taps samples from it on, as with lfilter
+    x[0, 200] = np.nan
+    expected = _loop_per_channel(x, coefficients, bank_count)
+    y = fir.per_channel(x, coefficients, bank_count)
+    np.testing.assert_array_equal(np.isnan(y), np.isnan(expected))
+    np.testing.assert_allclose(y, expected, rtol=1e-9, atol=1e-10)
+
+
+def test_per_channel_dimension_mismatch():
+    with pytest.raises(ValueError):
+        fir.per_channel(np.zeros((4, 10)), np.zeros((6, 5)), bank_count=3)
+
+
+def test_benchmark_per_channel(benchmark):
+    x = np.random.randn(18, 100000)
+    coefficients = np.random.randn(18, 15)
+    benchmark(fir.per_channel, x, coefficients)
+
+
 def test_fir_dexp():
 
     phi = np.array([[1, 0.3, 1, 3, 0.3, -0.75]])
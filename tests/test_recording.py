@@ -1,10 +1,14 @@
+import io
 from os.path import dirname, join
 
 import numpy as np
 import pandas as pd
 import pytest
-from nems.recording import Recording
-from nems.signal import RasterizedSignal
+import nems.configs.defaults
+from nems.recording import Recording, load_recording, \
+                           load_recording_from_targz_stream
+from nems.signal import RasterizedSignal, PointProcess, TiledSignal, \
+                        ChunkedRasterizedSignal, MaskSignal
 
 
 RECORDING_DIR = join(dirname(dirname(__file__)), 'recordings')
@@ -194,3 +198,198 @@ def test_recording_copy(recording):
     # Ensure we get a true copy of recording
     recording_copy = recording.copy()
     assert id(recording.signals) != id(recording_copy.signals)
+
+
+def test_recording_shares_epoch_table(recording, signal1):
+    # Equal epochs loaded separately end up in one shared table
+    table = recording['dummy_signal_1'].epoch_table
+    assert recording['dummy_signal_2'].epoch_table is table
+    assert recording['dummy_signal_1'].epochs.equals(signal1.epochs)
+
+    epochs = recording.epochs
+    assert recording.epochs is epochs
+    assert list(epochs['name']) == ['trial', 'pupil_closed',
+                                    'pupil_closed', 'trial2']
+
+    # New epochs on one signal are picked up, and code into the same names
+    sig = recording['dummy_signal_1']
+    sig.add_epoch('blink', np.array([[0.5, 0.6]]))
+    recording.add_signal(sig)
+    assert sig.epoch_table.names is table.names
+    assert recording.epochs is not epochs
+    assert 'blink' in set(recording.epochs['name'])
+    assert recording['dummy_signal_2'].epoch_table is table
+
+
+def test_recording_interval_masks(recording):
+    # epochs in samples: trial 3-200, pupil_closed 15-60 and 150-190
+    t = np.arange(250)
+    trial = (t >= 3) & (t < 200)
+    pupil = ((t >= 15) & (t < 60)) | ((t >= 150) & (t < 190))
+
+    rec = recording.create_mask('trial').or_mask('pupil_closed', invert=True)
+    assert isinstance(rec['mask'], MaskSignal)
+    assert rec['mask']._intervals.as_array() is rec['mask'].as_continuous()
+    assert np.array_equal(rec['mask'].as_continuous()[0], trial | ~pupil)
+
+    rec = recording.and_mask(['trial', 'pupil_closed'])
+    assert np.array_equal(rec['mask'].as_continuous()[0], trial | pupil)
+    assert np.array_equal(rec.get_epoch_indices('pupil_closed'),
+                          [[15, 60], [150, 190]])
+
+    # drop the second occurrence of pupil_closed
+    jack = rec.jackknife_mask_by_epoch(2, 1, 'pupil_closed')
+    expected = (trial | pupil) & ((t < 150) | (t >= 190))
+    assert np.array_equal(jack['mask'].as_continuous()[0], expected)
+    assert np.array_equal(jack.get_epoch_indices('pupil_closed'), [[15, 60]])
+
+    # a plain boolean mask signal gives the same result as a MaskSignal
+    dense = recording.copy()
+    dense.add_signal(jack['mask'].rasterize()._modified_copy(
+        np.array(jack['mask'].as_continuous()), name='mask'))
+    assert not isinstance(dense['mask'], MaskSignal)
+    for r in [jack, dense]:
+        masked = r.apply_mask()
+        assert np.array_equal(
+            masked['dummy_signal_1'].as_continuous(),
+            recording['dummy_signal_1'].as_continuous()[:, expected])
+
+
+def test_recording_save_load_binary(recording, tmpdir):
+    recording.meta = {'batch': 271}
+    loaded = load_recording_from_targz_stream(recording.as_targz())
+    for name, sig in recording.signals.items():
+        assert np.array_equal(loaded[name].as_continuous(),
+                              sig.as_continuous())
+    assert loaded.meta == recording.meta
+
+    directory = recording.save(str(tmpdir.join('rec')), uncompressed=True)
+    loaded = load_recording(directory)
+    assert set(loaded.signals) == set(recording.signals)
+    assert loaded.meta == recording.meta
+
+
+def test_load_recording_mmap(recording, tmpdir):
+    directory = recording.save(str(tmpdir.join('rec')), uncompressed=True)
+    loaded = load_recording(directory, mmap=True)
+    for name, sig in recording.signals.items():
+        data = loaded[name].as_continuous()
+        assert isinstance(data, np.memmap)
+        assert not data.flags.writeable
+        assert np.array_equal(data, sig.as_continuous())
+
+    # Derived signals are ordinary in-memory arrays
+    sig = loaded['dummy_signal_1']
+    scaled = sig.transform(lambda x: x * 2)
+    assert np.array_equal(scaled.as_continuous(),
+                          recording['dummy_signal_1'].as_continuous() * 2)
+
+    with pytest.raises(ValueError):
+        load_recording(str(tmpdir.join('rec.tgz')), mmap=True)
+
+
+def test_load_recording_chunked(recording, tmpdir):
+    directory = str(tmpdir.join('rec'))
+    recording.save_dir(directory, data_format='h5')
+    loaded = load_recording(directory, mmap=True)
+    for name, sig in recording.signals.items():
+        assert isinstance(loaded[name], ChunkedRasterizedSignal)
+        assert np.array_equal(loaded[name].as_continuous(),
+                              sig.as_continuous())
+
+
+def test_load_recording_dtype(recording, tmpdir, monkeypatch):
+    directory = recording.save(str(tmpdir.join('rec')), uncompressed=True)
+    loaded = load_recording(directory, dtype='float32')
+    for name, sig in recording.signals.items():
+        assert loaded[name].as_continuous().dtype == np.float32
+
+    monkeypatch.setattr(nems.configs.defaults, 'NEMS_SIGNAL_DTYPE', 'float32')
+    loaded = load_recording(directory)
+    assert loaded['dummy_signal_1'].as_continuous().dtype == np.float32
+    loaded = load_recording(directory, dtype='float64')
+    assert loaded['dummy_signal_1'].as_continuous().dtype == np.float64
+
+
+class _NonSeekableStream(io.RawIOBase):
+    '''
+    Minimal stand-in for an HTTP response body: readable, but neither
+    seekable nor able to report its length.
+    '''
+    def __init__(self, data):
+        self._buf = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._buf.readinto(b)
+
+
+def test_load_recording_from_targz_stream_nonseekable(recording):
+    fs = recording['dummy_signal_1'].fs
+    epochs = recording['dummy_signal_1'].epochs
+    spikes = PointProcess(fs=fs, name='spikes', recording='dummy_recording',
+                          data={'cell1': np.array([0.1, 0.5, 2.2]),
+                                'cell2': np.array([1.0, 4.9])},
+                          chans=['cell1', 'cell2'], epochs=epochs)
+    tiles = np.random.rand(3, 50)
+    tiled = TiledSignal(fs=fs, name='tiled', recording='dummy_recording',
+                        data={'trial2': tiles}, epochs=epochs)
+    recording.add_signal(spikes)
+    recording.add_signal(tiled)
+
+    tgz = recording.as_targz().read()
+    loaded = load_recording_from_targz_stream(_NonSeekableStream(tgz))
+
+    assert set(loaded.signals) == set(recording.signals)
+    assert np.array_equal(loaded['dummy_signal_1'].as_continuous(),
+                          recording['dummy_signal_1'].as_continuous())
+    assert np.array_equal(loaded['spikes'].as_continuous(),
+                          spikes.as_continuous())
+    assert np.array_equal(loaded['tiled']._data['trial2'], tiles)
+    assert loaded['dummy_signal_1'].epochs.equals(epochs)
+
+
+@pytest.fixture(scope='module')
+def many_signal_recording(tmpdir_factory):
+    '''
+    A synthetic recording with many CSV signals, saved both as a directory
+    and as a .tgz, for comparing serial and parallel loading.
+    '''
+    signals = {}
+    for i in range(24):
+        s = RasterizedSignal(fs=100, data=np.random.rand(4, 5000),
+                             name='sig{:02d}'.format(i), recording='many')
+        signals[s.name] = s
+    rec = Recording(signals)
+    base = tmpdir_factory.mktemp('many')
+    directory = str(base.mkdir('many'))
+    for s in signals.values():
+        s.save(directory, data_format='csv')
+    targz = rec.save_targz(str(base.join('many.tgz')))
+    return rec, directory, targz
+
+
+def test_load_recording_workers(many_signal_recording):
+    rec, directory, targz = many_signal_recording
+    for uri in [directory, targz]:
+        loaded = load_recording(uri, workers=4)
+        assert sorted(loaded.signals) == sorted(rec.signals)
+        for name, sig in rec.signals.items():
+            assert np.allclose(loaded[name].as_continuous(),
+                               sig.as_continuous())
+
+
+@pytest.mark.parametrize('workers', [None, 4])
+def test_benchmark_load_recording_dir(benchmark, many_signal_recording,
+                                      workers):
+    _, directory, _ = many_signal_recording
+    benchmark(load_recording, directory, workers=workers)
+
+
+@pytest.mark.parametrize('workers', [None, 4])
+def test_benchmark_load_recording_targz(benchmark, many_signal_recording,
+                                        workers):
+    _, _, targz = many_signal_recording
+    benchmark(load_recording, targz, workers=workers)
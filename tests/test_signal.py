@@ -1,5 +1,7 @@
 import os
+import gc
 import json
+import pickle
 import filecmp
 import pytest
 import numpy as np
@@ -7,6 +9,9 @@ from numpy import nan
 import pandas as pd
 import nems.signal
 from nems.signal import RasterizedSignal, merge_selections, _string_syntax_valid
+from nems.signal import RasterizedSignalSubset, join_signal_subsets, \
+    split_signal_to_subsets
+from nems.epoch import IntervalMask
 
 
 @pytest.fixture()
@@ -94,6 +99,151 @@ def test_epoch_save_load(signal, signal_tmpdir):
     assert before.equals(after)
 
 
+def test_signal_save_load_binary(signal, tmpdir):
+    '''
+    Test that the default binary format round-trips data exactly,
+    including non-float dtypes
+    '''
+    data = np.random.randn(3, 200)
+    sig = signal._modified_copy(data)
+    datafile, jsonfile, _ = sig.save(str(tmpdir))
+    assert datafile.endswith('.npy')
+    with open(jsonfile) as f:
+        js = json.load(f)
+    assert js['data_format'] == 'npy'
+    assert js['format_version'] == nems.signal.SIGNAL_FORMAT_VERSION
+
+    loaded = nems.signal.load_signal(os.path.splitext(datafile)[0])
+    assert np.array_equal(loaded.as_continuous(), data)
+
+    mask = signal._modified_copy(data > 0)
+    streams = mask.as_file_streams()
+    data_stream = [v for k, v in streams.items() if k.endswith('.npy')][0]
+    json_stream = [v for k, v in streams.items() if k.endswith('.json')][0]
+    json_stream.seek(0)
+    loaded = nems.signal.load_signal_from_streams(data_stream, json_stream)
+    assert loaded.as_continuous().dtype == bool
+    assert np.array_equal(loaded.as_continuous(), data > 0)
+
+
+class _SliceRecorder:
+    '''Wraps an array-like and records the time slices read from it.'''
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+        self.shape = data.shape
+        self.dtype = data.dtype
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and isinstance(key[-1], slice):
+            self.reads.append(key[-1])
+        return self.data[key]
+
+
+def test_chunked_signal(signal, tmpdir):
+    datafile, _, _ = signal.save(str(tmpdir), data_format='h5')
+    assert datafile.endswith('.h5')
+    basepath = os.path.splitext(datafile)[0]
+
+    loaded = nems.signal.load_signal(basepath)
+    assert type(loaded) is RasterizedSignal
+    assert np.array_equal(loaded.as_continuous(), signal.as_continuous())
+
+    chunked = nems.signal.load_signal(basepath, mmap=True)
+    assert isinstance(chunked, nems.signal.ChunkedRasterizedSignal)
+    assert chunked.shape == signal.shape
+    assert np.array_equal(chunked.as_continuous(), signal.as_continuous())
+
+    times = np.array([[0.1, 0.5], [2, 3]])
+    assert np.array_equal(chunked.select_times(times).as_continuous(),
+                          signal.select_times(times).as_continuous())
+    assert np.array_equal(chunked.extract_epoch('pupil_closed'),
+                          signal.extract_epoch('pupil_closed'),
+                          equal_nan=True)
+
+    mask = signal._modified_copy(np.zeros((1, signal.ntimes), dtype=bool))
+    mask = mask.epoch_to_signal('pupil_closed')
+    assert np.array_equal(chunked.as_continuous(mask),
+                          signal.as_continuous(mask))
+    assert np.array_equal(chunked.get_epoch_indices('trial', mask=mask),
+                          signal.get_epoch_indices('trial', mask=mask))
+
+    # Windowed reads only ask the store for the requested samples
+    chunked._dataset = _SliceRecorder(chunked._dataset)
+    chunked.extract_epoch('pupil_closed')
+    chunked.select_times(times)
+    chunked.as_continuous(mask)
+    reads = chunked._dataset.reads
+    assert reads
+    assert max(r.stop - r.start for r in reads) <= 50
+
+
+def test_chunked_signal_pickle(signal, tmpdir):
+    datafile, _, _ = signal.save(str(tmpdir), data_format='h5')
+    chunked = nems.signal.load_signal(os.path.splitext(datafile)[0],
+                                      mmap=True)
+    unpickled = pickle.loads(pickle.dumps(chunked))
+    assert isinstance(unpickled, nems.signal.ChunkedRasterizedSignal)
+    assert np.array_equal(unpickled.as_continuous(), signal.as_continuous())
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'),
+                    reason='lists open files through /proc')
+def test_chunked_signal_closes_file(signal, tmpdir):
+    datafile, _, _ = signal.save(str(tmpdir), data_format='h5')
+    basepath = os.path.splitext(datafile)[0]
+
+    def open_files():
+        return [f for f in os.listdir('/proc/self/fd')
+                if os.path.realpath('/proc/self/fd/' + f) == datafile]
+
+    chunked = nems.signal.load_signal(basepath, mmap=True)
+    copied = chunked.copy()
+    assert len(open_files()) == 1
+    # copies share the file, which stays open until the last is dropped
+    del chunked
+    gc.collect()
+    assert np.array_equal(copied.as_continuous(), signal.as_continuous())
+    del copied
+    gc.collect()
+    assert open_files() == []
+
+    chunked = nems.signal.load_signal(basepath, mmap=True)
+    chunked.close()
+    assert open_files() == []
+
+
+def test_signal_astype(signal):
+    single = signal.astype('float32')
+    assert single.as_continuous().dtype == np.float32
+    assert np.allclose(single.as_continuous(), signal.as_continuous())
+    assert signal.astype('float64') is signal
+
+    # float64 parameters must not promote float32 data back to float64
+    scaled = single.transform(lambda x: x * np.array([2.0]))
+    assert scaled.as_continuous().dtype == np.float32
+
+    mask = signal._modified_copy(signal.as_continuous() > 0)
+    assert mask.astype('float32').as_continuous().dtype == bool
+
+
+def test_signal_load_legacy_csv(signal, tmpdir):
+    '''
+    Test that signals saved in the CSV text format can still be loaded
+    '''
+    datafile, jsonfile, _ = signal.save(str(tmpdir), data_format='csv')
+    # Sidecars written before the binary format existed had no version info
+    with open(jsonfile) as f:
+        js = json.load(f)
+    del js['data_format']
+    del js['format_version']
+    with open(jsonfile, 'w') as f:
+        json.dump(js, f)
+
+    loaded = nems.signal.load_signal(os.path.splitext(datafile)[0])
+    assert np.all(signal.as_continuous() == loaded.as_continuous())
+
+
 def test_as_continuous(signal):
     assert signal.as_continuous().shape == (3, 200)
 
@@ -382,7 +532,400 @@ def test_rasterized_signal_subset(signal):
     assert subset.average_epoch('pupil_closed').shape == (3, 45)
 
 
+def test_rasterized_signal_subset_views(signal):
+    data = signal.as_continuous()
+    times = [(0, 0.2), (0.3, 2), (3, 3.5)]
+    subset = signal.select_times(times)
+    expected = np.concatenate([data[:, 0:10], data[:, 15:100],
+                               data[:, 150:175]], axis=1)
+    assert isinstance(subset, RasterizedSignalSubset)
+    assert subset.ntimes == 120
+    assert all(np.shares_memory(s, data) for s in subset._subsets)
+    assert np.array_equal(subset.as_continuous(), expected)
+
+    # cutting a subset again still only makes views
+    again = subset.select_times([(0.1, 0.5), (2.2, 2.3)])
+    assert all(np.shares_memory(s, data) for s in again._subsets)
+    assert np.array_equal(again.as_continuous(),
+                          expected[:, np.r_[5:25, 110:115]])
+    l, r = subset.split_at_time(0.5)
+    assert np.array_equal(l.as_continuous(), expected[:, :60])
+    assert np.array_equal(r.as_continuous(), expected[:, 60:])
+    jsig = subset.jackknife_by_time(4, 1, excise=True)
+    assert np.array_equal(jsig.as_continuous(),
+                          np.delete(expected, np.s_[30:60], axis=-1))
+    isig = subset.jackknife_by_time(4, 1, invert=True, excise=True)
+    assert np.array_equal(isig.as_continuous(), expected[:, 30:60])
+
+    # pickling and transforming segment by segment
+    assert np.array_equal(pickle.loads(pickle.dumps(subset)).as_continuous(),
+                          expected)
+    fn = lambda x: 2 * x[:2] + 1
+    y = subset.transform(fn, 'y', segmentwise=True)
+    assert isinstance(y, RasterizedSignalSubset)
+    assert y.name == 'y'
+    assert np.array_equal(y.as_continuous(), fn(expected))
+    assert np.array_equal(subset.transform(fn).as_continuous(), fn(expected))
+
+
+def test_join_split_signal_subsets(signal):
+    times = np.array([(0, 0.2), (0.3, 2), (3, 3.5)])
+    subset = signal.select_times(times)
+    parts = split_signal_to_subsets(subset)
+    assert [p.ntimes for p in parts] == [10, 85, 25]
+    assert all(np.array_equal(p.segments, t[np.newaxis]) for p, t
+               in zip(parts, times))
+    joined = join_signal_subsets(parts)
+    assert np.array_equal(joined.as_continuous(), subset.as_continuous())
+    assert np.array_equal(joined.segments, times)
+    assert np.array_equal(joined.extract_epoch('pupil_closed'),
+                          subset.extract_epoch('pupil_closed'))
+    assert split_signal_to_subsets(signal) == [signal]
+    with pytest.raises(ValueError):
+        join_signal_subsets([signal, signal.extract_channels(['chan0'])])
+
+
 def test_epoch_to_signal(signal):
     s = signal.epoch_to_signal('pupil_closed')
     assert s.as_continuous().shape == (1, 200)
     assert s.as_continuous().sum() == 85
+
+
+def _loop_raster(event_times, fs, max_bin):
+    '''The original per-spike binning, kept as a reference.'''
+    cellids = sorted(event_times)
+    raster = np.zeros([len(cellids), max_bin])
+    for i, key in enumerate(cellids):
+        for t in event_times[key]:
+            b = int(np.floor(t*fs))
+            if b < max_bin:
+                raster[i, b] += 1
+    return raster
+
+
+def _point_process(n_spikes, n_units=10, duration=100, seed=0):
+    rng = np.random.RandomState(seed)
+    data = {'unit{}'.format(i): np.sort(rng.rand(n_spikes // n_units)
+                                        * duration)
+            for i in range(n_units)}
+    return nems.signal.PointProcess(fs=100, data=data, name='spikes',
+                                    recording='rec')
+
+
+def test_point_process_rasterize():
+    sig = _point_process(20000, duration=10)
+    # Spikes beyond the last epoch are dropped
+    sig = sig._modified_copy(sig._data, epochs=pd.DataFrame(
+        {'start': [0], 'end': [9.5], 'name': ['TRIAL']}))
+    for fs in [100, 33]:
+        raster = sig.rasterize(fs).as_continuous()
+        assert np.array_equal(raster, _loop_raster(sig._data, fs,
+                                                   raster.shape[1]))
+
+    # Memoized per fs, and discarded when epochs change
+    assert sig.rasterize() is sig.rasterize()
+    assert sig.rasterize(50) is not sig.rasterize()
+    before = sig.rasterize()
+    sig.add_epoch('extra', np.array([[0, 20]]))
+    after = sig.rasterize()
+    assert after is not before
+    assert after.shape[1] == 2000
+
+
+def test_benchmark_point_process_rasterize(benchmark):
+    sig = _point_process(10**7)
+    # Build a fresh copy each round so the memoized raster is not reused
+    raster = benchmark(lambda: sig._modified_copy(sig._data).rasterize())
+    assert raster.as_continuous().sum() == 10**7
+
+
+def _replace_epochs_raster(sig):
+    '''The original replace_epochs based rasterization, kept as a reference.'''
+    z = np.zeros([sig.nchans, sig.shape[1]])
+    zsig = nems.signal.RasterizedSignal(fs=sig.fs, data=z, name=sig.name,
+                                        recording=sig.recording,
+                                        epochs=sig.epochs)
+    data = zsig.replace_epochs(sig._data).as_continuous().copy()
+    data[np.isnan(data)] = 0
+    return data
+
+
+def test_tiled_signal_rasterize():
+    rng = np.random.RandomState(0)
+    starts = np.arange(0, 20, 0.5)
+    epochs = pd.DataFrame({
+        'start': np.concatenate([starts, [3.2, 30]]),
+        'end': np.concatenate([starts + 0.4, [3.9, 31]]),
+        'name': ['stimA', 'stimB'] * 20 + ['stimC', 'SILENCE']})
+    tiles = {'stimA': rng.rand(3, 30), 'stimB': rng.rand(3, 50),
+             'stimC': rng.rand(3, 70)}
+    tiles['stimB'][1, 5:9] = np.nan
+    sig = nems.signal.TiledSignal(fs=100, data=tiles, name='stim',
+                                  recording='rec', epochs=epochs)
+
+    raster = sig.as_continuous()
+    assert raster.shape == (3, 3100)
+    assert np.array_equal(raster, _replace_epochs_raster(sig))
+
+    # Memoized, and discarded when epochs change
+    assert sig.rasterize() is sig.rasterize()
+    before = sig.rasterize()
+    sig.add_epoch('stimC', np.array([[10.05, 10.35]]))
+    assert sig.rasterize() is not before
+    assert np.array_equal(sig.as_continuous(), _replace_epochs_raster(sig))
+
+
+def test_epoch_index_shared(signal):
+    index = signal._get_epoch_index()
+    assert np.array_equal(signal.get_epoch_bounds('pupil_closed'),
+                          [[0.3, 1.2], [3.0, 3.8]])
+
+    # Copies that keep the epochs reuse the index; new epochs rebuild it
+    copied = signal._modified_copy(signal.as_continuous() * 2)
+    assert copied._get_epoch_index() is index
+    signal.add_epoch('blink', np.array([[0.5, 0.6]]))
+    assert signal._get_epoch_index() is not index
+    assert signal.epoch_names_matching('^b') == ['blink']
+    assert copied.epoch_names_matching('^b') == []
+
+
+def _loop_epoch_indices(sig, bounds, mask=None):
+    '''The original per-epoch conversion to indices, kept as a reference.'''
+    s = e = o = 0
+    indices = []
+    while s < len(sig.segments) and e < len(bounds):
+        s_lb, s_ub = sig.segments[s]
+        while True:
+            e_lb, e_ub = bounds[e]
+            if s_lb <= e_lb < s_ub:
+                indices.append((round((e_lb-s_lb)*sig.fs) + o,
+                                round((e_ub-s_lb)*sig.fs) + o))
+                e += 1
+            else:
+                s += 1
+                o += round((s_ub-s_lb)*sig.fs)
+                break
+            if e >= len(bounds):
+                break
+    indices = np.asarray(indices, dtype='i')
+    if mask is not None:
+        m_data = mask.as_continuous()
+        keepidx = [i for i, (lb, ub) in enumerate(indices)
+                   if np.all(m_data[0, lb:ub])]
+        indices = indices[np.array(keepidx)] if keepidx else np.array([])
+    return indices
+
+
+def _many_epochs_signal(n_epochs, fs=100, seed=0):
+    rng = np.random.RandomState(seed)
+    start = np.sort(rng.randint(0, n_epochs * 20, n_epochs)) / fs
+    epochs = pd.DataFrame({'start': start,
+                           'end': start + rng.randint(1, 60, n_epochs) / fs,
+                           'name': rng.choice(['a', 'b'], n_epochs)})
+    ntimes = n_epochs * 20 + 60
+    data = rng.rand(1, ntimes)
+    mask = RasterizedSignal(fs=fs, data=rng.rand(1, ntimes) > 0.001,
+                            name='mask', recording='rec', epochs=epochs)
+    sig = RasterizedSignal(fs=fs, data=data, name='resp', recording='rec',
+                           epochs=epochs)
+    return sig, mask
+
+
+def test_get_epoch_indices_matches_loop():
+    sig, mask = _many_epochs_signal(2000)
+    segmented = sig._modified_copy(sig.as_continuous(), segments=np.array(
+        [[0, 80.005], [100.3, 250], [250, 300], [310, 500]]))
+    for s in [sig, segmented]:
+        for name in ['a', 'b', 'missing']:
+            for boundary_mode in ['exclude', 'trim']:
+                bounds = s.get_epoch_bounds(name, boundary_mode)
+                for m in [None, mask]:
+                    expected = _loop_epoch_indices(s, bounds, m)
+                    result = s.get_epoch_indices(name, boundary_mode, mask=m)
+                    assert result.dtype == expected.dtype
+                    assert np.array_equal(result, expected)
+
+
+def test_benchmark_get_epoch_indices(benchmark):
+    sig, mask = _many_epochs_signal(10**5)
+    sig.get_epoch_bounds('a')
+    indices = benchmark(sig.get_epoch_indices, 'a', mask=mask)
+    assert np.array_equal(indices, _loop_epoch_indices(
+        sig, sig.get_epoch_bounds('a'), mask))
+
+
+def _loop_epoch_mask(ntimes, bounds, onsets_only=False):
+    mask = np.zeros([1, ntimes], dtype=bool)
+    for lb, ub in bounds:
+        if onsets_only:
+            mask[:, lb] = True
+        else:
+            mask[:, lb:ub] = True
+    return mask
+
+
+def test_generate_epoch_mask_matches_loop():
+    sig, _ = _many_epochs_signal(2000)
+    n = sig.ntimes
+    a, b = sig.get_epoch_indices('a'), sig.get_epoch_indices('b')
+    rng = np.random.RandomState(0)
+    slices = rng.randint(-n - 10, n + 10, (50, 2))
+    cases = [('a', a), (['a', 'b'], np.concatenate([a, b])),
+             (slices, slices), ([tuple(s) for s in slices], slices),
+             (None, []), (False, []), (True, [(0, n)])]
+    for epoch, bounds in cases:
+        assert np.array_equal(sig.generate_epoch_mask(epoch),
+                              _loop_epoch_mask(n, bounds))
+        assert sig.generate_epoch_intervals(epoch).equals(
+            IntervalMask.from_array(_loop_epoch_mask(n, bounds)))
+    for idx in [rng.randint(-n, n, 100), rng.rand(n) > 0.5]:
+        expected = np.zeros([1, n], dtype=bool)
+        expected[0, idx] = True
+        assert np.array_equal(sig.generate_epoch_mask(idx), expected)
+
+    merged = sig.get_epoch_indices('a', fix_overlap='merge')
+    for onsets_only in [False, True]:
+        result = sig.epoch_to_signal('a', onsets_only=onsets_only, shift=3)
+        expected = np.roll(_loop_epoch_mask(n, merged, onsets_only), 3, axis=1)
+        assert np.array_equal(result.as_continuous(), expected)
+
+
+def test_benchmark_epoch_to_signal(benchmark):
+    sig, _ = _many_epochs_signal(10**5)
+    sig.get_epoch_indices('a')
+    result = benchmark(sig.epoch_to_signal, 'a')
+    assert np.array_equal(result.as_continuous(), _loop_epoch_mask(
+        sig.ntimes, sig.get_epoch_indices('a', fix_overlap='merge')))
+
+
+def _loop_extract_epoch(sig, indices):
+    data = sig.as_continuous()
+    n_samples = np.max(indices[:, 1] - indices[:, 0])
+    fill = False if data.dtype == bool else np.nan
+    epoch_data = np.full((len(indices), data.shape[0], n_samples), fill,
+                         dtype=bool if data.dtype == bool else float)
+    for i, (lb, ub) in enumerate(indices):
+        ub = min(ub, data.shape[-1])
+        epoch_data[i, ..., :ub-lb] = data[..., lb:ub]
+    return epoch_data
+
+
+def test_extract_epoch_matches_loop():
+    sig, mask = _many_epochs_signal(500)
+    sig = sig._modified_copy(np.random.RandomState(0).rand(3, sig.ntimes))
+    n = sig.ntimes
+    cases = [np.array([[10, 30], [30, 50], [50, 70]]),   # evenly spaced
+             np.array([[5, 25], [40, 60], [41, 61]]),    # same length
+             np.array([[5, 25], [40, 47], [n - 5, n + 15]])]
+    for indices in cases:
+        expected = _loop_extract_epoch(sig, indices)
+        for copy in [True, False]:
+            result = sig.extract_epoch(indices, copy=copy)
+            assert result.dtype == expected.dtype
+            assert np.array_equal(result, expected, equal_nan=True)
+    # only evenly spaced occurrences of the same length come back as a view
+    view = sig.extract_epoch(cases[0], copy=False)
+    assert np.shares_memory(view, sig.as_continuous())
+    assert not view.flags.writeable
+    assert sig.extract_epoch(cases[0]).flags.writeable
+    assert not np.shares_memory(sig.extract_epoch(cases[1], copy=False),
+                                sig.as_continuous())
+
+    bools = mask.extract_epoch(cases[2])
+    assert bools.dtype == bool
+    assert np.array_equal(bools, _loop_extract_epoch(mask, cases[2]))
+
+    for copy in [True, False]:
+        for m in [None, mask]:
+            result = sig.extract_epochs(['b', 'missing', 'a'], mask=m,
+                                        copy=copy)
+            assert list(result) == ['b', 'a']
+            for name, v in result.items():
+                expected = _loop_extract_epoch(sig, sig.get_epoch_indices(
+                    name, fix_overlap='first', mask=m))
+                assert np.array_equal(v, expected, equal_nan=True)
+
+
+def test_benchmark_extract_epochs(benchmark):
+    rng = np.random.RandomState(0)
+    fs, n_stim, n_reps, length = 100, 50, 20, 150
+    start = rng.permutation(n_stim * n_reps) * length
+    epochs = pd.DataFrame({'start': start / fs,
+                           'end': (start + length) / fs,
+                           'name': np.tile(['STIM_{}'.format(i)
+                                            for i in range(n_stim)], n_reps)})
+    sig = RasterizedSignal(fs=fs, data=rng.rand(10, n_stim * n_reps * length),
+                           name='resp', recording='rec', epochs=epochs)
+    names = sig.epoch_names_matching('^STIM_')
+    folded = benchmark(sig.extract_epochs, names)
+    for name in names[:3]:
+        assert np.array_equal(folded[name], _loop_extract_epoch(
+            sig, sig.get_epoch_indices(name, fix_overlap='first')))
+
+
+def _loop_replace_epochs(sig, epoch_dict, preserve_nan=True):
+    data = sig.as_continuous().copy()
+    nan_bins = np.isnan(data[0, :])
+    for epoch, epoch_data in epoch_dict.items():
+        indices = sig.get_epoch_indices(epoch)
+        for ii, (lb, ub) in enumerate(indices):
+            if epoch_data.ndim == 2:
+                ub = min(ub, lb + epoch_data.shape[1])
+                data[:, lb:ub] = epoch_data[:, :(ub-lb)]
+            else:
+                data[:, lb:ub] = epoch_data[ii, :, :ub-lb]
+    if preserve_nan:
+        data[:, nan_bins] = np.nan
+    return data
+
+
+def test_replace_epochs_matches_loop():
+    sig, _ = _many_epochs_signal(300)
+    rng = np.random.RandomState(0)
+    data = rng.rand(2, sig.ntimes)
+    data[:, rng.rand(sig.ntimes) < 0.05] = np.nan
+    sig = sig._modified_copy(data)
+    # 'a' and 'b' overlap each other and themselves
+    n_a = len(sig.get_epoch_indices('a'))
+    length_b = np.max(np.diff(sig.get_epoch_indices('b'), axis=1))
+    cases = [{'a': rng.rand(2, 30)},
+             {'a': rng.rand(2, 70), 'b': rng.rand(2, 10)},
+             {'b': rng.rand(2, 5), 'a': rng.rand(n_a, 2, 60)},
+             {'b': rng.rand(1, 5)},
+             {'missing': rng.rand(2, 5)}]
+    for epoch_dict in cases:
+        for preserve_nan in [True, False]:
+            result = sig.replace_epochs(epoch_dict, preserve_nan)
+            expected = _loop_replace_epochs(sig, epoch_dict, preserve_nan)
+            assert np.array_equal(result.as_continuous(), expected,
+                                  equal_nan=True)
+
+    folded = sig.extract_epoch('b', fix_overlap=None)
+    assert np.array_equal(sig.replace_epoch('b', folded).as_continuous(),
+                          _loop_replace_epochs(sig, {'b': folded}),
+                          equal_nan=True)
+    with pytest.raises(ValueError):
+        sig.replace_epoch('b', rng.rand(2, length_b))
+    with pytest.raises(IndexError):
+        sig.replace_epochs({'a': rng.rand(n_a - 1, 2, 60)})
+
+
+def test_benchmark_replace_epochs(benchmark):
+    sig, _ = _many_epochs_signal(10**5)
+    psth = {'a': np.ones((1, 40)), 'b': np.zeros((1, 40))}
+    sig.get_epoch_indices('a')
+    result = benchmark(sig.replace_epochs, psth)
+    assert np.array_equal(result.as_continuous(),
+                          _loop_replace_epochs(sig, psth), equal_nan=True)
+
+
+def test_benchmark_select_times(benchmark):
+    rng = np.random.RandomState(0)
+    fs = 100
+    sig = RasterizedSignal(fs, rng.rand(20, 10**6), 'x', 'rec')
+    starts = np.arange(0, 10**6 - 400, 500)
+    times = np.stack([starts, starts + 400], axis=1) / fs
+    result = benchmark(sig.select_times, times)
+    assert result.ntimes == 400 * len(starts)
+    assert np.array_equal(result._segments_between(800, 1200)[0],
+                          sig.as_continuous()[:, 1000:1400])
@@ -0,0 +1,223 @@
+import io
+import os
+import json
+import threading
+import functools
+import multiprocessing
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler, \
+    BaseHTTPRequestHandler
+
+import numpy as np
+import pytest
+
+import nems.configs.defaults
+import nems.uri
+from nems.uri import load_resource, cache_stats, reset_cache_stats, \
+    get_session
+from nems.recording import Recording, load_recording, \
+    load_recording_from_targz_stream
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def http_dir(tmpdir):
+    '''
+    Serves a temporary directory over HTTP, yielding (directory, base URL).
+    '''
+    served = tmpdir.mkdir('served')
+    handler = functools.partial(_QuietHandler, directory=str(served))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield str(served), 'http://127.0.0.1:{}/'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def cache_dir(tmpdir, monkeypatch):
+    d = str(tmpdir.join('cache'))
+    monkeypatch.setattr(nems.configs.defaults, 'NEMS_CACHE_DIR', d)
+    monkeypatch.setattr(nems.configs.defaults, 'NEMS_CACHE_MAX_AGE', 0)
+    reset_cache_stats()
+    return d
+
+
+def _write_json(path, obj, mtime=None):
+    with open(path, 'w') as f:
+        json.dump(obj, f)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_load_resource_cached(http_dir, cache_dir):
+    served, url = http_dir
+    _write_json(os.path.join(served, 'ms.json'), {'a': 1}, mtime=1e9)
+
+    assert load_resource(url + 'ms.json') == {'a': 1}
+    assert load_resource(url + 'ms.json') == {'a': 1}
+    stats = cache_stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+
+    # A changed file on the server must be fetched again
+    _write_json(os.path.join(served, 'ms.json'), {'a': 2}, mtime=2e9)
+    assert load_resource(url + 'ms.json') == {'a': 2}
+    assert cache_stats()['misses'] == 2
+
+
+def test_cache_dedupes_by_content(http_dir, cache_dir):
+    served, url = http_dir
+    _write_json(os.path.join(served, 'x.json'), {'a': 1})
+    _write_json(os.path.join(served, 'y.json'), {'a': 1})
+    load_resource(url + 'x.json')
+    load_resource(url + 'y.json')
+
+    index = nems.uri._read_cache_index(cache_dir)
+    assert index[url + 'x.json']['sha256'] == index[url + 'y.json']['sha256']
+
+
+def test_cache_lru_eviction(http_dir, cache_dir, monkeypatch):
+    served, url = http_dir
+    for name in ['a', 'b', 'c']:
+        _write_json(os.path.join(served, name + '.json'), {name: [0]*20})
+    monkeypatch.setattr(nems.configs.defaults, 'NEMS_CACHE_MAX_BYTES', 150)
+
+    load_resource(url + 'a.json')
+    load_resource(url + 'b.json')
+    load_resource(url + 'a.json')  # b is now least recently used
+    load_resource(url + 'c.json')
+
+    index = nems.uri._read_cache_index(cache_dir)
+    assert set(index) == {url + 'a.json', url + 'c.json'}
+    assert cache_stats()['evictions'] == 1
+
+
+def _load_all(urls):
+    for u in urls:
+        load_resource(u)
+
+
+def test_cache_shared_between_processes(http_dir, cache_dir):
+    served, url = http_dir
+    names = ['r{}'.format(i) for i in range(40)]
+    for name in names:
+        _write_json(os.path.join(served, name + '.json'), {name: 1})
+
+    # each process indexes its own URLs; none may be lost
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_load_all,
+                           args=([url + n + '.json' for n in names[i::4]],))
+               for i in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+        assert w.exitcode == 0
+
+    index = nems.uri._read_cache_index(cache_dir)
+    assert set(index) == {url + n + '.json' for n in names}
+
+
+def test_cache_disabled(http_dir, cache_dir, monkeypatch):
+    served, url = http_dir
+    monkeypatch.setattr(nems.configs.defaults, 'NEMS_CACHE_DIR', None)
+    _write_json(os.path.join(served, 'ms.json'), {'a': 1})
+
+    assert load_resource(url + 'ms.json') == {'a': 1}
+    assert load_resource(url + 'ms.json') == {'a': 1}
+    assert cache_stats()['hits'] == 0
+    assert not os.path.exists(cache_dir)
+
+
+def test_load_recording_url_cached(http_dir, cache_dir):
+    served, url = http_dir
+    data = np.random.rand(2, 50)
+    rec = Recording.load_from_arrays([data], 'cached_rec', 100,
+                                     sig_names=['resp'])
+    with open(os.path.join(served, 'cached_rec.tgz'), 'wb') as f:
+        f.write(rec.as_targz().read())
+
+    rec1 = load_recording(url + 'cached_rec.tgz')
+    rec2 = Recording.load_url(url + 'cached_rec.tgz')
+    assert cache_stats()['misses'] == 1
+    assert cache_stats()['hits'] == 1
+    assert np.array_equal(rec1['resp'].as_continuous(), data)
+    assert np.array_equal(rec2['resp'].as_continuous(), data)
+
+
+class _PutHandler(BaseHTTPRequestHandler):
+    '''
+    Records PUT bodies on the server, answering 503 to the first
+    server.failures of them.
+    '''
+    def log_message(self, *args):
+        pass
+
+    def do_PUT(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if size == 0:
+                    break
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append((dict(self.headers), body))
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.send_response(503)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+@pytest.fixture()
+def put_server(monkeypatch):
+    monkeypatch.setattr(nems.configs.defaults, 'NEMS_HTTP_BACKOFF', 0)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _PutHandler)
+    server.received = []
+    server.failures = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, 'http://127.0.0.1:{}/'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_session_is_shared():
+    assert get_session() is get_session()
+    assert get_session(retry=False) is not get_session()
+
+
+def test_iter_targz_matches_as_targz():
+    data = np.random.rand(3, 40)
+    rec = Recording.load_from_arrays([data], 'chunked_rec', 100,
+                                     sig_names=['resp'])
+    chunks = list(rec.iter_targz())
+    assert len(chunks) > 1
+    for tgz in [io.BytesIO(b''.join(chunks)), rec.as_targz()]:
+        loaded = load_recording_from_targz_stream(tgz)
+        assert np.array_equal(loaded['resp'].as_continuous(), data)
+
+
+def test_save_url_streams_with_retry(put_server):
+    server, url = put_server
+    server.failures = 1
+    data = np.random.rand(3, 40)
+    rec = Recording.load_from_arrays([data], 'upload_rec', 100,
+                                     sig_names=['resp'])
+
+    assert rec.save_url(url + 'upload_rec.tgz') == url + 'upload_rec.tgz'
+    assert len(server.received) == 2
+    headers, body = server.received[-1]
+    assert headers['Transfer-Encoding'] == 'chunked'
+    loaded = load_recording_from_targz_stream(io.BytesIO(body))
+    assert np.array_equal(loaded['resp'].as_continuous(), data)